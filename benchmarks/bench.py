@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Benchmark Harness - Drives mcp_handler end to end for every tool
+
+Each tool runs in its own fresh process so cold start and peak RSS are
+per tool. Requests go through the Starlette app as raw ASGI calls (JSON-RPC
+body in, response bytes out), so routing, the worker pool, the result
+cache and JSON encoding are all measured. The stdio server is timed
+separately as a desktop client sees it: launch, tools/list, first call.
+
+    python benchmarks/synthetic_gtfs.py /tmp/gtfs --preset medium
+    python benchmarks/bench.py --data /tmp/gtfs --cache /tmp/gtfs-cache --json bench.json
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent / "statcan_transit_mcp"
+
+# Pseudo-tool: its scenario is a list of (tool, arguments) sent as one JSON-RPC batch
+BATCH = "batch"
+
+
+def scenarios(data_dir: Path) -> Dict[str, Dict]:
+    """Tool name -> arguments, using IDs and coordinates from the first agency in the data dir"""
+    agency = sorted(d.name for d in data_dir.iterdir() if d.is_dir())[0]
+    with open(data_dir / agency / "stops.txt", 'r', encoding='utf-8') as f:
+        stops = [row for _, row in zip(range(500), csv.DictReader(f))]
+    stop = next((row for row in stops if row.get('location_type', '0') in ('', '0')), stops[0])
+    lat, lon = float(stop['stop_lat']), float(stop['stop_lon'])
+    with open(data_dir / agency / "routes.txt", 'r', encoding='utf-8') as f:
+        route = next(csv.DictReader(f))
+    # Served stops a few trips apart, so the journey needs more than one ride
+    with open(data_dir / agency / "stop_times.txt", 'r', encoding='utf-8') as f:
+        stop_times = [row for _, row in zip(range(200), csv.DictReader(f))]
+    return {
+        "describe_dataset": {},
+        "list_agencies": {"query": "transit"},
+        "get_agency_files": {"agency_id": agency},
+        "query_data": {"agency_id": agency, "file_name": "stop_times.txt", "limit": 1000},
+        "find_stops_near": {"lat": lat, "lon": lon, "radius_m": 1000},
+        "find_stops_in_bbox": {"min_lat": lat - 0.02, "min_lon": lon - 0.02, "max_lat": lat + 0.02, "max_lon": lon + 0.02},
+        "next_departures": {"agency_id": agency, "stop_id": stop['stop_id'], "date": "2026-03-04", "time": "08:00"},
+        "search": {"query": "Yonge"},
+        "aggregate": {"file_name": "routes.txt", "group_by": "route_type"},
+        "get_route_geometry": {"agency_id": agency, "route_id": route['route_id'], "tolerance_m": 25},
+        "route_service_summary": {"agency_id": agency, "route_id": route['route_id'], "date": "2026-03-04"},
+        "plan_trip": {"agency_id": agency, "from_stop_id": stop_times[0]['stop_id'], "to_stop_id": stop_times[-1]['stop_id'],
+                      "date": "2026-03-04", "time": "08:00"},
+        BATCH: [["query_data", {"agency_id": agency, "file_name": name, "limit": 100}]
+                for name in ("routes.txt", "stops.txt", "trips.txt")],
+    }
+
+
+def request_body(tool: str, args, request_id: int) -> bytes:
+    """tools/call body, or a batch of them for the BATCH scenario"""
+    if tool == BATCH:
+        return json.dumps([{"jsonrpc": "2.0", "id": request_id * 100 + i, "method": "tools/call",
+                            "params": {"name": name, "arguments": call_args}}
+                           for i, (name, call_args) in enumerate(args)]).encode()
+    return json.dumps({"jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+                       "params": {"name": tool, "arguments": args}}).encode()
+
+
+async def asgi_post(app, body: bytes) -> bytes:
+    """One POST / through the ASGI app; returns the response body"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 3000),
+    }
+    sent = False
+    disconnected = asyncio.Event()
+    chunks = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                disconnected.set()
+
+    await app(scope, receive, send)
+    return b"".join(chunks)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def peak_rss_mb() -> float:
+    """High-water RSS of this process; VmHWM restarts at exec, unlike ru_maxrss which keeps the parent's peak"""
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def tool_error(response: bytes) -> Optional[str]:
+    """The tool's error message, if the call (or any call of a batch) failed"""
+    message = json.loads(response)
+    if isinstance(message, list):
+        return next((error for error in (tool_error(json.dumps(item)) for item in message) if error), None)
+    if "error" in message:
+        return message["error"].get("message")
+    try:
+        payload = json.loads(message["result"]["content"][0]["text"])
+    except (KeyError, IndexError, ValueError):
+        return None
+    return payload.get("error") if isinstance(payload, dict) else None
+
+
+def run_child(tool: str, args: Dict, data_dir: str, cache_dir: Optional[str], requests: int,
+              concurrency: List[int], no_result_cache: bool) -> Dict:
+    """Runs inside a fresh process: cold start, sequential latency, then throughput per concurrency level"""
+    started = time.perf_counter()
+    sys.path.insert(0, str(PACKAGE_DIR))
+    import engine
+    from data_loader import GTFSDataLoader
+    # Set before the first call starts the engine, so it keeps this loader instead of the default one
+    engine.data_loader = GTFSDataLoader(data_dir, cache_dir or str(Path(data_dir) / ".no-cache"))
+    import http_server
+    if no_result_cache:
+        engine.result_cache.max_bytes = 0
+    imported = time.perf_counter()
+
+    async def measure():
+        body = request_body(tool, args, 1)
+        first_started = time.perf_counter()
+        first = await asgi_post(http_server.app, body)
+        first_call = time.perf_counter() - first_started
+
+        latencies = []
+        for _ in range(requests):
+            call_started = time.perf_counter()
+            await asgi_post(http_server.app, body)
+            latencies.append(time.perf_counter() - call_started)
+
+        throughput = {}
+        for level in concurrency:
+            # Distinct request ids so nothing but the tool arguments is shared between calls
+            bodies = [request_body(tool, args, i) for i in range(max(requests, level))]
+            limiter = asyncio.Semaphore(level)
+
+            async def one(payload):
+                async with limiter:
+                    await asgi_post(http_server.app, payload)
+
+            level_started = time.perf_counter()
+            await asyncio.gather(*(one(payload) for payload in bodies))
+            throughput[str(level)] = round(len(bodies) / (time.perf_counter() - level_started), 2)
+        return first, first_call, latencies, throughput
+
+    first, first_call, latencies, throughput = asyncio.run(measure())
+    http_server.tool_executor.shutdown()
+    if engine.aggregator is not None:
+        engine.aggregator.shutdown()
+    return {
+        "tool": tool,
+        "error": tool_error(first),
+        "response_bytes": len(first),
+        "import_s": round(imported - started, 4),
+        "cold_start_s": round(imported - started + first_call, 4),
+        "first_call_s": round(first_call, 4),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else None,
+        "throughput_rps": throughput,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_stdio(data_dir: str, cache_dir: Optional[str], tool: str, args: Dict) -> Dict:
+    """Launch server.py the way a desktop client does and time its replies from process start"""
+    env = dict(os.environ, MCP_DATA_SOURCE=data_dir, MCP_CACHE_DIR=cache_dir or str(Path(data_dir) / ".no-cache"))
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, str(PACKAGE_DIR / "server.py")], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+
+    def reply(message: Dict) -> float:
+        process.stdin.write(json.dumps(message).encode() + b"\n")
+        process.stdin.flush()
+        for line in process.stdout:
+            if json.loads(line).get("id") == message["id"]:
+                return time.perf_counter() - started
+        raise RuntimeError(f"stdio server exited before answering {message['method']}")
+
+    try:
+        initialized = reply({"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}})
+        listed = reply({"jsonrpc": "2.0", "id": 2, "method": "tools/list"})
+        called = reply({"jsonrpc": "2.0", "id": 3, "method": "tools/call", "params": {"name": tool, "arguments": args}})
+    finally:
+        process.stdin.close()
+        process.wait()
+    return {
+        "tool": tool,
+        "initialize_ms": round(initialized * 1000, 1),
+        "tools_list_ms": round(listed * 1000, 1),
+        "first_call_ms": round(called * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every MCP tool through mcp_handler")
+    parser.add_argument("--data", required=True, help="GTFS data dir (see synthetic_gtfs.py)")
+    parser.add_argument("--cache", help="Cache dir; compiled once before the runs when given")
+    parser.add_argument("--tools", help="Comma-separated subset of tools")
+    parser.add_argument("--requests", type=int, default=50, help="Sequential calls per tool after the cold call")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--no-result-cache", action="store_true", help="Disable the query_data result cache")
+    parser.add_argument("--stdio-tool", default="get_agency_files",
+                        help="Tool whose first call is timed on the stdio server ('' to skip)")
+    parser.add_argument("--json", help="Also write results to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    data_dir = Path(options.data).resolve()
+    levels = [int(level) for level in options.concurrency.split(',') if level]
+
+    if options.child:
+        tool, args = json.loads(options.child)
+        print(json.dumps(run_child(tool, args, str(data_dir), options.cache, options.requests, levels,
+                                   options.no_result_cache)))
+        return
+
+    all_scenarios = scenarios(data_dir)
+    sys.path.insert(0, str(PACKAGE_DIR))
+    from engine import get_tools
+    available = [tool["name"] for tool in get_tools()] + [BATCH]
+    wanted = options.tools.split(',') if options.tools else available
+    missing = [tool for tool in wanted if tool not in all_scenarios]
+    if missing:
+        print(f"No benchmark scenario for: {', '.join(missing)}", file=sys.stderr)
+
+    if options.cache:
+        from data_loader import GTFSDataLoader
+        Path(options.cache).mkdir(parents=True, exist_ok=True)
+        loader = GTFSDataLoader(str(data_dir), options.cache)
+        compile_started = time.perf_counter()
+        compiled = loader.build_cache()
+        loader.get_dataset_metadata()
+        print(f"Cache ready ({compiled} files compiled in {time.perf_counter() - compile_started:.1f}s)")
+
+    results = []
+    header = f"{'tool':<20} {'cold s':>8} {'p50 ms':>9} {'p99 ms':>9} {'rps@' + str(levels[-1] if levels else '-'):>9} {'rss MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for tool in wanted:
+        if tool not in all_scenarios:
+            continue
+        command = [sys.executable, __file__, "--data", str(data_dir), "--requests", str(options.requests),
+                   "--concurrency", options.concurrency, "--child", json.dumps([tool, all_scenarios[tool]])]
+        if options.cache:
+            command += ["--cache", options.cache]
+        if options.no_result_cache:
+            command.append("--no-result-cache")
+        completed = subprocess.run(command, capture_output=True, text=True)
+        lines = [line for line in completed.stdout.splitlines() if line.startswith('{')]
+        if completed.returncode != 0 or not lines:
+            print(f"{tool:<20} failed: {completed.stderr.strip().splitlines()[-1:] or completed.returncode}")
+            continue
+        result = json.loads(lines[-1])
+        results.append(result)
+        top = result["throughput_rps"].get(str(levels[-1])) if levels else None
+        print(f"{tool:<20} {result['cold_start_s']:>8.3f} {result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} "
+              f"{top if top is not None else '-':>9} {result['peak_rss_mb']:>8.1f}"
+              + (f"  ERROR: {result['error']}" if result['error'] else ""))
+
+    stdio = None
+    if options.stdio_tool:
+        stdio = run_stdio(str(data_dir), options.cache, options.stdio_tool, all_scenarios[options.stdio_tool])
+        print(f"stdio cold start: tools/list {stdio['tools_list_ms']:.0f} ms, "
+              f"first {stdio['tool']} {stdio['first_call_ms']:.0f} ms after launch")
+
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump({"data_dir": str(data_dir), "cache": options.cache, "requests": options.requests,
+                       "concurrency": levels, "python": sys.version.split()[0], "cpus": os.cpu_count(),
+                       "results": results, "stdio": stdio}, f, indent=2)
+        print(f"Wrote {options.json}")
+
+
+if __name__ == "__main__":
+    main()
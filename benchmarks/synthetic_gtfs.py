@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Synthetic GTFS Generator - Writes agency folders shaped like the StatCan dataset
+
+Every file is streamed row by row, so feeds with tens of millions of
+stop_times can be written without holding them in memory.
+
+    python benchmarks/synthetic_gtfs.py /tmp/gtfs --preset medium
+    python benchmarks/synthetic_gtfs.py /tmp/gtfs --agencies 10 --trips-per-route 400 --stops-per-trip 40
+"""
+
+import argparse
+import csv
+import math
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+# (folder, agency name, centre lat, centre lon, timezone)
+CITIES = [
+    ("toronto_transit_commission", "Toronto Transit Commission", 43.6532, -79.3832, "America/Toronto"),
+    ("societe_de_transport_de_montreal", "Société de transport de Montréal", 45.5019, -73.5674, "America/Montreal"),
+    ("translink_vancouver", "TransLink", 49.2827, -123.1207, "America/Vancouver"),
+    ("calgary_transit", "Calgary Transit", 51.0447, -114.0719, "America/Edmonton"),
+    ("edmonton_transit_service", "Edmonton Transit Service", 53.5461, -113.4938, "America/Edmonton"),
+    ("oc_transpo", "OC Transpo", 45.4215, -75.6972, "America/Toronto"),
+    ("winnipeg_transit", "Winnipeg Transit", 49.8951, -97.1384, "America/Winnipeg"),
+    ("reseau_de_transport_de_la_capitale", "Réseau de transport de la Capitale", 46.8139, -71.2080, "America/Montreal"),
+    ("halifax_transit", "Halifax Transit", 44.6488, -63.5752, "America/Halifax"),
+    ("bc_transit_victoria", "BC Transit - Victoria Regional Transit System", 48.4284, -123.3656, "America/Vancouver"),
+    ("saskatoon_transit", "Saskatoon Transit", 52.1332, -106.6700, "America/Regina"),
+    ("metrobus_st_johns", "Metrobus Transit", 47.5615, -52.7126, "America/St_Johns"),
+]
+
+STREETS = [
+    "Yonge", "Bloor", "Queen", "King", "Dundas", "College", "Spadina", "Bathurst", "Sainte-Catherine",
+    "Sherbrooke", "Saint-Denis", "Côte-des-Neiges", "René-Lévesque", "Granville", "Broadway", "Hastings",
+    "Main", "Commercial", "Kingsway", "Jasper", "Whyte", "Portage", "Rideau", "Bank", "Elgin", "Barrington",
+    "Robie", "Douglas", "Macleod", "Centre", "Victoria", "Wellington", "Church", "Park", "Lakeshore",
+]
+SUFFIXES = ["St", "Ave", "Rd", "Blvd", "Dr"]
+
+PRESETS = {
+    # ~0.1M stop_times
+    "small": dict(agencies=3, stops=2000, routes=40, trips_per_route=60, stops_per_trip=15),
+    # ~2M stop_times
+    "medium": dict(agencies=6, stops=8000, routes=120, trips_per_route=120, stops_per_trip=24),
+    # ~20M stop_times
+    "large": dict(agencies=12, stops=12000, routes=200, trips_per_route=240, stops_per_trip=35),
+}
+
+
+def write_csv(path: Path, header: List[str], rows: Iterator[List]) -> int:
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def format_time(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def generate_agency(root: Path, index: int, args: argparse.Namespace) -> Dict[str, int]:
+    """Write one agency folder; returns rows written per file"""
+    folder, name, lat, lon, timezone = CITIES[index % len(CITIES)]
+    if index >= len(CITIES):
+        folder, name = f"{folder}_{index // len(CITIES) + 1}", f"{name} {index // len(CITIES) + 1}"
+    rng = random.Random(args.seed * 1000 + index)
+    directory = root / folder
+    directory.mkdir(parents=True, exist_ok=True)
+    written = {}
+    prefix = ''.join(word[0] for word in name.split() if len(word) > 2).upper() or "AG"
+
+    written['agency.txt'] = write_csv(directory / "agency.txt",
+        ['agency_id', 'agency_name', 'agency_url', 'agency_timezone', 'agency_lang', 'agency_phone'],
+        iter([[prefix, name, f"https://www.{folder.replace('_', '')}.ca", timezone, 'en', '555-0100']]))
+
+    # Stops scattered around the centre, denser downtown; every 10th stop is a station with two platforms
+    stations = args.stops // 10
+    coords = []
+    for _ in range(args.stops):
+        radius = abs(rng.gauss(0, 0.08))
+        angle = rng.uniform(0, 2 * math.pi)
+        coords.append((lat + radius * math.sin(angle), lon + radius * math.cos(angle) / math.cos(math.radians(lat))))
+
+    def stops() -> Iterator[List]:
+        for i, (stop_lat, stop_lon) in enumerate(coords):
+            street = f"{rng.choice(STREETS)} {rng.choice(SUFFIXES)}"
+            cross = f"{rng.choice(STREETS)} {rng.choice(SUFFIXES)}"
+            if i < stations:
+                yield [f"STN{i}", f"{street} Station", f"{stop_lat:.6f}", f"{stop_lon:.6f}", '1', '', '1']
+            else:
+                parent = f"STN{i % stations}" if stations and i < stations * 3 else ''
+                # Some names carry commas and quotes, like the real feeds
+                label = f'{street} at {cross}' if i % 13 else f'{street}, "{cross}" (Northbound)'
+                yield [str(i), label, f"{stop_lat:.6f}", f"{stop_lon:.6f}", '0', parent, str(rng.choice([0, 1, 2]))]
+
+    written['stops.txt'] = write_csv(directory / "stops.txt",
+        ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'location_type', 'parent_station', 'wheelchair_boarding'],
+        stops())
+    platform_ids = [str(i) for i in range(stations, args.stops)] or ['0']
+
+    route_types = ['3'] * 17 + ['1', '0', '2']
+    written['routes.txt'] = write_csv(directory / "routes.txt",
+        ['route_id', 'agency_id', 'route_short_name', 'route_long_name', 'route_type', 'route_color'],
+        ([f"R{r}", prefix, str(r + 1), f"{rng.choice(STREETS)} {rng.choice(['Express', 'Local', 'Crosstown', 'Line'])}",
+          route_types[r % len(route_types)], f"{rng.randrange(0xFFFFFF):06X}"] for r in range(args.routes)))
+
+    written['calendar.txt'] = write_csv(directory / "calendar.txt",
+        ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday',
+         'start_date', 'end_date'],
+        iter([['WKDY', '1', '1', '1', '1', '1', '0', '0', '20250101', '20261231'],
+              ['SAT', '0', '0', '0', '0', '0', '1', '0', '20250101', '20261231'],
+              ['SUN', '0', '0', '0', '0', '0', '0', '1', '20250101', '20261231']]))
+    holidays = ['20250101', '20250701', '20251225', '20260101', '20260701', '20261225']
+    written['calendar_dates.txt'] = write_csv(directory / "calendar_dates.txt",
+        ['service_id', 'date', 'exception_type'],
+        ([service, day, kind] for day in holidays for service, kind in (('WKDY', '2'), ('SUN', '1'))))
+
+    # Each route runs two shape patterns (one per direction) over a fixed sequence of stops
+    patterns = {}
+    for r in range(args.routes):
+        sequence = rng.sample(platform_ids, min(args.stops_per_trip, len(platform_ids)))
+        patterns[r] = (sequence, list(reversed(sequence)))
+
+    def shapes() -> Iterator[List]:
+        for r, directions in patterns.items():
+            for direction, sequence in enumerate(directions):
+                point = 0
+                for stop_id in sequence:
+                    stop_lat, stop_lon = coords[int(stop_id)]
+                    for step in range(args.shape_points_per_stop):
+                        jitter = step * 0.00005
+                        yield [f"SH{r}_{direction}", f"{stop_lat + jitter:.6f}", f"{stop_lon + jitter:.6f}", str(point)]
+                        point += 1
+
+    written['shapes.txt'] = write_csv(directory / "shapes.txt",
+        ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'], shapes())
+
+    services = ['WKDY'] * 5 + ['SAT', 'SUN']
+    trip_plan = []
+    for r in range(args.routes):
+        for k in range(args.trips_per_route):
+            # Departures from 05:00 spread over ~20 hours, so late trips run past 24:00:00
+            start = 5 * 3600 + int(k * 72000 / max(args.trips_per_route, 1)) + rng.randrange(0, 120)
+            trip_plan.append((f"T{r}_{k}", r, k % 2, services[k % len(services)], start))
+
+    written['trips.txt'] = write_csv(directory / "trips.txt",
+        ['route_id', 'service_id', 'trip_id', 'trip_headsign', 'direction_id', 'shape_id', 'block_id'],
+        ([f"R{r}", service, trip_id, f"To {rng.choice(STREETS)}", str(direction), f"SH{r}_{direction}", f"B{r}_{k % 12}"]
+         for k, (trip_id, r, direction, service, start) in enumerate(trip_plan)))
+
+    def stop_times() -> Iterator[List]:
+        for trip_id, r, direction, _, start in trip_plan:
+            seconds = start
+            for sequence, stop_id in enumerate(patterns[r][direction], 1):
+                arrival = format_time(seconds)
+                departure = format_time(seconds + (30 if sequence % 5 == 0 else 0))
+                # Like many real feeds, only every third stop is a timepoint
+                timed = sequence == 1 or sequence % 3 == 0 or sequence == len(patterns[r][direction])
+                yield [trip_id, arrival if timed else '', departure if timed else '', stop_id, sequence,
+                       '0', '1' if timed else '0']
+                seconds += 60 + rng.randrange(0, 90)
+
+    written['stop_times.txt'] = write_csv(directory / "stop_times.txt",
+        ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence', 'pickup_type', 'timepoint'],
+        stop_times())
+
+    if index % 3 == 0:
+        written['transfers.txt'] = write_csv(directory / "transfers.txt",
+            ['from_stop_id', 'to_stop_id', 'transfer_type', 'min_transfer_time'],
+            ([f"STN{s}", f"STN{(s + 1) % stations}", '2', '180'] for s in range(stations - 1)))
+        written['frequencies.txt'] = write_csv(directory / "frequencies.txt",
+            ['trip_id', 'start_time', 'end_time', 'headway_secs'],
+            ([f"T{r}_0", '06:00:00', '09:30:00', '300'] for r in range(0, args.routes, 10)))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic GTFS agency folders for benchmarking")
+    parser.add_argument("output", help="Data directory to write agency folders into")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--agencies", type=int)
+    parser.add_argument("--stops", type=int, help="Stops per agency")
+    parser.add_argument("--routes", type=int, help="Routes per agency")
+    parser.add_argument("--trips-per-route", type=int)
+    parser.add_argument("--stops-per-trip", type=int)
+    parser.add_argument("--shape-points-per-stop", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    for key, value in PRESETS[args.preset].items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+
+    root = Path(args.output)
+    root.mkdir(parents=True, exist_ok=True)
+    expected = args.agencies * args.routes * args.trips_per_route * min(args.stops_per_trip, args.stops)
+    print(f"Writing {args.agencies} agencies (~{expected:,} stop_times) to {root}")
+    started = time.perf_counter()
+    totals: Dict[str, int] = {}
+    for index in range(args.agencies):
+        for file_name, rows in generate_agency(root, index, args).items():
+            totals[file_name] = totals.get(file_name, 0) + rows
+        print(f"  {index + 1}/{args.agencies} agencies written", file=sys.stderr)
+    for file_name, rows in sorted(totals.items()):
+        print(f"  {file_name:<20} {rows:>12,} rows")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
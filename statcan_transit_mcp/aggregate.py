@@ -0,0 +1,237 @@
+"""Aggregate - Cross-agency count / distinct-count / group-by over a process pool"""
+import csv
+import io
+import multiprocessing
+import signal
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from archive import GTFSArchive, is_archive
+from columnar_cache import ColumnarCache, StrColumn
+
+OPERATIONS = ('count', 'count_distinct')
+
+# group_by value that groups by agency folder instead of a GTFS column
+AGENCY_GROUP = 'agency'
+
+_caches: Dict[tuple, ColumnarCache] = {}
+_archives: Dict[tuple, Optional[GTFSArchive]] = {}
+
+
+def _archive(data_dir: str, cache_dir: Optional[str]) -> Optional[GTFSArchive]:
+    """The worker's own handle on the dataset zip when data_dir is one (index loaded from the cache)
+
+    Reopened when the zip is replaced, so workers follow a hot reload.
+    """
+    key = (data_dir, cache_dir)
+    archive = _archives.get(key)
+    if key not in _archives or (archive is not None and archive.index['signature'] != archive.signature):
+        archive = _archives[key] = GTFSArchive(Path(data_dir), cache_dir) if is_archive(Path(data_dir)) else None
+        _caches.pop(key, None)
+    return archive
+
+
+def _columnar_table(data_dir: str, cache_dir: Optional[str], agency: str, file_name: str):
+    """Fresh compiled table if one exists; workers never compile, they fall back to CSV"""
+    if not cache_dir:
+        return None
+    cache = _caches.get((data_dir, cache_dir))
+    if cache is None:
+        archive = _archive(data_dir, cache_dir)
+        root = archive.root if archive is not None else Path(data_dir)
+        cache = _caches[(data_dir, cache_dir)] = ColumnarCache(cache_dir, root, archive)
+    return cache.get_table(agency, file_name, rebuild=False)
+
+
+def _open_text(data_dir: str, cache_dir: Optional[str], agency: str, file_name: str):
+    """The CSV as text: the file itself, or the zip member decompressed as it is read"""
+    archive = _archive(data_dir, cache_dir)
+    if archive is None:
+        return open(Path(data_dir) / agency / file_name, 'r', encoding='utf-8')
+    return io.TextIOWrapper(archive.open_member(agency, file_name), encoding='utf-8', newline='')
+
+
+def _column_keys(table, name: str, rows) -> List:
+    """Values (or dictionary codes, for strings) of one column at `rows`"""
+    column = table.columns[name]
+    raw = column.codes if isinstance(column, StrColumn) else column.slice(0, len(table))
+    return raw if isinstance(rows, range) else [raw[i] for i in rows]
+
+
+def _decoder(table, name: str):
+    column = table.columns[name]
+    return column.value if isinstance(column, StrColumn) else (lambda value: value)
+
+
+def _partial_columnar(table, op: str, column: Optional[str], group_by: Optional[str],
+                      filters: Dict[str, List[str]]) -> Dict:
+    rows = table.matching_rows(filters)
+    if op == 'count' and not group_by:
+        return {None: len(rows)}
+    if op == 'count':
+        counts = Counter(_column_keys(table, group_by, rows))
+        decode = _decoder(table, group_by)
+        return {decode(key): count for key, count in counts.items()}
+    values = _column_keys(table, column, rows)
+    decode_value = _decoder(table, column)
+    if not group_by:
+        return {None: {decode_value(key) for key in set(values)}}
+    decode_group = _decoder(table, group_by)
+    partial = {}
+    for group_key, value_key in set(zip(_column_keys(table, group_by, rows), values)):
+        partial.setdefault(decode_group(group_key), set()).add(decode_value(value_key))
+    return partial
+
+
+def _partial_csv(f, op: str, column: Optional[str], group_by: Optional[str],
+                 filters: Dict[str, List[str]]) -> Dict:
+    with f:
+        reader = csv.reader(f)
+        fields = next(reader, None) or []
+        position = {name: i for i, name in enumerate(fields)}
+        wanted = [(position[name], set(values)) for name, values in filters.items()]
+        group_at = position.get(group_by) if group_by else None
+        value_at = position.get(column) if column else None
+        partial = {}
+        for record in reader:
+            if not record:
+                continue
+            if any((record[i] if i < len(record) else None) not in values for i, values in wanted):
+                continue
+            group = (record[group_at] if group_at < len(record) else None) if group_at is not None else None
+            if op == 'count':
+                partial[group] = partial.get(group, 0) + 1
+            else:
+                value = record[value_at] if value_at < len(record) else None
+                partial.setdefault(group, set()).add(value)
+        return partial
+
+
+def partial_aggregate(data_dir: str, cache_dir: Optional[str], agency: str, file_name: str, op: str,
+                      column: Optional[str], group_by: Optional[str], filters: Dict[str, List[str]]) -> Dict:
+    """One agency's partial result; runs in a worker process next to the file
+
+    data_dir is the gtfs/ folder tree or the dataset zip. Returns
+    {"status": "ok", "groups": {...}} or a status explaining why the agency
+    contributed nothing ("no_file" / "missing_column" / "error").
+    """
+    try:
+        archive = _archive(data_dir, cache_dir)
+        if archive is not None:
+            if archive.stat(agency, file_name) is None:
+                return {"status": "no_file"}
+        elif not (Path(data_dir) / agency / file_name).exists():
+            return {"status": "no_file"}
+        per_agency = group_by == AGENCY_GROUP
+        column_group = None if per_agency else group_by
+        needed = [name for name in (column, column_group) if name] + list(filters)
+        table = _columnar_table(data_dir, cache_dir, agency, file_name)
+        if table is not None:
+            fields = table.fields
+        else:
+            with _open_text(data_dir, cache_dir, agency, file_name) as f:
+                fields = next(csv.reader(f), [])
+        missing = [name for name in needed if name not in fields]
+        if missing:
+            return {"status": "missing_column", "columns": missing}
+        if table is not None:
+            groups = _partial_columnar(table, op, column, column_group, filters)
+        else:
+            groups = _partial_csv(_open_text(data_dir, cache_dir, agency, file_name), op, column, column_group, filters)
+        if per_agency:
+            # Collapse to one number per agency here, so distinct value sets never cross the process boundary
+            groups = {agency: sum(groups.values()) if op == 'count' else len(groups.get(None, ()))}
+        return {"status": "ok", "groups": groups}
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+
+
+def _init_worker():
+    """First thing each pool process runs; unpickling it imports this module, i.e. only what partials need
+
+    Ctrl+C reaches the whole process group; the parent shuts the pool down,
+    so workers ignore it rather than each printing a traceback.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Aggregator:
+    """Fans an aggregate out over agency folders on a process pool and merges the partials
+
+    The pool is created on first use with the spawn start method, so workers
+    never inherit the server's threads or loaded tables. Spawned processes
+    still import the parent's __main__ module (e.g. http_server), so that
+    must not load data at import time.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker)
+        return self._pool
+
+    def run(self, data_dir: str, cache_dir: Optional[str], agencies: List[str], file_name: str, op: str,
+            column: Optional[str] = None, group_by: Optional[str] = None,
+            filters: Optional[Dict[str, List[str]]] = None) -> Dict:
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{op}'. Use one of {list(OPERATIONS)}")
+        if op == 'count_distinct' and not column:
+            raise ValueError("count_distinct needs a column")
+        filters = filters or {}
+        pool = self._get_pool()
+        futures = {pool.submit(partial_aggregate, data_dir, cache_dir, agency, file_name, op, column,
+                               group_by, filters): agency for agency in agencies}
+
+        merged: Dict = {}
+        scanned = []
+        without_file = []
+        missing_column = {}
+        errors = {}
+        for future in as_completed(futures):
+            agency = futures[future]
+            try:
+                partial = future.result()
+            except BrokenProcessPool as e:
+                # A worker died (e.g. OOM-killed); start a fresh pool next time
+                self._pool = None
+                errors[agency] = f"worker process died: {e}"
+                continue
+            except Exception as e:
+                errors[agency] = str(e)
+                continue
+            status = partial["status"]
+            if status == "no_file":
+                without_file.append(agency)
+            elif status == "missing_column":
+                missing_column[agency] = partial["columns"]
+            elif status == "error":
+                errors[agency] = partial["error"]
+            else:
+                scanned.append(agency)
+                for group, value in partial["groups"].items():
+                    if op == 'count' or group_by == AGENCY_GROUP:
+                        merged[group] = merged.get(group, 0) + value
+                    else:
+                        merged.setdefault(group, set()).update(value)
+
+        if op == 'count_distinct' and group_by != AGENCY_GROUP:
+            merged = {group: len(values) for group, values in merged.items()}
+        return {
+            "groups": merged,
+            "agencies_scanned": sorted(scanned),
+            "agencies_without_file": sorted(without_file),
+            "agencies_missing_column": missing_column,
+            "errors": errors,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
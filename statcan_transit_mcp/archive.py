@@ -0,0 +1,317 @@
+"""GTFS Archive - Agency files read straight from the dataset zip, including nested per-agency zips"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import IO, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No cross-process pins (Windows); copies in use by this process are still never evicted
+
+INDEX_VERSION = 1
+# A folder holding any of these is an agency folder
+GTFS_MARKERS = {'agency.txt', 'stops.txt', 'routes.txt', 'trips.txt', 'stop_times.txt'}
+# Nested zips with these names are named after the folder they sit in instead
+GENERIC_ZIP_NAMES = {'gtfs', 'google_transit', 'feed', 'data'}
+COPY_CHUNK = 1024 * 1024
+
+_scratch: Optional[tempfile.TemporaryDirectory] = None
+_scratch_lock = threading.Lock()
+
+
+def is_archive(path: Path) -> bool:
+    return path.is_file() and zipfile.is_zipfile(path)
+
+
+def _scratch_root() -> Path:
+    """Extraction dir of this process when there is no cache dir: shared by the archives of every reload, removed at exit"""
+    global _scratch
+    with _scratch_lock:
+        if _scratch is None:
+            _scratch = tempfile.TemporaryDirectory(prefix="gtfs-extracted-")
+        return Path(_scratch.name)
+
+
+def _member_mtime_ns(info: zipfile.ZipInfo) -> int:
+    """Stable stand-in mtime for a member: its zip timestamp, with the CRC in the nanoseconds
+
+    Extracted copies get this mtime, so file signatures (mtime_ns:size) change
+    whenever a member's content does, even if the timestamp didn't.
+    """
+    try:
+        seconds = int(datetime(*info.date_time, tzinfo=timezone.utc).timestamp())
+    except ValueError:
+        seconds = 0
+    return seconds * 10 ** 9 + info.CRC % 10 ** 9
+
+
+class GTFSArchive:
+    """Agency folders and GTFS members of a dataset zip, without unzipping it
+
+    Where every member lives (outer member, member of a nested zip, offsets,
+    sizes, CRCs) is indexed once per zip version and persisted to
+    <cache_dir>/archive_index.json. Members are stream-decompressed on
+    demand: open_member() reads one without touching disk, use() extracts
+    a "hot" copy under <cache_dir>/extracted/<agency>/<file> for the code
+    that needs seeks or whole columns. Least recently used hot copies are
+    deleted once they take more than hot_bytes (0 = no limit). A process
+    only deletes copies it extracted itself, and never one a reader in any
+    process is using: use() pins the copy with a shared flock.
+    """
+
+    def __init__(self, zip_path: Path, cache_dir: Optional[str], hot_bytes: int = 0):
+        self.zip_path = Path(zip_path)
+        cache_enabled = bool(cache_dir) and Path(cache_dir).is_dir()
+        self.root = Path(cache_dir) / "extracted" if cache_enabled else _scratch_root()
+        self.hot_bytes = hot_bytes
+        self._index_path = Path(cache_dir) / "archive_index.json" if cache_enabled else None
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._nested: Dict[str, zipfile.ZipFile] = {}
+        self._lock = threading.Lock()
+        self._file_locks: Dict[tuple, threading.Lock] = {}
+        # Copies this process extracted, least recently used first, and how many readers use each
+        self._hot: "OrderedDict[tuple, int]" = OrderedDict()
+        self._in_use: Dict[tuple, int] = {}
+        self.index = self._load_index() or self._build_index()
+
+    @property
+    def signature(self) -> str:
+        stat = self.zip_path.stat()
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def _outer(self) -> zipfile.ZipFile:
+        # One handle for all threads: ZipFile serializes reads of its shared file object
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(self.zip_path)
+        return self._zip
+
+    def _load_index(self) -> Optional[Dict]:
+        if self._index_path is None or not self._index_path.exists():
+            return None
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable archive index {self._index_path}: {e}")
+            return None
+        if index.get('version') != INDEX_VERSION or index.get('signature') != self.signature:
+            return None
+        return index
+
+    def _build_index(self) -> Dict:
+        outer = self._outer()
+        folders: Dict[str, Dict[str, zipfile.ZipInfo]] = {}
+        nested_zips = {}
+        for info in outer.infolist():
+            if info.is_dir():
+                continue
+            parent, _, base = info.filename.rstrip('/').rpartition('/')
+            if base.lower().endswith('.txt'):
+                folders.setdefault(parent, {})[base] = info
+            elif base.lower().endswith('.zip'):
+                stem = base[:-4]
+                agency = parent.rpartition('/')[2] if stem.lower() in GENERIC_ZIP_NAMES and parent else stem
+                nested_zips[agency] = info.filename
+
+        agencies: Dict[str, Dict[str, Dict]] = {}
+        for parent, members in folders.items():
+            if not parent or not GTFS_MARKERS & set(members):
+                continue
+            agencies[parent.rpartition('/')[2]] = {
+                name: {'member': info.filename, 'inner': None, 'size': info.file_size, 'crc': info.CRC,
+                       'mtime_ns': _member_mtime_ns(info), 'offset': info.header_offset,
+                       'compressed_size': info.compress_size}
+                for name, info in sorted(members.items())
+            }
+        nested = {}
+        for agency, member in sorted(nested_zips.items()):
+            if agency in agencies:
+                continue  # A plain folder wins over a zip of the same agency
+            try:
+                inner = self._nested_zip(agency, member)
+            except Exception as e:
+                print(f"Skipping unreadable nested zip {member}: {e}")
+                continue
+            files = {}
+            # Shallowest copy of each file name, in case the nested zip has a top-level folder
+            for info in sorted(inner.infolist(), key=lambda i: i.filename.count('/')):
+                base = info.filename.rstrip('/').rpartition('/')[2]
+                if not info.is_dir() and base.lower().endswith('.txt') and base not in files:
+                    files[base] = {'member': member, 'inner': info.filename, 'size': info.file_size, 'crc': info.CRC,
+                                   'mtime_ns': _member_mtime_ns(info), 'offset': info.header_offset,
+                                   'compressed_size': info.compress_size}
+            if GTFS_MARKERS & set(files):
+                agencies[agency] = dict(sorted(files.items()))
+                nested[agency] = member
+
+        index = {'version': INDEX_VERSION, 'signature': self.signature, 'agencies': agencies, 'nested': nested}
+        if self._index_path is not None:
+            tmp = self._index_path.with_name(f"{self._index_path.name}.{os.getpid()}.tmp")
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(index, f)
+                os.replace(tmp, self._index_path)
+            except Exception as e:
+                print(f"Could not persist archive index to {self._index_path}: {e}")
+        return index
+
+    def _nested_zip(self, agency: str, member: str) -> zipfile.ZipFile:
+        """Nested agency zip, copied out once so its members can be opened with seeks"""
+        with self._lock:
+            inner = self._nested.get(agency)
+            if inner is not None:
+                return inner
+            info = self._outer().getinfo(member)
+            target = self.root / ".nested" / f"{agency}.zip"
+            stamp = _member_mtime_ns(info)
+            if not target.exists() or (target.stat().st_size, target.stat().st_mtime_ns) != (info.file_size, stamp):
+                self._copy_out(self._outer().open(info), target, stamp)
+            inner = self._nested[agency] = zipfile.ZipFile(target)
+            return inner
+
+    def folders(self) -> List[str]:
+        return sorted(self.index['agencies'])
+
+    def files(self, agency: str) -> List[str]:
+        return list(self.index['agencies'].get(agency, {}))
+
+    def stat(self, agency: str, file_name: str) -> Optional[SimpleNamespace]:
+        """mtime_ns/size of a member, matching what its extracted copy will report"""
+        entry = self.index['agencies'].get(agency, {}).get(file_name)
+        if entry is None:
+            return None
+        return SimpleNamespace(st_mtime_ns=entry['mtime_ns'], st_size=entry['size'])
+
+    def open_member(self, agency: str, file_name: str) -> IO[bytes]:
+        """Binary stream that decompresses the member as it is read"""
+        entry = self.index['agencies'].get(agency, {}).get(file_name)
+        if entry is None:
+            raise FileNotFoundError(f"{agency}/{file_name} is not in {self.zip_path.name}")
+        if entry['inner'] is None:
+            return self._outer().open(entry['member'])
+        return self._nested_zip(agency, entry['member']).open(entry['inner'])
+
+    def _hot_path(self, agency: str, file_name: str) -> Path:
+        return self.root / agency / file_name
+
+    def is_hot(self, agency: str, file_name: str) -> bool:
+        """Whether an up-to-date extracted copy exists"""
+        stat = self.stat(agency, file_name)
+        try:
+            current = self._hot_path(agency, file_name).stat()
+        except OSError:
+            return False
+        return stat is not None and current.st_size == stat.st_size and current.st_mtime_ns == stat.st_mtime_ns
+
+    def adopt(self, previous: 'GTFSArchive'):
+        """Take over `previous`'s record of extracted copies (a reloaded loader extracting to the same dir)"""
+        if previous.root == self.root:
+            with previous._lock:
+                hot = list(previous._hot.items())
+            with self._lock:
+                for key, size in hot:
+                    self._hot.setdefault(key, size)
+
+    @contextmanager
+    def use(self, agency: str, file_name: str) -> Iterator[Path]:
+        """Extracted copy of a member, decompressed first if needed, that stays in place until the block exits"""
+        key = (agency, file_name)
+        with self._lock:
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+        pin = None
+        try:
+            while pin is None:
+                target = self._extract(agency, file_name)
+                try:
+                    pin = open(target, 'rb')
+                    if fcntl is not None:
+                        fcntl.flock(pin, fcntl.LOCK_SH)
+                    if os.stat(target).st_ino != os.fstat(pin.fileno()).st_ino:
+                        raise FileNotFoundError(target)
+                except FileNotFoundError:
+                    # Evicted by another process before the pin took hold; extract it again
+                    if pin is not None:
+                        pin.close()
+                        pin = None
+            yield target
+        finally:
+            if pin is not None:
+                pin.close()
+            with self._lock:
+                self._in_use[key] -= 1
+                if not self._in_use[key]:
+                    del self._in_use[key]
+
+    def _extract(self, agency: str, file_name: str) -> Path:
+        key = (agency, file_name)
+        with self._lock:
+            file_lock = self._file_locks.setdefault(key, threading.Lock())
+        with file_lock:
+            target = self._hot_path(agency, file_name)
+            if not self.is_hot(agency, file_name):
+                stat = self.stat(agency, file_name)
+                if stat is None:
+                    raise FileNotFoundError(f"{agency}/{file_name} is not in {self.zip_path.name}")
+                self._copy_out(self.open_member(agency, file_name), target, stat.st_mtime_ns)
+                with self._lock:
+                    self._hot[key] = stat.st_size
+            with self._lock:
+                if key in self._hot:
+                    self._hot.move_to_end(key)
+            self._evict(keep=key)
+            return target
+
+    def _copy_out(self, source: IO[bytes], target: Path, mtime_ns: int):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with source, open(tmp, 'wb') as f:
+                shutil.copyfileobj(source, f, COPY_CHUNK)
+            os.utime(tmp, ns=(mtime_ns, mtime_ns))
+            os.replace(tmp, target)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def _evict(self, keep: tuple):
+        if not self.hot_bytes:
+            return
+        with self._lock:
+            total = sum(self._hot.values())
+            for key in list(self._hot):
+                if total <= self.hot_bytes:
+                    break
+                if key == keep or key in self._in_use:
+                    continue
+                if self._remove_unpinned(self._hot_path(*key)):
+                    total -= self._hot.pop(key)
+
+    @staticmethod
+    def _remove_unpinned(path: Path) -> bool:
+        """Delete a copy unless a reader in another process has it pinned; True if it is gone"""
+        try:
+            handle = open(path, 'rb')
+        except FileNotFoundError:
+            return True
+        with handle:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return False
+            try:
+                # Only the copy that was locked; a fresh extraction may have replaced it meanwhile
+                if os.stat(path).st_ino == os.fstat(handle.fileno()).st_ino:
+                    os.unlink(path)
+            except OSError:
+                pass
+        return True
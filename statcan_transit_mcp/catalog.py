@@ -0,0 +1,201 @@
+"""Dataset Catalog - Per-agency file inventory built once and persisted in the cache"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from archive import GTFSArchive
+from pagination import iter_stream_records, read_stream_header
+
+CATALOG_VERSION = 2
+
+
+def count_rows(f: IO[bytes]) -> int:
+    """Data rows of an open binary file without parsing fields: a line ends a record unless it leaves a quote open"""
+    records = 0
+    inside_quotes = False
+    for line in f:
+        if line.count(b'"') & 1:
+            inside_quotes = not inside_quotes
+        if not inside_quotes and line.strip(b'\r\n'):
+            records += 1
+    return max(records - 1, 0)
+
+
+def first_record(f: IO[bytes]) -> Optional[Dict]:
+    """Header and first data record of an open binary file, skipping blank lines as csv.DictReader does"""
+    records = iter_stream_records(f)
+    for _, columns in records:
+        values = next((record for _, record in records if record), None)
+        return {'columns': columns, 'values': values} if values is not None else None
+    return None
+
+
+class DatasetCatalog:
+    """File list, row counts, byte sizes, CSV headers and mtimes for every agency folder, plus its agency.txt row
+
+    Loaded from <cache_dir>/catalog.json when its recorded data dir mtime still
+    matches; otherwise rebuilt, reusing entries for files whose mtime and size
+    are unchanged.
+    """
+
+    def __init__(self, data_dir: Path, cache_dir: str, archive: Optional[GTFSArchive] = None):
+        self.data_dir = data_dir
+        self.archive = archive
+        self.path = Path(cache_dir) / "catalog.json" if Path(cache_dir).is_dir() else None
+        self._data: Optional[Dict] = None
+        self._lock = threading.Lock()
+
+    def _data_dir_mtime(self) -> Optional[int]:
+        try:
+            return (self.archive.zip_path if self.archive is not None else self.data_dir).stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _is_fresh(self, data: Optional[Dict]) -> bool:
+        return (data is not None and data.get('version') == CATALOG_VERSION
+                and data.get('data_dir_mtime_ns') == self._data_dir_mtime())
+
+    def get(self) -> Dict:
+        """The current catalog; one stat() of the data dir when already loaded"""
+        data = self._data
+        if self._is_fresh(data):
+            return data
+        with self._lock:
+            if self._is_fresh(self._data):
+                return self._data
+            if self._data is None:
+                self._data = self._load()
+                if self._is_fresh(self._data):
+                    return self._data
+            self._data = self._build(self._data)
+            self._save(self._data)
+            return self._data
+
+    def peek(self) -> Optional[Dict]:
+        """The catalog if it is loaded or fresh on disk; None rather than building it (or waiting for a build)"""
+        data = self._data
+        if self._is_fresh(data):
+            return data
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if self._data is None:
+                self._data = self._load()
+            return self._data if self._is_fresh(self._data) else None
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+
+    def refresh(self) -> Dict:
+        """Rebuild now, even if the data dir's mtime is unchanged (e.g. a file was rewritten in place)"""
+        with self._lock:
+            previous = self._data if self._data is not None else self._load()
+            self._data = self._build(previous)
+            self._save(self._data)
+            return self._data
+
+    def fingerprints(self) -> Dict[str, Dict[str, str]]:
+        """{agency: {file: "mtime_ns:size"}} straight from the folder tree or zip index, without reading files"""
+        return {agency: {name: f"{stat.st_mtime_ns}:{stat.st_size}" for name, stat in entries}
+                for agency, entries in self._listing()}
+
+    def _load(self) -> Optional[Dict]:
+        if self.path is None or not self.path.exists():
+            return None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable catalog {self.path}: {e}")
+            return None
+
+    def _save(self, data: Dict):
+        if self.path is None:
+            return
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"Could not persist catalog to {self.path}: {e}")
+
+    def _listing(self) -> Iterator[Tuple[str, List[tuple]]]:
+        """(agency folder, [(file name, stat)]) from the folder tree or the zip index"""
+        if self.archive is not None:
+            for agency in self.archive.folders():
+                yield agency, [(name, self.archive.stat(agency, name)) for name in self.archive.files(agency)]
+            return
+        folders = sorted(d for d in self.data_dir.iterdir() if d.is_dir()) if self.data_dir.exists() else []
+        for agency_dir in folders:
+            entries = []
+            for path in sorted(agency_dir.glob("*.txt")):
+                try:
+                    entries.append((path.name, path.stat()))
+                except OSError as e:
+                    print(f"Error cataloguing {agency_dir.name}/{path.name}: {e}")
+            yield agency_dir.name, entries
+
+    def _open(self, agency: str, name: str) -> IO[bytes]:
+        # Zip members are counted while they decompress, without extracting them
+        if self.archive is not None:
+            return self.archive.open_member(agency, name)
+        return open(self.data_dir / agency / name, 'rb')
+
+    def _agency_record(self, agency: str, entry: Optional[Dict], old: Optional[Dict], old_entry: Dict) -> Optional[Dict]:
+        # The first agency.txt row, so resolving names and listing agencies needs no file reads
+        if entry is None:
+            return None
+        if entry is old and 'agency' in old_entry:
+            return old_entry['agency']
+        try:
+            with self._open(agency, 'agency.txt') as f:
+                return first_record(f)
+        except Exception as e:
+            print(f"Error cataloguing {agency}/agency.txt: {e}")
+            return None
+
+    def _build(self, previous: Optional[Dict]) -> Dict:
+        data_dir_mtime = self._data_dir_mtime()
+        previous_agencies = (previous or {}).get('agencies', {})
+        agencies = {}
+        all_files = set()
+        for agency, entries in self._listing():
+            old_entry = previous_agencies.get(agency, {})
+            old_files = old_entry.get('files', {})
+            files = {}
+            for name, stat in entries:
+                try:
+                    old = old_files.get(name)
+                    if old and old['mtime_ns'] == stat.st_mtime_ns and old['bytes'] == stat.st_size:
+                        files[name] = old
+                        continue
+                    with self._open(agency, name) as f:
+                        rows = count_rows(f)
+                    with self._open(agency, name) as f:
+                        columns = read_stream_header(f)[0]
+                    files[name] = {
+                        'rows': rows,
+                        'bytes': stat.st_size,
+                        'mtime_ns': stat.st_mtime_ns,
+                        'columns': columns,
+                    }
+                except Exception as e:
+                    print(f"Error cataloguing {agency}/{name}: {e}")
+            agencies[agency] = {
+                'files': files,
+                'total_bytes': sum(f['bytes'] for f in files.values()),
+                'agency': self._agency_record(agency, files.get('agency.txt'), old_files.get('agency.txt'), old_entry),
+            }
+            all_files.update(files)
+        return {
+            'version': CATALOG_VERSION,
+            'data_dir_mtime_ns': data_dir_mtime,
+            'agencies': agencies,
+            'all_files': sorted(all_files),
+        }
@@ -0,0 +1,472 @@
+"""Columnar Cache - Typed, memory-mapped copies of GTFS files"""
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from archive import GTFSArchive
+
+MAGIC = b"GTFSCOL1"
+FORMAT_VERSION = 1
+INT_NULL = -(2 ** 63)
+INT_MIN = -(2 ** 63) + 1
+INT_MAX = 2 ** 63 - 1
+
+# Columns worth a value -> row numbers index; other filters scan the column
+INDEXED_COLUMNS = {
+    'agency_id', 'route_id', 'trip_id', 'stop_id', 'service_id', 'shape_id',
+    'parent_station', 'block_id', 'zone_id', 'from_stop_id', 'to_stop_id', 'fare_id',
+}
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _is_int(value: str) -> bool:
+    try:
+        number = int(value)
+    except ValueError:
+        return False
+    return str(number) == value and INT_MIN <= number <= INT_MAX
+
+
+def _is_float(value: str) -> bool:
+    try:
+        number = float(value)
+    except ValueError:
+        return False
+    return repr(number) == value and number == number and number not in (float('inf'), float('-inf'))
+
+
+def _infer_type(values: List[Optional[str]]) -> str:
+    """Pick the narrowest type that round-trips every value exactly"""
+    non_empty = [v for v in values if v != '']
+    if not non_empty or any(v is None for v in non_empty):
+        return 'str'
+    if all(_is_int(v) for v in non_empty):
+        return 'int'
+    if all(_is_float(v) for v in non_empty):
+        return 'float'
+    return 'str'
+
+
+def _int_text(value: int) -> str:
+    return '' if value == INT_NULL else str(value)
+
+
+class _IntTexts(dict):
+    """value -> text, so a slice holds one string per distinct value (ids and flags repeat a lot)"""
+
+    def __missing__(self, value: int) -> str:
+        text = self[value] = _int_text(value)
+        return text
+
+
+class IntColumn:
+    def __init__(self, view: memoryview):
+        self.values = view.cast('q')
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i: int) -> str:
+        return _int_text(self.values[i])
+
+    def slice(self, start: int, stop: int) -> List[str]:
+        return list(map(_IntTexts().__getitem__, self.values[start:stop]))
+
+
+class FloatColumn:
+    def __init__(self, view: memoryview):
+        self.values = view.cast('d')
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i: int) -> str:
+        value = self.values[i]
+        return '' if value != value else repr(value)
+
+    def slice(self, start: int, stop: int) -> List[str]:
+        return ['' if v != v else repr(v) for v in self.values[start:stop]]
+
+
+class StrColumn:
+    """Dictionary-encoded strings: int32 codes into a utf-8 blob, decoded lazily"""
+
+    def __init__(self, codes: memoryview, offsets: memoryview, blob: memoryview):
+        self.codes = codes.cast('i')
+        self.offsets = offsets.cast('q')
+        self.blob = blob
+        self._decoded = [None] * (len(self.offsets) - 1)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def value(self, code: int) -> Optional[str]:
+        if code < 0:
+            return None
+        value = self._decoded[code]
+        if value is None:
+            value = str(self.blob[self.offsets[code]:self.offsets[code + 1]], 'utf-8')
+            self._decoded[code] = value
+        return value
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        return self.value(self.codes[i])
+
+    def slice(self, start: int, stop: int) -> List[Optional[str]]:
+        decoded, value = self._decoded, self.value
+        return [decoded[c] if c >= 0 and decoded[c] is not None else value(c)
+                for c in self.codes[start:stop]]
+
+
+def _read_layout(data: mmap.mmap) -> Tuple[Dict, int]:
+    """The metadata of a compiled file and where its sections start, checking every section lies inside the file
+
+    Reads copies out of the mapping, so a bad file leaves no views that
+    would keep it from being closed.
+    """
+    if len(data) < 12 or data[:8] != MAGIC:
+        raise ValueError("bad magic")
+    meta_len = struct.unpack_from('<I', data, 8)[0]
+    meta = json.loads(data[12:12 + meta_len])
+    base = _align(12 + meta_len)
+    if not isinstance(meta.get('rows'), int) or not isinstance(meta.get('fields'), list):
+        raise ValueError("incomplete metadata")
+    for spec in meta['columns']:
+        if spec['type'] == 'str':
+            sections = [(spec['offset'], spec['length'], 4), (spec['dict_offset'], spec['dict_length'], 8),
+                        (spec['blob_offset'], spec['blob_length'], 1)]
+        else:
+            sections = [(spec['offset'], spec['length'], 8)]
+        for offset, length, itemsize in sections:
+            if offset < 0 or length < 0 or length % itemsize or base + offset + length > len(data):
+                raise ValueError(f"column {spec['name']} is truncated")
+    return meta, base
+
+
+class ColumnarTable:
+    """Read-only view over one compiled GTFS file"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            raise ValueError(f"Bad columnar cache file {path}: {e}") from e
+        try:
+            self.meta, base = _read_layout(self._mmap)
+        except (ValueError, KeyError, TypeError, struct.error) as e:
+            self._mmap.close()
+            raise ValueError(f"Bad columnar cache file {path}: {e}") from e
+        buf = memoryview(self._mmap)
+        self.num_rows = self.meta['rows']
+        self.fields = self.meta['fields']
+        self.columns = {}
+        self._indexes = {}
+        for spec in self.meta['columns']:
+            start, length = base + spec['offset'], spec['length']
+            if spec['type'] == 'int':
+                column = IntColumn(buf[start:start + length])
+            elif spec['type'] == 'float':
+                column = FloatColumn(buf[start:start + length])
+            else:
+                codes = buf[start:start + length]
+                dict_start = base + spec['dict_offset']
+                blob_start = base + spec['blob_offset']
+                offsets = buf[dict_start:dict_start + spec['dict_length']]
+                blob = buf[blob_start:blob_start + spec['blob_length']]
+                column = StrColumn(codes, offsets, blob)
+            self.columns[spec['name']] = column
+
+    def __len__(self):
+        return self.num_rows
+
+    def close(self):
+        """Unmap the file now rather than at garbage collection; the table must not be used afterwards"""
+        # Dropping the column views releases their exports of the mapping, which close() requires
+        self.columns = {}
+        self._indexes = {}
+        self._mmap.close()
+
+    def is_fresh(self, stat: os.stat_result) -> bool:
+        return (self.meta['source_mtime_ns'] == stat.st_mtime_ns
+                and self.meta['source_size'] == stat.st_size)
+
+    def index(self, name: str) -> Dict[str, array]:
+        """Value -> row numbers for one column, built on first use"""
+        index = self._indexes.get(name)
+        if index is not None:
+            return index
+        column = self.columns[name]
+        if isinstance(column, StrColumn):
+            # The extra trailing bucket collects code -1 (missing field)
+            groups = [[] for _ in range(len(column.offsets))]
+            for i, code in enumerate(column.codes):
+                groups[code].append(i)
+            index = {column.value(code): array('i', rows) for code, rows in enumerate(groups[:-1]) if rows}
+        else:
+            groups = {}
+            for i, value in enumerate(column.slice(0, self.num_rows)):
+                groups.setdefault(value, []).append(i)
+            index = {value: array('i', rows) for value, rows in groups.items()}
+        self._indexes[name] = index
+        return index
+
+    def matching_rows(self, filters: Dict[str, List[str]]):
+        """Row numbers, in file order, whose values are in every filter's value list"""
+        if not filters:
+            return range(self.num_rows)
+        candidates = None
+        for name, values in filters.items():
+            if name not in INDEXED_COLUMNS:
+                continue
+            index = self.index(name)
+            rows = set()
+            for value in values:
+                rows.update(index.get(value, ()))
+            candidates = rows if candidates is None else candidates & rows
+        candidates = range(self.num_rows) if candidates is None else sorted(candidates)
+        for name, values in filters.items():
+            if name in INDEXED_COLUMNS:
+                continue
+            wanted = set(values)
+            if isinstance(candidates, range):
+                column_values = self.columns[name].slice(0, self.num_rows)
+                candidates = [i for i in candidates if column_values[i] in wanted]
+            else:
+                column = self.columns[name]
+                candidates = [i for i in candidates if column[i] in wanted]
+        return candidates
+
+    def iter_select(self, filters: Optional[Dict[str, List[str]]] = None, columns: Optional[List[str]] = None,
+                    start: int = 0, chunk_size: int = 1024) -> Iterator[Tuple[int, Tuple]]:
+        """(row number, values in `columns` order) for filtered rows from row number `start` on
+
+        Columns are validated up front; rows are decoded chunk_size at a time.
+        """
+        fields = list(columns) if columns else self.fields
+        unknown = [name for name in list(fields) + list(filters or {}) if name not in self.columns]
+        if unknown:
+            raise ValueError(f"Unknown column(s) {unknown}. Available columns: {self.fields}")
+        rows = self.matching_rows(filters)
+        if isinstance(rows, range):
+            rows = range(max(start, 0), self.num_rows)
+        else:
+            rows = rows[bisect_left(rows, start):]
+        chunk_size = max(chunk_size, 1)
+
+        def generate():
+            for chunk_start in range(0, len(rows), chunk_size):
+                chunk = rows[chunk_start:chunk_start + chunk_size]
+                if isinstance(chunk, range):
+                    values = [self.columns[name].slice(chunk.start, chunk.stop) for name in fields]
+                else:
+                    values = [[column[i] for i in chunk] for column in (self.columns[name] for name in fields)]
+                yield from zip(chunk, zip(*values))
+
+        return generate()
+
+
+def compile_file(source: Path, target: Path, stat=None):
+    """Parse a GTFS .txt file once and write its columnar form atomically
+
+    `stat` overrides the source's own mtime/size as the recorded version
+    (e.g. the zip member an extracted copy came from).
+    """
+    stat = stat or source.stat()
+    num_rows = 0
+    with open(source, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        if len(set(fields)) != len(fields):
+            raise ValueError(f"Duplicate column names in {source}")
+        values = {name: [] for name in fields}
+        for row in reader:
+            if None in row:
+                raise ValueError(f"Row {reader.line_num} of {source} has extra fields")
+            for name in fields:
+                values[name].append(row[name])
+            num_rows += 1
+
+    sections = []
+    specs = []
+    offset = 0
+
+    def add(data: bytes) -> int:
+        nonlocal offset
+        start = offset
+        sections.append(data)
+        padding = _align(len(data)) - len(data)
+        if padding:
+            sections.append(b'\0' * padding)
+        offset += len(data) + padding
+        return start
+
+    for name in fields:
+        column = values.pop(name)
+        kind = _infer_type(column)
+        if kind == 'int':
+            data = array('q', (INT_NULL if v == '' else int(v) for v in column)).tobytes()
+            specs.append({'name': name, 'type': kind, 'offset': add(data), 'length': len(data)})
+        elif kind == 'float':
+            data = array('d', (float('nan') if v == '' else float(v) for v in column)).tobytes()
+            specs.append({'name': name, 'type': kind, 'offset': add(data), 'length': len(data)})
+        else:
+            lookup = {}
+            codes = array('i', (-1 if v is None else lookup.setdefault(v, len(lookup)) for v in column))
+            encoded = [value.encode('utf-8') for value in lookup]
+            offsets = array('q', [0])
+            for item in encoded:
+                offsets.append(offsets[-1] + len(item))
+            codes_data, offsets_data, blob = codes.tobytes(), offsets.tobytes(), b''.join(encoded)
+            specs.append({
+                'name': name, 'type': kind,
+                'offset': add(codes_data), 'length': len(codes_data),
+                'dict_offset': add(offsets_data), 'dict_length': len(offsets_data),
+                'blob_offset': add(blob), 'blob_length': len(blob),
+            })
+
+    meta = json.dumps({
+        'version': FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'source_size': stat.st_size,
+        'rows': num_rows,
+        'fields': fields,
+        'columns': specs,
+    }).encode('utf-8')
+    header = MAGIC + struct.pack('<I', len(meta)) + meta
+    header += b'\0' * (_align(len(header)) - len(header))
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(header)
+            for data in sections:
+                f.write(data)
+        os.replace(tmp, target)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+class ColumnarCache:
+    """Compiled GTFS files under <cache_dir>/columnar/<agency>/<file>.col
+
+    Entries are rebuilt when the source file's mtime or size changes.
+    Missing entries are reported as None so callers can fall back to CSV.
+    With a zip data source, freshness comes from the archive index, so a
+    fresh entry is used without extracting its source file.
+    """
+
+    def __init__(self, cache_dir: str, data_dir: Path, archive: Optional[GTFSArchive] = None):
+        self.root = Path(cache_dir) / "columnar"
+        self.data_dir = data_dir
+        self.archive = archive
+        self.enabled = Path(cache_dir).is_dir()
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def entry_path(self, agency: str, file_name: str) -> Path:
+        return self.root / agency / f"{file_name}.col"
+
+    def _source_stat(self, agency: str, file_name: str):
+        if self.archive is None:
+            return (self.data_dir / agency / file_name).stat()
+        stat = self.archive.stat(agency, file_name)
+        if stat is None:
+            raise FileNotFoundError(f"{agency}/{file_name}")
+        return stat
+
+    def _source(self, agency: str, file_name: str):
+        """Context manager giving the source's path; a zip member is extracted and kept from eviction meanwhile"""
+        if self.archive is None:
+            return nullcontext(self.data_dir / agency / file_name)
+        return self.archive.use(agency, file_name)
+
+    def _source_files(self, agency: str) -> List[str]:
+        if self.archive is None:
+            return [source.name for source in sorted((self.data_dir / agency).glob("*.txt"))]
+        return self.archive.files(agency)
+
+    def _open(self, agency: str, file_name: str, stat: os.stat_result) -> Optional[ColumnarTable]:
+        table = self._tables.get((agency, file_name))
+        if table is not None and table.is_fresh(stat):
+            return table
+        path = self.entry_path(agency, file_name)
+        if not path.exists():
+            return None
+        try:
+            table = ColumnarTable(path)
+        except ValueError as e:
+            # Corrupt or truncated: treated as missing, so compile() replaces it
+            print(f"Ignoring unreadable columnar cache entry: {e}")
+            return None
+        if table.meta.get('version') != FORMAT_VERSION or table.meta.get('byteorder') != sys.byteorder:
+            table.close()
+            return None
+        self._tables[(agency, file_name)] = table
+        return table
+
+    def adopt(self, previous: 'ColumnarCache', agencies: set):
+        """Reuse `previous`'s open tables of these agencies (each is still checked for freshness on use)"""
+        self._tables.update({key: table for key, table in list(previous._tables.items()) if key[0] in agencies})
+
+    def get_table(self, agency: str, file_name: str, rebuild: bool = True) -> Optional[ColumnarTable]:
+        """Return the compiled table, rebuilding it first if the source changed (or None if not `rebuild`)"""
+        if not self.enabled:
+            return None
+        try:
+            stat = self._source_stat(agency, file_name)
+            table = self._open(agency, file_name, stat)
+            if table is None or table.is_fresh(stat):
+                return table
+            return self.compile(agency, file_name) if rebuild else None
+        except Exception as e:
+            print(f"Columnar cache unavailable for {agency}/{file_name}: {e}")
+            return None
+
+    def compile(self, agency: str, file_name: str) -> Optional[ColumnarTable]:
+        """(Re)build one cache entry"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            stat = self._source_stat(agency, file_name)
+            table = self._open(agency, file_name, stat)
+            if table is not None and table.is_fresh(stat):
+                return table
+            with self._source(agency, file_name) as source:
+                compile_file(source, self.entry_path(agency, file_name), stat)
+            self._tables.pop((agency, file_name), None)
+            return self._open(agency, file_name, stat)
+
+    def compile_all(self, agencies: List[str]) -> int:
+        """Build every missing or stale entry; returns the number of files compiled"""
+        if not self.enabled:
+            return 0
+        compiled = 0
+        for agency in agencies:
+            for file_name in self._source_files(agency):
+                try:
+                    stat = self._source_stat(agency, file_name)
+                    table = self._open(agency, file_name, stat)
+                    if table is not None and table.is_fresh(stat):
+                        continue
+                    self.compile(agency, file_name)
+                    compiled += 1
+                except Exception as e:
+                    print(f"Error compiling {agency}/{file_name}: {e}")
+        return compiled
@@ -1,18 +1,141 @@
 """GTFS Data Loader - Universal Access to All Files"""
 import csv
+import hashlib
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import date, timedelta
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from aggregate import Aggregator
+from archive import GTFSArchive, is_archive
+from columnar_cache import ColumnarCache
+from shared_store import load_or_build
+from spatial_index import INDEX_VERSION as SPATIAL_VERSION, StopSpatialIndex
+from search_index import INDEX_VERSION as SEARCH_VERSION, SearchIndex, acronym
+from catalog import DatasetCatalog
+from metrics import COLUMNAR_LOOKUPS, record_file_read
+from geometry import GEOMETRY_VERSION, build_geometry, decode_polyline, encode_polyline, simplify
+from view_cache import AgencyViewCache
+from service_summary import SUMMARY_VERSION, build_service_summaries, summarize
+from departures import INDEX_VERSION as DEPARTURES_VERSION, WEEKDAYS, DepartureIndex, active_service_ids, format_gtfs_time
+from journey import INDEX_VERSION as TIMETABLE_VERSION, ConnectionTimetable
+from pagination import (SparseOffsetIndex, as_row, decode_cursor, encode_cursor, file_signature, iter_records,
+                        iter_stream_records, read_header)
+from row_table import RowTable, shared_schema
+
+class RowStream:
+    """Lazily produced rows of one file; next_cursor is set once iteration stops at the limit
+    
+    Rows travel as lists of values in `fields` order; iterating the stream
+    turns each into a dict, records() hands them over as they are.
+    """
+    
+    def __init__(self, agency: Optional[str], file_name: Optional[str], signature: Optional[str],
+                 start_row: int, positions: Iterator[Tuple[int, Optional[int], Sequence]], limit: Optional[int],
+                 source: str = 'csv', io_stats: Optional[Dict] = None, fields: Sequence[str] = ()):
+        self.agency = agency
+        self.file_name = file_name
+        self.signature = signature
+        self.fields = shared_schema(fields)
+        self.start_row = start_row
+        self.limit = limit
+        self.count = 0
+        self.next_cursor = None
+        self.last_position = None
+        self.source = source
+        self._positions = positions
+        self._io_stats = io_stats
+    
+    @classmethod
+    def empty(cls, start_row: int = 0) -> 'RowStream':
+        return cls(None, None, None, start_row, iter(()), None)
+    
+    def __iter__(self) -> Iterator[Dict]:
+        fields = self.fields
+        for values in self.records():
+            yield as_row(fields, values)
+    
+    def records(self) -> Iterator[Sequence]:
+        """Each row's values in `fields` order (a record may be longer or shorter than the header)"""
+        started = time.perf_counter()
+        try:
+            for row_number, byte_offset, values in self._positions:
+                if self.limit is not None and self.count >= self.limit:
+                    self.next_cursor = encode_cursor(self.agency, self.file_name, self.signature, row_number, byte_offset)
+                    return
+                self.count += 1
+                self.last_position = (row_number, byte_offset)
+                yield values
+        finally:
+            if self.agency is not None:
+                # CSV reads report rows parsed (including filtered-out rows) and bytes; columnar reads rows decoded
+                stats = self._io_stats or {}
+                record_file_read(self.agency, self.file_name, self.source, stats.get('rows', self.count),
+                                 stats.get('bytes', 0), time.perf_counter() - started)
+    
+    def close(self):
+        """Release the open file or mapping now, e.g. when the reader stops early"""
+        close = getattr(self._positions, 'close', None)
+        if close is not None:
+            close()
+    
+    def cursor_at(self, position: Tuple[int, Optional[int]]) -> Optional[str]:
+        """Cursor that resumes at a row this stream yielded (its last_position at the time)"""
+        if self.agency is None:
+            return None
+        return encode_cursor(self.agency, self.file_name, self.signature, *position)
+
+def normalize_filters(filters: Optional[Dict]) -> Dict[str, List[str]]:
+    """{column: value or [values]} -> {column: [values as strings]}"""
+    normalized = {}
+    for name, value in (filters or {}).items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        normalized[name] = [str(v) for v in values]
+    return normalized
+
+# Pages this close to the start of a zip member that isn't extracted yet are read straight from the decompressor
+PARTIAL_READ_ROWS = 5000
 
 class GTFSDataLoader:
-    def __init__(self, data_dir: str = "/app/data/canadian_public_transit_network_database/gtfs"):
-        self.data_dir = Path(data_dir)
+    def __init__(self, data_dir: str = "/app/data/canadian_public_transit_network_database/gtfs",
+                 cache_dir: str = "/app/cache", hot_cache_mb: int = 0):
+        """data_dir is the gtfs/ folder tree, or the dataset zip itself (read without unzipping)"""
+        self.source = Path(data_dir)
+        self.archive = GTFSArchive(self.source, cache_dir, hot_cache_mb * 1024 * 1024) if is_archive(self.source) else None
+        # With a zip, every path below points into the archive's extracted copies
+        self.data_dir = self.archive.root if self.archive is not None else self.source
+        self.cache_dir = cache_dir
+        self.cache_root = Path(cache_dir)
+        # Nationwide and departure indexes go to mapped files every worker process shares
+        self.shared_enabled = self.cache_root.is_dir()
         self.agencies_cache = {}
         self._all_folders = None
         self._agency_aliases = {}
+        self.columnar = ColumnarCache(cache_dir, self.data_dir, self.archive)
+        self.catalog = DatasetCatalog(self.data_dir, cache_dir, self.archive)
+        self._offset_indexes = {}
+        self._offset_locks = {}
+        self._offset_locks_lock = threading.Lock()
+        self._spatial_index = None
+        self._spatial_lock = threading.Lock()
+        self._search_index = None
+        self._search_lock = threading.Lock()
+        self._departure_indexes = {}
+        self._departures_lock = threading.Lock()
+        self._timetables = {}
+        self._timetables_lock = threading.Lock()
+        self.geometry = AgencyViewCache(cache_dir, "geometry", GEOMETRY_VERSION)
+        self.service_summaries = AgencyViewCache(cache_dir, "service_summaries", SUMMARY_VERSION)
+        # {agency: {file: "mtime_ns:size"}} as of loading; hot reload diffs against it
+        self.snapshot = self.catalog.fingerprints()
     
     def get_all_agency_folders(self) -> List[str]:
         if self._all_folders is None:
-            if not self.data_dir.exists():
+            if self.archive is not None:
+                self._all_folders = self.archive.folders()
+            elif not self.data_dir.exists():
                 self._all_folders = []
             else:
                 self._all_folders = [d.name for d in self.data_dir.iterdir() if d.is_dir()]
@@ -21,24 +144,26 @@ class GTFSDataLoader:
     def _build_agency_aliases(self):
         if self._agency_aliases:
             return
+        # Build aside and publish in one assignment so worker threads never see a partial map
+        aliases = {}
         for folder in self.get_all_agency_folders():
             agency = self.load_agency_info(folder)
-            self._agency_aliases[folder.lower()] = folder
+            aliases[folder.lower()] = folder
             if agency:
-                name = agency.get('agency_name', '').lower()
-                words = name.replace('_', ' ').replace('-', ' ').split()
-                if len(words) > 1:
-                    acronym = ''.join(w[0] for w in words if len(w) > 2)
-                    if len(acronym) >= 2:
-                        self._agency_aliases[acronym] = folder
-                self._agency_aliases[name] = folder
+                name = agency.get('agency_name', '')
+                short = acronym(name)
+                if short:
+                    aliases.setdefault(short, folder)
+                aliases[name.lower()] = folder
+        self._agency_aliases = aliases
     
     def resolve_agency_id(self, agency_id: str) -> Optional[str]:
         if not agency_id:
             return None
-        self._build_agency_aliases()
+        # Exact folder ids (what list_agencies returns) need no alias map, so a cold start skips the agency.txt scan
         if agency_id in self.get_all_agency_folders():
             return agency_id
+        self._build_agency_aliases()
         return self._agency_aliases.get(agency_id.lower())
     
     def get_agency_files(self, agency_id: str) -> List[str]:
@@ -47,23 +172,33 @@ class GTFSDataLoader:
         if not resolved:
             return []
         
-        agency_dir = self.data_dir / resolved
-        if not agency_dir.exists():
-            return []
-        
-        txt_files = [f.name for f in agency_dir.glob("*.txt")]
-        return sorted(txt_files)
+        entry = self.catalog.get()['agencies'].get(resolved)
+        return sorted(entry['files']) if entry else []
+    
+    def get_agency_file_details(self, agency_id: str) -> Dict[str, Dict]:
+        """Catalog entry (rows, bytes, mtime_ns, columns) for each file of an agency"""
+        resolved = self.resolve_agency_id(agency_id)
+        entry = self.catalog.get()['agencies'].get(resolved) if resolved else None
+        return entry['files'] if entry else {}
     
     def load_agency_info(self, folder_name: str) -> Optional[Dict]:
         if folder_name in self.agencies_cache:
             return self.agencies_cache[folder_name]
         
+        agency_data = self._catalog_agency_row(folder_name)
+        if agency_data is not None:
+            self.agencies_cache[folder_name] = agency_data
+            return agency_data
+        
         agency_file = self.data_dir / folder_name / "agency.txt"
-        if not agency_file.exists():
+        if self.archive is not None:
+            if self.archive.stat(folder_name, "agency.txt") is None:
+                return None
+        elif not agency_file.exists():
             return None
         
         try:
-            with open(agency_file, 'r', encoding='utf-8') as f:
+            with self._source(folder_name, "agency.txt", agency_file) as path, open(path, 'r', encoding='utf-8') as f:
                 reader = csv.DictReader(f)
                 agency_data = next(reader, None)
                 if agency_data:
@@ -74,73 +209,753 @@ class GTFSDataLoader:
             print(f"Error loading {folder_name}: {e}")
             return None
     
+    def _catalog_agency_row(self, folder_name: str) -> Optional[Dict]:
+        # Taken from an already-built catalog only, and only while agency.txt is the file it was read from
+        catalog = self.catalog.peek()
+        entry = catalog['agencies'].get(folder_name) if catalog else None
+        record = entry.get('agency') if entry else None
+        if not record:
+            return None
+        details = entry['files'].get('agency.txt')
+        if f"{details['mtime_ns']}:{details['bytes']}" != self.snapshot.get(folder_name, {}).get('agency.txt'):
+            return None
+        agency_data = as_row(record['columns'], record['values'])
+        agency_data['folder_name'] = folder_name
+        return agency_data
+    
     def get_dataset_metadata(self) -> Dict:
         """Get dataset overview"""
-        agencies = self.get_all_agency_folders()
-        
-        # Count files across all agencies
-        all_files = set()
-        for folder in agencies:
-            files = self.get_agency_files(folder)
-            all_files.update(files)
+        catalog = self.catalog.get()
         
         return {
             'dataset_name': 'Canadian Public Transit Network Database',
             'source': 'Statistics Canada',
-            'total_agencies': len(agencies),
-            'total_file_types': len(all_files),
-            'all_available_files': sorted(list(all_files)),
+            'total_agencies': len(catalog['agencies']),
+            'total_file_types': len(catalog['all_files']),
+            'total_bytes': sum(agency['total_bytes'] for agency in catalog['agencies'].values()),
+            'all_available_files': catalog['all_files'],
             'core_files': ['agency.txt', 'routes.txt', 'stops.txt', 'stop_times.txt', 'trips.txt'],
             'usage': 'Use list_agencies to find agencies, get_agency_files to see available files, then query_data to get any file'
         }
     
     def search_agencies(self, query: str = None) -> List[Dict]:
-        """Search agencies"""
+        """Search agencies; with a query, ranked index matches first, then plain substring matches"""
+        catalog = self.catalog.get()['agencies']
+        if query:
+            index = self.get_search_index()
+            folders = [hit['agency_id'] for hit in index.search(query, kinds={'agency'}, limit=len(catalog) or 1)]
+            folders += [folder for folder in index.agency_substring_matches(query) if folder not in folders]
+        else:
+            folders = self.get_all_agency_folders()
+        
         results = []
-        for folder in self.get_all_agency_folders():
+        for folder in folders:
             agency = self.load_agency_info(folder)
             if not agency:
                 continue
             
-            if query:
-                query_lower = query.lower()
-                searchable = f"{folder} {agency.get('agency_name', '')} {agency.get('agency_url', '')}".lower()
-                if query_lower not in searchable:
-                    continue
-            
             # Add file count
-            agency['available_files'] = len(self.get_agency_files(folder))
+            agency['available_files'] = len(catalog.get(folder, {}).get('files', {}))
             results.append(agency)
         
         return results
     
-    def get_gtfs_data(self, agency_id: str, file_name: str, limit: int = 10000) -> List[Dict]:
-        """Get data from ANY txt file"""
+    def get_gtfs_data(self, agency_id: str, file_name: str, limit: int = 10000,
+                      filters: Optional[Dict] = None, columns: Optional[List[str]] = None) -> List[Dict]:
+        """Get data from ANY txt file, optionally filtered (equality / IN) and projected"""
+        return self.get_gtfs_page(agency_id, file_name, limit, filters, columns)['data']
+    
+    def get_gtfs_page(self, agency_id: str, file_name: str, limit: int = 10000,
+                      filters: Optional[Dict] = None, columns: Optional[List[str]] = None,
+                      cursor: Optional[str] = None, offset: int = 0) -> Dict:
+        """One page of rows starting at a cursor or row offset, plus the cursor for the next page"""
+        stream = self.open_rows(agency_id, file_name, limit, filters, columns, cursor, offset)
+        data = list(stream)
+        return {'data': data, 'next_cursor': stream.next_cursor, 'start_row': stream.start_row}
+    
+    def get_gtfs_table(self, agency_id: str, file_name: str, limit: Optional[int] = None,
+                       filters: Optional[Dict] = None, columns: Optional[List[str]] = None) -> RowTable:
+        """get_gtfs_data as a compact RowTable, for callers that hold many rows before answering"""
+        stream = self.open_rows(agency_id, file_name, limit, filters, columns)
+        return RowTable(stream.fields).extend(stream.records())
+    
+    def iter_gtfs_data(self, agency_id: str, file_name: str, limit: Optional[int] = None,
+                       filters: Optional[Dict] = None, columns: Optional[List[str]] = None,
+                       cursor: Optional[str] = None, offset: int = 0) -> Iterator[Dict]:
+        """Generator version of get_gtfs_data: rows are produced one at a time"""
+        yield from self.open_rows(agency_id, file_name, limit, filters, columns, cursor, offset)
+    
+    def locate_file(self, agency_id: str, file_name: str) -> Optional[Tuple[str, str, Path]]:
+        """(agency folder, file name with .txt, path) for an existing agency file, else None
+        
+        With a zip data source the path is where the member is extracted to
+        and may not exist yet: read it inside _source().
+        """
         resolved = self.resolve_agency_id(agency_id)
         if not resolved:
             matching = self.search_agencies(agency_id)
             if matching:
                 resolved = matching[0]['folder_name']
             else:
-                return []
+                return None
         
         # Support both "stops" and "stops.txt"
         if not file_name.endswith('.txt'):
             file_name = f"{file_name}.txt"
         
+        if self.archive is not None:
+            if self.archive.stat(resolved, file_name) is None:
+                return None
+            return resolved, file_name, self.data_dir / resolved / file_name
+        
         data_file = self.data_dir / resolved / file_name
         if not data_file.exists():
-            return []
+            return None
+        return resolved, file_name, data_file
+    
+    def _source(self, agency: str, file_name: str, data_file: Path):
+        """Context manager giving the file's path to read; a zip member is extracted and kept from eviction meanwhile"""
+        if self.archive is None:
+            return nullcontext(data_file)
+        return self.archive.use(agency, file_name)
+    
+    def _signature(self, agency: str, file_name: str, data_file: Path) -> str:
+        if self.archive is not None:
+            stat = self.archive.stat(agency, file_name)
+            return f"{stat.st_mtime_ns}:{stat.st_size}"
+        return file_signature(data_file)
+    
+    def get_file_signature(self, agency_id: str, file_name: str) -> Optional[Tuple[str, str, str]]:
+        """(agency folder, file name, "mtime_ns:size") identifying the current version of a file"""
+        located = self.locate_file(agency_id, file_name)
+        if located is None:
+            return None
+        try:
+            return located[0], located[1], self._signature(*located)
+        except OSError:
+            return None
+    
+    def open_rows(self, agency_id: str, file_name: str, limit: Optional[int] = None,
+                  filters: Optional[Dict] = None, columns: Optional[List[str]] = None,
+                  cursor: Optional[str] = None, offset: int = 0) -> 'RowStream':
+        """Resolve and validate a query, returning a lazy stream of its rows
         
-        results = []
+        Bad cursors, malformed filters/columns and unknown columns raise
+        ValueError here, before any row is read.
+        """
+        if filters is not None and not isinstance(filters, dict):
+            raise ValueError("filters must be an object mapping column names to a value or a list of values")
+        if columns is not None and (not isinstance(columns, list) or not all(isinstance(name, str) for name in columns)):
+            raise ValueError("columns must be a list of column names")
+        located = self.locate_file(agency_id, file_name)
+        if located is None:
+            return RowStream.empty(offset)
+        resolved, file_name, data_file = located
+        
+        signature = self._signature(resolved, file_name, data_file)
+        start_offset = None
+        if cursor:
+            position = decode_cursor(cursor)
+            if position.get('a') != resolved or position.get('f') != file_name:
+                raise ValueError(f"Cursor belongs to {position.get('a')}/{position.get('f')}, not {resolved}/{file_name}")
+            if position.get('v') != signature:
+                raise ValueError("The file has changed since this cursor was issued. Start again from the first page.")
+            offset, start_offset = position['r'], position['o']
+        
+        filters = normalize_filters(filters)
+        table = self.columnar.get_table(resolved, file_name)
+        if table is None and filters:
+            # Filtered lookups need the per-column indexes, so compile on demand
+            try:
+                table = self.columnar.compile(resolved, file_name)
+            except Exception as e:
+                print(f"Error compiling {file_name} for {resolved}: {e}")
+        COLUMNAR_LOOKUPS.inc(('hit' if table is not None else 'miss',))
+        if table is not None:
+            chunk_size = min(limit + 1, 1024) if limit is not None else 1024
+            rows = table.iter_select(filters, columns, offset, chunk_size)
+            positions = ((row_number, None, values) for row_number, values in rows)
+            return RowStream(resolved, file_name, signature, offset, positions, limit, 'columnar',
+                             fields=columns or table.fields)
+        if self.archive is not None:
+            if (start_offset is None and limit is not None and offset + limit < PARTIAL_READ_ROWS
+                    and not filters and not self.archive.is_hot(resolved, file_name)):
+                # Header plus the first rows, inflated as they are read; the member is never extracted
+                io_stats = {'rows': 0, 'bytes': 0}
+                fields, positions = self._iter_member_rows(resolved, file_name, columns, offset, io_stats)
+                return RowStream(resolved, file_name, signature, offset, positions, limit, 'zip', io_stats,
+                                 columns or fields)
+        with self._source(resolved, file_name, data_file) as path:
+            fields, data_start = read_header(path)
+        unknown = [name for name in list(columns or []) + list(filters) if name not in fields]
+        if unknown:
+            raise ValueError(f"Unknown column(s) {unknown}. Available columns: {fields}")
+        io_stats = {'rows': 0, 'bytes': 0}
+        positions = self._iter_csv_rows(resolved, file_name, data_file, fields, data_start,
+                                        filters, columns, offset, start_offset, io_stats)
+        return RowStream(resolved, file_name, signature, offset, positions, limit, 'csv', io_stats, columns or fields)
+    
+    def _iter_csv_rows(self, agency: str, file_name: str, data_file: Path, fields: List[str], data_start: int,
+                       filters: Dict[str, List[str]], columns: Optional[List[str]],
+                       offset: int, start_offset: Optional[int],
+                       io_stats: Optional[Dict] = None) -> Iterator[Tuple[int, int, List]]:
+        """(row number, byte offset, values) for matching CSV rows from row `offset` on
+        
+        Values follow `columns` when given, else the whole record. io_stats,
+        when given, is kept updated with records parsed and bytes consumed.
+        """
+        io_stats = io_stats if io_stats is not None else {}
+        # Repeated header names resolve to the last one, as in the dict csv.DictReader builds
+        index = {name: i for i, name in enumerate(fields)}
+        wanted = [(index[name], set(values)) for name, values in filters.items()]
+        projection = [index[name] for name in columns] if columns else None
         try:
-            with open(data_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for i, row in enumerate(reader):
-                    if i >= limit:
-                        break
-                    results.append(dict(row))
+            # Held from eviction until the stream is exhausted or closed
+            with self._source(agency, file_name, data_file) as data_file:
+                row_number = offset
+                if start_offset is None:
+                    if offset == 0:
+                        start_offset = data_start
+                    else:
+                        row_number, start_offset = self._offset_index(agency, file_name, data_file).seek_point(offset)
+                if start_offset is None:
+                    return
+                for record_start, record in iter_records(data_file, start_offset):
+                    io_stats['rows'] = io_stats.get('rows', 0) + 1
+                    io_stats['bytes'] = record_start - start_offset
+                    if not record:
+                        continue
+                    row_number += 1
+                    if row_number <= offset:
+                        continue
+                    width = len(record)
+                    if wanted and any((record[i] if i < width else None) not in values for i, values in wanted):
+                        continue
+                    yield row_number - 1, record_start, ([record[i] if i < width else None for i in projection]
+                                                         if projection else record)
+        except Exception as e:
+            print(f"Error reading {file_name} for {agency}: {e}")
+    
+    def _iter_member_rows(self, agency: str, file_name: str, columns: Optional[List[str]], offset: int,
+                          io_stats: Dict) -> Tuple[List[str], Iterator[Tuple[int, int, List]]]:
+        """The member's header, and (row number, byte offset, values) straight from it; offsets match the extracted file
+        
+        The header is read (and columns validated) before returning, so bad
+        columns raise ValueError up front like the other paths.
+        """
+        member = self.archive.open_member(agency, file_name)
+        records = iter_stream_records(member)
+        fields = next(records, (0, []))[1]
+        unknown = [name for name in columns or [] if name not in fields]
+        if unknown:
+            member.close()
+            raise ValueError(f"Unknown column(s) {unknown}. Available columns: {fields}")
+        index = {name: i for i, name in enumerate(fields)}
+        projection = [index[name] for name in columns] if columns else None
+        
+        def generate():
+            row_number = 0
+            try:
+                for record_start, record in records:
+                    io_stats['rows'] += 1
+                    io_stats['bytes'] = record_start
+                    if not record:
+                        continue
+                    row_number += 1
+                    if row_number <= offset:
+                        continue
+                    width = len(record)
+                    yield row_number - 1, record_start, ([record[i] if i < width else None for i in projection]
+                                                         if projection else record)
+            except Exception as e:
+                print(f"Error reading {file_name} for {agency}: {e}")
+            finally:
+                member.close()
+        
+        return fields, generate()
+    
+    def _offset_index(self, agency: str, file_name: str, data_file: Path) -> SparseOffsetIndex:
+        """Sparse row number -> byte offset index, rebuilt when the file changes"""
+        key = (agency, file_name)
+        index = self._offset_indexes.get(key)
+        if index is not None and index.signature == file_signature(data_file):
+            return index
+        with self._offset_locks_lock:
+            file_lock = self._offset_locks.setdefault(key, threading.Lock())
+        # Concurrent calls on one file (e.g. a batch) wait for a single scan
+        with file_lock:
+            index = self._offset_indexes.get(key)
+            if index is None or index.signature != file_signature(data_file):
+                index = SparseOffsetIndex(data_file)
+                self._offset_indexes[key] = index
+        return index
+    
+    def get_column_values(self, agency_id: str, file_name: str, columns: List[str]) -> Dict[str, List]:
+        """Whole columns of a file as parallel lists; columns the file lacks are left out"""
+        located = self.locate_file(agency_id, file_name)
+        if located is None:
+            return {}
+        resolved, file_name, data_file = located
+        started = time.perf_counter()
+        table = self.columnar.get_table(resolved, file_name)
+        COLUMNAR_LOOKUPS.inc(('hit' if table is not None else 'miss',))
+        if table is not None:
+            values = {name: table.columns[name].slice(0, len(table)) for name in columns if name in table.columns}
+            record_file_read(resolved, file_name, 'columnar', len(table), 0, time.perf_counter() - started)
+            return values
+        values = {}
+        rows = size = 0
+        try:
+            with self._source(resolved, file_name, data_file) as path, open(path, 'r', encoding='utf-8') as f:
+                size = os.fstat(f.fileno()).st_size
+                reader = csv.reader(f)
+                header = next(reader, [])
+                index = {name: i for i, name in enumerate(header)}
+                values = {name: [] for name in columns if name in index}
+                # Repeated values (trip_ids, stop_ids, times) share one string per column
+                wanted = [(index[name], values[name].append, {}.setdefault) for name in values]
+                for record in reader:
+                    if not record:
+                        continue
+                    rows += 1
+                    width = len(record)
+                    for i, append, intern in wanted:
+                        value = record[i] if i < width else None
+                        append(intern(value, value))
         except Exception as e:
             print(f"Error reading {file_name} for {resolved}: {e}")
+        record_file_read(resolved, file_name, 'csv', rows, size, time.perf_counter() - started)
+        return values
+    
+    def _shared_index(self, name: str, signature: str, build: Callable[[], object], load: Callable):
+        """An index built once and mapped from <cache>/shared/<name>.bin by every process, or built in memory without a cache"""
+        if not self.shared_enabled:
+            return build()
+        store = load_or_build(self.cache_root / "shared" / f"{name}.bin", signature,
+                              lambda path: build().save(path, signature))
+        return load(store)
+    
+    def _files_signature(self, version: int, file_names: List[str]) -> str:
+        """Identifies one version of these files across every agency (mtime/size, not contents)"""
+        digest = hashlib.sha1()
+        for folder in sorted(self.get_all_agency_folders()):
+            for file_name in file_names:
+                signature = self.get_file_signature(folder, file_name)
+                digest.update(f"{folder}/{file_name}={signature[2] if signature else '-'};".encode('utf-8'))
+        return f"{version}:{digest.hexdigest()}"
+    
+    def _build_spatial_index(self) -> StopSpatialIndex:
+        index = StopSpatialIndex()
+        for folder in self.get_all_agency_folders():
+            index.add_agency(folder, self.get_gtfs_table(folder, 'stops.txt').iter_dicts())
+        index.freeze()
+        return index
+    
+    def get_spatial_index(self) -> StopSpatialIndex:
+        """Nationwide stop grid, built once from every agency's stops.txt"""
+        with self._spatial_lock:
+            if self._spatial_index is None:
+                self._spatial_index = self._shared_index(
+                    "spatial", self._files_signature(SPATIAL_VERSION, ['stops.txt']),
+                    self._build_spatial_index, StopSpatialIndex.load)
+        return self._spatial_index
+    
+    def _build_search_index(self) -> SearchIndex:
+        self._build_agency_aliases()
+        aliases = {}
+        for alias, folder in self._agency_aliases.items():
+            aliases.setdefault(folder, []).append(alias)
+        index = SearchIndex()
+        for folder in sorted(self.get_all_agency_folders()):
+            index.add_agency(folder, self.load_agency_info(folder), aliases.get(folder, []))
+            index.add_routes(folder, self.get_column_values(
+                folder, 'routes.txt', ['route_id', 'route_short_name', 'route_long_name']))
+            index.add_stops(folder, self.get_column_values(folder, 'stops.txt', ['stop_id', 'stop_name']))
+        index.freeze()
+        return index
+    
+    def get_search_index(self) -> SearchIndex:
+        """Agency, route and stop name index, built once from agency.txt, routes.txt and stops.txt"""
+        with self._search_lock:
+            if self._search_index is None:
+                self._search_index = self._shared_index(
+                    "search", self._files_signature(SEARCH_VERSION, ['agency.txt', 'routes.txt', 'stops.txt']),
+                    self._build_search_index, SearchIndex.load)
+        return self._search_index
+    
+    def get_departure_index(self, agency: str) -> Optional[DepartureIndex]:
+        """Per-stop departure index for one agency folder, rebuilt when stop_times.txt, trips.txt or frequencies.txt change"""
+        signatures = tuple(self.get_file_signature(agency, file_name)
+                           for file_name in ('stop_times.txt', 'trips.txt', 'frequencies.txt'))
+        if None in signatures[:2]:
+            return None
+        with self._departures_lock:
+            cached = self._departure_indexes.get(agency)
+            if cached is None or cached[0] != signatures:
+                index = self._shared_index(
+                    f"departures/{agency}", f"{DEPARTURES_VERSION}:" + '|'.join(sig[2] if sig else '-' for sig in signatures),
+                    lambda: DepartureIndex(
+                        self.get_column_values(agency, 'stop_times.txt', ['trip_id', 'stop_id', 'arrival_time', 'departure_time',
+                                                                          'stop_sequence', 'pickup_type']),
+                        self.get_column_values(agency, 'trips.txt', ['trip_id', 'route_id', 'service_id', 'trip_headsign', 'direction_id']),
+                        self.get_column_values(agency, 'frequencies.txt', ['trip_id', 'start_time', 'end_time', 'headway_secs'])
+                    ), DepartureIndex.load)
+                cached = (signatures, index)
+                self._departure_indexes[agency] = cached
+        return cached[1]
+    
+    def get_next_departures(self, agency_id: str, stop_id: str, day: date, seconds: int, limit: int = 10) -> List[Dict]:
+        """Next departures from a stop (or every platform of a station) at or after `seconds` on `day`"""
+        resolved = self.resolve_agency_id(agency_id)
+        index = self.get_departure_index(resolved) if resolved else None
+        if index is None:
+            raise ValueError(f"Agency '{agency_id}' has no stop_times.txt / trips.txt schedule")
         
-        return results
+        stops = self.get_column_values(resolved, 'stops.txt', ['stop_id', 'parent_station'])
+        stop_ids = [stop_id] + [child for child, parent in zip(stops.get('stop_id', []), stops.get('parent_station', []))
+                                if parent == stop_id]
+        if not any(s in index for s in stop_ids) and stop_id not in stops.get('stop_id', []):
+            raise ValueError(f"Stop '{stop_id}' not found for agency '{resolved}'")
+        
+        calendar = self.get_column_values(resolved, 'calendar.txt', ['service_id', 'start_date', 'end_date'] + WEEKDAYS)
+        calendar_dates = self.get_column_values(resolved, 'calendar_dates.txt', ['service_id', 'date', 'exception_type'])
+        today = active_service_ids(calendar, calendar_dates, day)
+        yesterday = active_service_ids(calendar, calendar_dates, day - timedelta(days=1))
+        
+        routes = self.get_column_values(resolved, 'routes.txt', ['route_id', 'route_short_name', 'route_long_name'])
+        route_names = {route_id: (short, long) for route_id, short, long in zip(
+            routes.get('route_id', []),
+            routes.get('route_short_name') or [None] * len(routes.get('route_id', [])),
+            routes.get('route_long_name') or [None] * len(routes.get('route_id', [])))}
+        
+        departures = []
+        for time, code, departing_stop, day_offset in index.next_departures(stop_ids, seconds, today, yesterday, limit):
+            trip = index.trip_details(code)
+            short_name, long_name = route_names.get(trip['route_id'], (None, None))
+            service_day = day + timedelta(days=day_offset)
+            departures.append({
+                "departure_time": format_gtfs_time(time),
+                "scheduled_time": format_gtfs_time(time - day_offset * 86400),
+                "service_date": service_day.isoformat(),
+                "minutes_away": round((time - seconds) / 60, 1),
+                "stop_id": departing_stop,
+                "route_id": trip['route_id'],
+                "route_short_name": short_name,
+                "route_long_name": long_name,
+                "trip_id": trip['trip_id'],
+                "trip_headsign": trip['trip_headsign'],
+                "direction_id": trip['direction_id'],
+            })
+        return departures
+    
+    def _station_stops(self, agency: str, stop_id: str) -> List[str]:
+        """stop_id plus, for a station, every stop whose parent_station it is"""
+        stops = self.get_column_values(agency, 'stops.txt', ['stop_id', 'parent_station'])
+        return [stop_id] + [child for child, parent in zip(stops.get('stop_id', []), stops.get('parent_station', []))
+                            if parent == stop_id]
+    
+    def get_timetable(self, agency: str) -> Optional[ConnectionTimetable]:
+        """Connection timetable for trip planning, rebuilt when any schedule, stop or transfer file changes"""
+        files = ['stop_times.txt', 'trips.txt', 'stops.txt', 'transfers.txt', 'frequencies.txt']
+        signatures = tuple(self.get_file_signature(agency, file_name) for file_name in files)
+        if None in signatures[:2]:
+            return None
+        with self._timetables_lock:
+            cached = self._timetables.get(agency)
+            if cached is None or cached[0] != signatures:
+                timetable = self._shared_index(
+                    f"timetables/{agency}",
+                    f"{TIMETABLE_VERSION}:" + '|'.join(sig[2] if sig else '-' for sig in signatures),
+                    lambda: ConnectionTimetable(
+                        self.get_column_values(agency, 'stop_times.txt', ['trip_id', 'stop_id', 'arrival_time', 'departure_time',
+                                                                          'stop_sequence', 'pickup_type', 'drop_off_type']),
+                        self.get_column_values(agency, 'trips.txt', ['trip_id', 'route_id', 'service_id', 'trip_headsign']),
+                        self.get_column_values(agency, 'stops.txt', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'parent_station']),
+                        self.get_column_values(agency, 'transfers.txt', ['from_stop_id', 'to_stop_id', 'transfer_type',
+                                                                         'min_transfer_time', 'from_trip_id', 'to_trip_id',
+                                                                         'from_route_id', 'to_route_id']),
+                        self.get_column_values(agency, 'frequencies.txt', ['trip_id', 'start_time', 'end_time', 'headway_secs'])
+                    ), ConnectionTimetable.load)
+                cached = (signatures, timetable)
+                self._timetables[agency] = cached
+        return cached[1]
+    
+    def plan_trip(self, agency_id: str, from_stop_id: str, to_stop_id: str, day: date, seconds: int,
+                  arrive_by: Optional[int] = None, min_transfer_s: int = 0) -> Dict:
+        """Earliest-arriving journey between two stops (or stations) leaving at or after `seconds` on `day`"""
+        resolved = self.resolve_agency_id(agency_id)
+        timetable = self.get_timetable(resolved) if resolved else None
+        if timetable is None:
+            raise ValueError(f"Agency '{agency_id}' has no stop_times.txt / trips.txt schedule")
+        
+        endpoints = []
+        for stop_id in (from_stop_id, to_stop_id):
+            codes = [code for code in (timetable.stop_code(s) for s in self._station_stops(resolved, stop_id)) if code is not None]
+            if not codes:
+                raise ValueError(f"Stop '{stop_id}' not found or not served for agency '{resolved}'")
+            endpoints.append(codes)
+        
+        calendar = self.get_column_values(resolved, 'calendar.txt', ['service_id', 'start_date', 'end_date'] + WEEKDAYS)
+        calendar_dates = self.get_column_values(resolved, 'calendar_dates.txt', ['service_id', 'date', 'exception_type'])
+        today = active_service_ids(calendar, calendar_dates, day)
+        yesterday = active_service_ids(calendar, calendar_dates, day - timedelta(days=1))
+        legs = timetable.earliest_arrival(endpoints[0], endpoints[1], seconds, today, yesterday, arrive_by, min_transfer_s)
+        if legs is None:
+            return {"agency": resolved, "legs": None}
+        
+        routes = self.get_column_values(resolved, 'routes.txt', ['route_id', 'route_short_name', 'route_long_name'])
+        route_names = {route_id: (short, long) for route_id, short, long in zip(
+            routes.get('route_id', []),
+            routes.get('route_short_name') or [None] * len(routes.get('route_id', [])),
+            routes.get('route_long_name') or [None] * len(routes.get('route_id', [])))}
+        
+        def stop(code: int) -> Dict:
+            return {"stop_id": timetable.stop_ids[code], "stop_name": timetable.stop_names[code]}
+        
+        described = []
+        clock = seconds
+        # When to leave the origin: the first ride's departure less any walk to reach it
+        departure_at = None
+        walked = 0
+        for leg in legs:
+            if leg[0] == "ride":
+                _, board, alight, shift = leg
+                trip = timetable.trip_details(timetable.runs[board])
+                short_name, long_name = route_names.get(trip['route_id'], (None, None))
+                departure, arrival = timetable.departures[board] - shift, timetable.arrivals[alight] - shift
+                if departure_at is None:
+                    departure_at = departure - walked
+                described.append({
+                    "mode": "transit",
+                    "from": stop(timetable.from_stops[board]),
+                    "to": stop(timetable.to_stops[alight]),
+                    "departure_time": format_gtfs_time(departure),
+                    "arrival_time": format_gtfs_time(arrival),
+                    "wait_minutes": round((departure - clock) / 60, 1),
+                    "route_id": trip['route_id'],
+                    "route_short_name": short_name,
+                    "route_long_name": long_name,
+                    "trip_id": trip['trip_id'],
+                    "trip_headsign": trip['trip_headsign'],
+                    "service_date": (day - timedelta(days=1) if shift else day).isoformat(),
+                })
+                clock = arrival
+            else:
+                _, origin, destination, path = leg
+                metres = timetable.footpath_metres[path]
+                described.append({
+                    "mode": "walk",
+                    "from": stop(origin),
+                    "to": stop(destination),
+                    "minutes": round(timetable.footpath_seconds[path] / 60, 1),
+                    "distance_m": metres if metres >= 0 else None,
+                    "source": "transfers.txt" if timetable.footpath_kinds[path] else "proximity",
+                })
+                clock += timetable.footpath_seconds[path]
+                if departure_at is None:
+                    walked += timetable.footpath_seconds[path]
+        return {"agency": resolved, "legs": described, "departure": departure_at if departure_at is not None else seconds,
+                "arrival": clock}
+    
+    def _resolve_route_ids(self, agency: str, route_id: str, known: set) -> set:
+        """route_ids meant by `route_id`: itself if known, else routes with that route_short_name"""
+        if route_id in known:
+            return {route_id}
+        # Accept the rider-facing number too ("504" for TTC route_id "504" or "61234")
+        routes = self.get_column_values(agency, 'routes.txt', ['route_id', 'route_short_name'])
+        route_ids = {rid for rid, short in zip(routes.get('route_id', []), routes.get('route_short_name', []))
+                     if short == route_id}
+        if not route_ids:
+            raise ValueError(f"Route '{route_id}' not found for agency '{agency}'")
+        return route_ids
+    
+    def get_route_geometry(self, agency_id: str, route_id: Optional[str] = None, shape_id: Optional[str] = None,
+                           tolerance_m: float = 0) -> Dict:
+        """Encoded polylines of every shape a route uses (or of one shape), simplified to tolerance_m
+        
+        Precomputed levels are served from the geometry cache; other tolerances
+        are simplified from the full shape on request.
+        """
+        resolved = self.resolve_agency_id(agency_id)
+        if not resolved:
+            raise ValueError(f"Agency '{agency_id}' not found. Use list_agencies first.")
+        signature = self.get_file_signature(resolved, 'shapes.txt')
+        if signature is None:
+            raise ValueError(f"Agency '{resolved}' has no shapes.txt")
+        geometry = self.geometry.get(resolved, signature[2], lambda: build_geometry(self.get_column_values(
+            resolved, 'shapes.txt', ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'])))
+        
+        trips = self.get_column_values(resolved, 'trips.txt', ['route_id', 'shape_id', 'direction_id'])
+        trip_routes = trips.get('route_id', [])
+        trip_shapes = trips.get('shape_id') or [None] * len(trip_routes)
+        trip_directions = trips.get('direction_id') or [None] * len(trip_routes)
+        route_ids = self._resolve_route_ids(resolved, route_id, set(trip_routes)) if route_id else set()
+        if not route_id and shape_id not in geometry['shapes']:
+            raise ValueError(f"Shape '{shape_id}' not found in shapes.txt for agency '{resolved}'")
+        
+        usage = {}
+        for trip_route, trip_shape, direction in zip(trip_routes, trip_shapes, trip_directions):
+            if not trip_shape or (trip_route not in route_ids if route_id else trip_shape != shape_id):
+                continue
+            used = usage.setdefault(trip_shape, {"trip_count": 0, "direction_ids": set()})
+            used["trip_count"] += 1
+            if direction:
+                used["direction_ids"].add(direction)
+        shape_ids = sorted(usage) if route_id else [shape_id]
+        
+        level_key = str(int(tolerance_m)) if float(tolerance_m).is_integer() else None
+        shapes, missing = [], []
+        for sid in shape_ids:
+            entry = geometry['shapes'].get(sid)
+            if entry is None:
+                missing.append(sid)
+                continue
+            level = entry['levels'].get(level_key)
+            if level is None:
+                lats, lons = decode_polyline(entry['levels']['0']['polyline'])
+                kept = simplify(lats, lons, tolerance_m)
+                level = {"points": len(kept),
+                         "polyline": encode_polyline([lats[i] for i in kept], [lons[i] for i in kept])}
+            used = usage.get(sid, {"trip_count": 0, "direction_ids": set()})
+            shapes.append({
+                "shape_id": sid,
+                "direction_ids": sorted(used["direction_ids"]),
+                "trip_count": used["trip_count"],
+                "points": level["points"],
+                "points_full": entry['levels']['0']['points'],
+                "length_m": entry['length_m'],
+                "bbox": entry['bbox'],
+                "polyline": level["polyline"],
+            })
+        return {"agency": resolved, "route_ids": sorted(route_ids), "shapes": shapes, "missing_shapes": missing}
+    
+    def get_service_summaries(self, agency: str) -> Optional[Dict]:
+        """Per route/direction/service_id departures and summaries, recomputed when stop_times.txt, trips.txt or frequencies.txt change"""
+        signatures = tuple(self.get_file_signature(agency, file_name)
+                           for file_name in ('stop_times.txt', 'trips.txt', 'frequencies.txt'))
+        if None in signatures[:2]:
+            return None
+        return self.service_summaries.get(agency, '|'.join(sig[2] if sig else '-' for sig in signatures), lambda: build_service_summaries(
+            self.get_column_values(agency, 'stop_times.txt', ['trip_id', 'stop_sequence', 'arrival_time', 'departure_time']),
+            self.get_column_values(agency, 'trips.txt', ['trip_id', 'route_id', 'service_id', 'direction_id']),
+            self.get_column_values(agency, 'frequencies.txt', ['trip_id', 'start_time', 'end_time', 'headway_secs'])))
+    
+    def get_route_service_summary(self, agency_id: str, route_id: Optional[str] = None,
+                                  direction_id: Optional[str] = None, day: Optional[date] = None) -> Dict:
+        """Service span, trips per hour and headways per route and direction
+        
+        With `day`, the service_ids running that day are merged into one summary
+        per route and direction; without it, each service_id is listed with the
+        weekdays and date range calendar.txt gives it.
+        """
+        resolved = self.resolve_agency_id(agency_id)
+        if not resolved:
+            raise ValueError(f"Agency '{agency_id}' not found. Use list_agencies first.")
+        view = self.get_service_summaries(resolved)
+        if view is None:
+            raise ValueError(f"Agency '{resolved}' has no stop_times.txt / trips.txt schedule")
+        by_route = view['routes']
+        route_ids = sorted(self._resolve_route_ids(resolved, route_id, set(by_route)) if route_id else by_route)
+        
+        calendar = self.get_column_values(resolved, 'calendar.txt', ['service_id', 'start_date', 'end_date'] + WEEKDAYS)
+        routes = self.get_column_values(resolved, 'routes.txt', ['route_id', 'route_short_name', 'route_long_name'])
+        route_count = len(routes.get('route_id', []))
+        names = dict(zip(routes.get('route_id', []), zip(routes.get('route_short_name') or [''] * route_count,
+                                                         routes.get('route_long_name') or [''] * route_count)))
+        active = None
+        if day is not None:
+            calendar_dates = self.get_column_values(resolved, 'calendar_dates.txt', ['service_id', 'date', 'exception_type'])
+            active = active_service_ids(calendar, calendar_dates, day)
+        service_ids = calendar.get('service_id', [])
+        columns = {name: calendar.get(name) or [None] * len(service_ids) for name in WEEKDAYS + ['start_date', 'end_date']}
+        patterns = {service_id: {"days": [weekday for weekday in WEEKDAYS if columns[weekday][i] == '1'],
+                                 "start_date": columns['start_date'][i], "end_date": columns['end_date'][i]}
+                    for i, service_id in enumerate(service_ids)}
+        
+        results = []
+        for rid in route_ids:
+            short, long = names.get(rid, ('', ''))
+            entries = [entry for entry in by_route.get(rid, [])
+                       if direction_id is None or entry['direction_id'] == str(direction_id)]
+            if active is None:
+                for entry in entries:
+                    results.append(dict({"route_id": rid, "route_short_name": short, "route_long_name": long,
+                                         "direction_id": entry['direction_id'], "service_id": entry['service_id']},
+                                        **patterns.get(entry['service_id'], {"days": None}), **entry['summary']))
+                continue
+            merged = {}
+            for entry in entries:
+                if entry['service_id'] in active:
+                    merged.setdefault(entry['direction_id'], []).append(entry)
+            for direction, running in sorted(merged.items()):
+                if len(running) == 1:
+                    summary = running[0]['summary']
+                else:
+                    summary = summarize(sorted(s for entry in running for s in entry['departures']))
+                results.append(dict({"route_id": rid, "route_short_name": short, "route_long_name": long,
+                                     "direction_id": direction,
+                                     "service_ids": sorted(entry['service_id'] for entry in running)}, **summary))
+        return {"agency": resolved, "summaries": results}
+    
+    def build_agency_views(self, agencies: Optional[List[str]] = None) -> int:
+        """Precompute route geometry, service summaries and trip-planning timetables (for every agency by default)
+        
+        Timetables are only prebuilt when they go to shared files; otherwise
+        each is built on its agency's first plan_trip call. Returns agencies processed.
+        """
+        built = 0
+        for folder in sorted(agencies if agencies is not None else self.get_all_agency_folders()):
+            try:
+                signature = self.get_file_signature(folder, 'shapes.txt')
+                if signature is not None:
+                    self.geometry.get(folder, signature[2], lambda: build_geometry(self.get_column_values(
+                        folder, 'shapes.txt', ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'])))
+                self.get_service_summaries(folder)
+                if self.shared_enabled:
+                    self.get_timetable(folder)
+                built += 1
+            except Exception as e:
+                print(f"Error building route views for {folder}: {e}")
+        return built
+    
+    def aggregate(self, aggregator: Aggregator, file_name: str, operation: str, column: Optional[str] = None,
+                  group_by: Optional[str] = None, filters: Optional[Dict] = None) -> Dict:
+        """Count / distinct-count / group-by over one file of every agency, computed in worker processes"""
+        if not file_name.endswith('.txt'):
+            file_name = f"{file_name}.txt"
+        cache_dir = self.cache_dir if self.columnar.enabled else None
+        return aggregator.run(str(self.source), cache_dir, sorted(self.get_all_agency_folders()), file_name,
+                              operation, column, group_by, normalize_filters(filters))
+    
+    def build_cache(self, agencies: Optional[List[str]] = None) -> int:
+        """Compile every agency file (or those of `agencies`) into the columnar cache"""
+        return self.columnar.compile_all(agencies if agencies is not None else self.get_all_agency_folders())
+    
+    def warm_up(self, agencies: Optional[List[str]] = None):
+        """Build caches and indexes ahead of requests; per-agency work only for `agencies` when given"""
+        self.build_cache(agencies)
+        self.get_spatial_index()
+        self.get_search_index()
+        self.build_agency_views(agencies)
+    
+    def adopt(self, previous: 'GTFSDataLoader', agencies: List[str]):
+        """Start from `previous`'s in-memory state for agencies whose files are unchanged
+        
+        Agency info, offset and departure indexes, timetables, open columnar
+        tables and derived views are carried over, so warming this loader only re-reads
+        the other agencies. Nationwide indexes are always rebuilt.
+        """
+        keep = set(agencies)
+        self.agencies_cache.update({a: info for a, info in list(previous.agencies_cache.items()) if a in keep})
+        self._offset_indexes.update({key: index for key, index in list(previous._offset_indexes.items()) if key[0] in keep})
+        with previous._departures_lock:
+            departures = {a: cached for a, cached in previous._departure_indexes.items() if a in keep}
+        self._departure_indexes.update(departures)
+        with previous._timetables_lock:
+            timetables = {a: cached for a, cached in previous._timetables.items() if a in keep}
+        self._timetables.update(timetables)
+        self.columnar.adopt(previous.columnar, keep)
+        if self.archive is not None and previous.archive is not None:
+            self.archive.adopt(previous.archive)
+        self.geometry.adopt(previous.geometry, keep)
+        self.service_summaries.adopt(previous.service_summaries, keep)
@@ -0,0 +1,252 @@
+"""Departures - Per-stop departure index and calendar-aware service resolution"""
+from array import array
+from bisect import bisect_left
+from datetime import date
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from shared_store import SharedStore, write_store
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+DAY_SECONDS = 24 * 3600
+INDEX_VERSION = 1
+
+
+def parse_gtfs_time(value: Optional[str]) -> Optional[int]:
+    """'HH:MM[:SS]' (hours may exceed 24) -> seconds after midnight of the service day; None if malformed"""
+    if not value:
+        return None
+    parts = value.strip().split(':')
+    if len(parts) not in (2, 3) or not all(part.isascii() and part.isdigit() for part in parts):
+        return None
+    hours, minutes = int(parts[0]), int(parts[1])
+    seconds = int(parts[2]) if len(parts) == 3 else 0
+    if minutes > 59 or seconds > 59:
+        return None
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def format_gtfs_time(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def parse_service_date(value: str) -> date:
+    """'YYYYMMDD' or 'YYYY-MM-DD'"""
+    digits = value.strip().replace('-', '')
+    if len(digits) != 8 or not digits.isdigit():
+        raise ValueError(f"Invalid date '{value}'. Use YYYY-MM-DD or YYYYMMDD.")
+    return date(int(digits[:4]), int(digits[4:6]), int(digits[6:]))
+
+
+def first_departures(stop_times: Dict[str, List[str]]) -> Dict[str, int]:
+    """trip_id -> seconds at the trip's first timepoint (lowest stop_sequence that has a time)
+
+    Times and sequence numbers repeat heavily, so each distinct string is
+    parsed once; the per-row work is two dict lookups and a comparison.
+    """
+    trip_ids = stop_times.get('trip_id', [])
+    departures = stop_times.get('departure_time') or [None] * len(trip_ids)
+    arrivals = stop_times.get('arrival_time') or [None] * len(trip_ids)
+    sequences = stop_times.get('stop_sequence') or [''] * len(trip_ids)
+    parsed_times: Dict[str, int] = {}
+    parsed_sequences: Dict[str, int] = {}
+    orders: Dict[str, int] = {}
+    firsts: Dict[str, int] = {}
+    for trip_id, sequence, departure, arrival in zip(trip_ids, sequences, departures, arrivals):
+        value = departure or arrival
+        if not value:
+            continue
+        order = parsed_sequences.get(sequence)
+        if order is None:
+            try:
+                order = parsed_sequences[sequence] = int(sequence)
+            except ValueError:
+                continue
+        current = orders.get(trip_id)
+        if current is not None and current <= order:
+            continue
+        seconds = parsed_times.get(value)
+        if seconds is None:
+            parsed = parse_gtfs_time(value)
+            seconds = parsed_times[value] = parsed if parsed is not None else -1
+        if seconds < 0:
+            continue
+        orders[trip_id] = order
+        firsts[trip_id] = seconds
+    return firsts
+
+
+def headway_windows(frequencies: Dict[str, List[str]]) -> Dict[str, List[Tuple[int, int, int]]]:
+    """trip_id -> (start, end, headway) seconds of each frequencies.txt window; rows that don't parse are skipped"""
+    windows: Dict[str, List[Tuple[int, int, int]]] = {}
+    for trip_id, start, end, headway in zip(frequencies.get('trip_id', []), frequencies.get('start_time', []),
+                                            frequencies.get('end_time', []), frequencies.get('headway_secs', [])):
+        start_s, end_s = parse_gtfs_time(start), parse_gtfs_time(end)
+        try:
+            headway_s = int(headway)
+        except (TypeError, ValueError):
+            continue
+        if start_s is not None and end_s is not None and headway_s > 0:
+            windows.setdefault(trip_id, []).append((start_s, end_s, headway_s))
+    return windows
+
+
+def run_starts(windows: Iterable[Tuple[int, int, int]]) -> Iterator[int]:
+    """Start of every run of a frequencies.txt trip: one per headway from each window's start, end excluded
+
+    The trip's stop_times are a template; each run is the template shifted
+    so its first timepoint falls on the run's start.
+    """
+    for start_s, end_s, headway_s in windows:
+        yield from range(start_s, end_s, headway_s)
+
+
+def active_service_ids(calendar: Dict[str, List[str]], calendar_dates: Dict[str, List[str]],
+                       day: date) -> Set[str]:
+    """service_ids running on `day`: calendar.txt weekday patterns, then calendar_dates.txt exceptions"""
+    ymd = day.strftime('%Y%m%d')
+    weekday = WEEKDAYS[day.weekday()]
+    active = set()
+    if calendar.get('service_id') and calendar.get(weekday):
+        for service_id, runs, start, end in zip(calendar['service_id'], calendar[weekday],
+                                                calendar.get('start_date') or [''] * len(calendar['service_id']),
+                                                calendar.get('end_date') or [''] * len(calendar['service_id'])):
+            if runs == '1' and (not start or start <= ymd) and (not end or ymd <= end):
+                active.add(service_id)
+    if calendar_dates.get('service_id') and calendar_dates.get('date'):
+        for service_id, exception_date, exception_type in zip(calendar_dates['service_id'], calendar_dates['date'],
+                                                               calendar_dates.get('exception_type', [])):
+            if exception_date != ymd:
+                continue
+            if exception_type == '1':
+                active.add(service_id)
+            elif exception_type == '2':
+                active.discard(service_id)
+    return active
+
+
+class DepartureIndex:
+    """For every stop, departure seconds sorted ascending with the trip made at each
+
+    Stops are a sorted list; each stop's departures are one slice of the
+    times/codes arrays. service_ids are coded per trip, so filtering a stop's
+    departures compares integers. save()/load() move the same layout through
+    a shared store. Like the trip planner, frequencies.txt trips depart once
+    per run and stops with pickup_type 1 (no boarding) are left out.
+    """
+
+    def __init__(self, stop_times: Dict[str, List[str]], trips: Dict[str, List[str]], frequencies: Dict[str, List[str]]):
+        trip_ids = trips.get('trip_id', [])
+        count = len(trip_ids)
+        self.trip_ids = trip_ids
+        self.trip_route = trips.get('route_id') or [None] * count
+        self.trip_headsign = trips.get('trip_headsign') or [None] * count
+        self.trip_direction = trips.get('direction_id') or [None] * count
+        service_codes: Dict[Optional[str], int] = {}
+        self.trip_service_codes = array('i', (service_codes.setdefault(service_id, len(service_codes))
+                                              for service_id in (trips.get('service_id') or [None] * count)))
+        self.service_ids = list(service_codes)
+        self._service_codes = service_codes
+        trip_codes = {trip_id: code for code, trip_id in enumerate(trip_ids)}
+
+        departures = stop_times.get('departure_time') or []
+        arrivals = stop_times.get('arrival_time') or [None] * len(departures)
+        pickups = stop_times.get('pickup_type') or repeat('')
+        windows = headway_windows(frequencies)
+        firsts = first_departures(stop_times) if windows else {}
+        parsed = {}
+        per_stop = {}
+        for stop_id, trip_id, departure, arrival, pickup in zip(stop_times.get('stop_id', []), stop_times.get('trip_id', []),
+                                                                departures, arrivals, pickups):
+            if pickup == '1':
+                continue
+            value = departure or arrival
+            seconds = parsed.get(value)
+            if seconds is None:
+                seconds = parsed[value] = parse_gtfs_time(value)
+            code = trip_codes.get(trip_id)
+            # Untimed intermediate stops and orphan stop_times can't be scheduled
+            if seconds is None or code is None:
+                continue
+            runs = windows.get(trip_id)
+            if runs is None:
+                per_stop.setdefault(stop_id, []).append((seconds, code))
+            else:
+                offset = seconds - firsts.get(trip_id, seconds)
+                per_stop.setdefault(stop_id, []).extend((start + offset, code) for start in run_starts(runs))
+
+        self.stop_ids = sorted(per_stop)
+        self.stop_starts = array('q', [0])
+        self.times = array('i')
+        self.codes = array('i')
+        for stop_id in self.stop_ids:
+            events = sorted(per_stop[stop_id])
+            self.times.extend(s for s, _ in events)
+            self.codes.extend(c for _, c in events)
+            self.stop_starts.append(len(self.times))
+
+    def save(self, path: Path, signature: str):
+        write_store(path, signature,
+                    {'stop_starts': self.stop_starts, 'times': self.times, 'codes': self.codes,
+                     'trip_service_codes': self.trip_service_codes},
+                    {'stop_ids': self.stop_ids, 'trip_ids': self.trip_ids, 'trip_route': self.trip_route,
+                     'trip_headsign': self.trip_headsign, 'trip_direction': self.trip_direction,
+                     'service_ids': self.service_ids})
+
+    @classmethod
+    def load(cls, store: SharedStore) -> 'DepartureIndex':
+        """Index backed by a mapped store"""
+        index = cls.__new__(cls)
+        for name in ('stop_starts', 'times', 'codes', 'trip_service_codes'):
+            setattr(index, name, store.array(name))
+        for name in ('stop_ids', 'trip_ids', 'trip_route', 'trip_headsign', 'trip_direction', 'service_ids'):
+            setattr(index, name, store.strings(name))
+        index._service_codes = {service_id: code for code, service_id in enumerate(index.service_ids)}
+        return index
+
+    def _stop_position(self, stop_id: str) -> Optional[int]:
+        i = bisect_left(self.stop_ids, stop_id)
+        return i if i < len(self.stop_ids) and self.stop_ids[i] == stop_id else None
+
+    def __contains__(self, stop_id: str) -> bool:
+        return self._stop_position(stop_id) is not None
+
+    def _after(self, stop_id: str, seconds: int, services: Set[int]) -> Iterator[Tuple[int, int]]:
+        position = self._stop_position(stop_id)
+        if position is None:
+            return
+        start, end = self.stop_starts[position], self.stop_starts[position + 1]
+        times, codes, service = self.times, self.codes, self.trip_service_codes
+        for i in range(bisect_left(times, seconds, start, end), end):
+            if service[codes[i]] in services:
+                yield times[i], codes[i]
+
+    def next_departures(self, stop_ids: List[str], seconds: int, services_today: Set[str],
+                        services_yesterday: Set[str], limit: int) -> List[Tuple[int, int, str, int]]:
+        """(seconds after today's midnight, trip code, stop_id, service day offset) of the next departures
+
+        Trips on yesterday's service day with times past 24:00:00 are still running today.
+        """
+        today = {self._service_codes[s] for s in services_today if s in self._service_codes}
+        yesterday = {self._service_codes[s] for s in services_yesterday if s in self._service_codes}
+        found = []
+        for stop_id in stop_ids:
+            for day_offset, services, shift in ((0, today, 0), (-1, yesterday, DAY_SECONDS)):
+                if not services:
+                    continue
+                for count, (time, code) in enumerate(self._after(stop_id, seconds + shift, services)):
+                    if count >= limit:
+                        break
+                    found.append((time - shift, code, stop_id, day_offset))
+        found.sort()
+        return found[:limit]
+
+    def trip_details(self, code: int) -> Dict:
+        return {
+            "trip_id": self.trip_ids[code],
+            "route_id": self.trip_route[code],
+            "trip_headsign": self.trip_headsign[code],
+            "direction_id": self.trip_direction[code],
+            "service_id": self.service_ids[self.trip_service_codes[code]],
+        }
@@ -0,0 +1,1031 @@
+"""Tool Engine - MCP tool definitions and implementations shared by the HTTP and stdio transports
+
+Importing this module is cheap: tool schemas and JSON-RPC framing need no
+data. The GTFS loader, aggregate pool and feed reloader are created by
+start(), which the first tool call runs if the transport has not already
+(the HTTP server starts eagerly, the stdio server once it has listed tools).
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from json_codec import dumps, dumps_bytes
+from geometry import LEVELS as GEOMETRY_LEVELS, POLYLINE_PRECISION, decode_polyline
+from metrics import SlowRequestLog
+from departures import format_gtfs_time, parse_gtfs_time, parse_service_date
+from journey import MAX_JOURNEY_S, WALK_RADIUS_M, WALK_SPEED_MPS
+from result_cache import ResultCache
+from row_table import RowTable
+
+DATASET_URL = "https://www150.statcan.gc.ca/n1/pub/23-26-0003/232600032025001-eng.htm"
+LICENCE = "Open Government Licence - Canada"
+LICENCE_URL = "https://open.canada.ca/en/open-government-licence-canada"
+
+PROTOCOL_VERSION = "2024-11-05"
+SERVER_INFO = {"name": "statcan-transit", "version": "1.0.0"}
+
+# Max tool calls parsing files at once; further calls queue
+TOOL_WORKERS = int(os.environ.get("MCP_TOOL_WORKERS", "4"))
+
+# Byte budget for cached query_data responses
+RESULT_CACHE_MB = int(os.environ.get("MCP_RESULT_CACHE_MB", "256"))
+
+# Tool calls slower than this are logged with a sampled stack profile (0 = off)
+SLOW_REQUEST_MS = float(os.environ.get("MCP_SLOW_REQUEST_MS", "0"))
+
+# Worker processes for cross-agency aggregates (default: one per core)
+AGGREGATE_PROCESSES = int(os.environ.get("MCP_AGGREGATE_PROCESSES", str(os.cpu_count() or 1)))
+
+# Largest query_data payload in bytes; bigger pages are cut short and return a continuation cursor
+MAX_RESPONSE_BYTES = int(os.environ.get("MCP_MAX_RESPONSE_KB", "16384")) * 1024
+MIN_RESPONSE_BYTES = 4 * 1024
+
+# query_data layouts: records (pretty dicts), minified (compact dicts),
+# columnar (field list + row arrays), column_arrays (field list + one array per column)
+QUERY_FORMATS = ("records", "minified", "columnar", "column_arrays")
+
+# The gtfs/ folder tree, or the downloaded dataset zip read in place
+DATA_SOURCE = os.environ.get("MCP_DATA_SOURCE", "/app/data/canadian_public_transit_network_database/gtfs")
+
+# Derived data (catalog, columnar files, shared indexes); without it everything is rebuilt in memory per process
+CACHE_DIR = os.environ.get("MCP_CACHE_DIR", "/app/cache")
+
+# Disk budget for zip members extracted for seeks and compilation (least recently used are deleted; 0 = no limit)
+ZIP_CACHE_MB = int(os.environ.get("MCP_ZIP_CACHE_MB", "2048"))
+
+# Created by start()
+data_loader = None
+aggregator = None
+feed_reloader = None
+result_cache = ResultCache(RESULT_CACHE_MB * 1024 * 1024)
+slow_requests = SlowRequestLog(SLOW_REQUEST_MS)
+_start_lock = threading.Lock()
+
+def _swap_loader(loader):
+    # Requests already running keep the loader they started with
+    global data_loader
+    data_loader = loader
+
+def start():
+    """Create the loader, aggregate pool and feed reloader once; the data modules are imported here"""
+    global data_loader, aggregator, feed_reloader
+    if feed_reloader is not None:
+        return data_loader
+    with _start_lock:
+        if feed_reloader is None:
+            from data_loader import GTFSDataLoader
+            from aggregate import Aggregator
+            from hot_reload import FeedReloader
+            if data_loader is None:
+                data_loader = GTFSDataLoader(DATA_SOURCE, CACHE_DIR, hot_cache_mb=ZIP_CACHE_MB)
+            aggregator = Aggregator(AGGREGATE_PROCESSES)
+            feed_reloader = FeedReloader(
+                lambda: data_loader,
+                lambda: GTFSDataLoader(str(data_loader.source), data_loader.cache_dir, hot_cache_mb=ZIP_CACHE_MB),
+                _swap_loader)
+    return data_loader
+
+def get_tools():
+    """Define MCP tools - Universal data access"""
+    return [
+        {
+            "name": "describe_dataset",
+            "description": "Get dataset overview: total agencies (138), all available file types (39 different GTFS files), and usage instructions.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {},
+                "required": []
+            }
+        },
+        {
+            "name": "list_agencies",
+            "description": "List all 138 transit agencies or search by name/location. Returns agency IDs and file counts.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "Optional: search term (e.g., 'Montreal', 'BC', 'Ontario')"}
+                },
+                "required": []
+            }
+        },
+        {
+            "name": "get_agency_files",
+            "description": "List all available GTFS files for a specific agency. Shows which of the 39 file types this agency has.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "agency_id": {"type": "string", "description": "Agency ID from list_agencies"}
+                },
+                "required": ["agency_id"]
+            }
+        },
+        {
+            "name": "query_data",
+            "description": "Get data from ANY GTFS file for any agency. Supports all 39 file types including: agency, routes, stops, stop_times, trips, shapes, calendar, calendar_dates, feed_info, transfers, fare_attributes, fare_rules, frequencies, and 26 more specialized files. Returns complete data as JSON.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "agency_id": {"type": "string", "description": "Agency ID from list_agencies"},
+                    "file_name": {"type": "string", "description": "File name (e.g., 'stops', 'routes', 'transfers.txt'). Can omit .txt extension."},
+                    "limit": {"type": "number", "description": "Max records (default 5000, max 100000)"},
+                    "filters": {
+                        "type": "object",
+                        "description": "Optional: only return rows matching every filter. Map a column to a value (equality) or a list of values (IN), e.g. {\"trip_id\": \"123\"} or {\"stop_id\": [\"A\", \"B\"]}. Key columns (stop_id, trip_id, route_id, service_id, shape_id, ...) are indexed.",
+                        "additionalProperties": {
+                            "anyOf": [
+                                {"type": ["string", "number"]},
+                                {"type": "array", "items": {"type": ["string", "number"]}}
+                            ]
+                        }
+                    },
+                    "columns": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Optional: only return these columns (e.g. ['stop_id', 'departure_time'])"
+                    },
+                    "cursor": {"type": "string", "description": "Optional: next_cursor from a previous response to fetch the following page"},
+                    "offset": {"type": "number", "description": "Optional: row number to start from (default 0). Ignored when cursor is given."},
+                    "format": {
+                        "type": "string",
+                        "enum": list(QUERY_FORMATS),
+                        "description": "Optional: 'records' (default, indented objects), 'minified' (same objects, no whitespace), 'columnar' (fields + rows as arrays, smallest) or 'column_arrays' (fields + one array per column)"
+                    },
+                    "max_bytes": {"type": "number", "description": "Optional: byte budget for this response (capped by the server limit). Larger pages stop early with truncated=true and a next_cursor."}
+                },
+                "required": ["agency_id", "file_name"]
+            }
+        },
+        {
+            "name": "find_stops_near",
+            "description": "Find transit stops from ALL agencies near a coordinate, nearest first. Searches a nationwide spatial index, so no agency_id is needed.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "lat": {"type": "number", "description": "Latitude (e.g., 45.5017)"},
+                    "lon": {"type": "number", "description": "Longitude (e.g., -73.5673)"},
+                    "radius_m": {"type": "number", "description": "Search radius in metres (default 500, max 50000)"},
+                    "limit": {"type": "number", "description": "Max stops (default 20, max 1000)"},
+                    "agency_id": {"type": "string", "description": "Optional: only stops from this agency"}
+                },
+                "required": ["lat", "lon"]
+            }
+        },
+        {
+            "name": "find_stops_in_bbox",
+            "description": "Find transit stops from ALL agencies inside a latitude/longitude bounding box.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "min_lat": {"type": "number", "description": "Southern edge"},
+                    "min_lon": {"type": "number", "description": "Western edge"},
+                    "max_lat": {"type": "number", "description": "Northern edge"},
+                    "max_lon": {"type": "number", "description": "Eastern edge"},
+                    "limit": {"type": "number", "description": "Max stops (default 100, max 5000)"},
+                    "agency_id": {"type": "string", "description": "Optional: only stops from this agency"}
+                },
+                "required": ["min_lat", "min_lon", "max_lat", "max_lon"]
+            }
+        },
+        {
+            "name": "next_departures",
+            "description": "Next scheduled departures from a stop (or all platforms of a station), with route and headsign. Resolves which services run on the date from calendar and calendar_dates.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "agency_id": {"type": "string", "description": "Agency ID from list_agencies"},
+                    "stop_id": {"type": "string", "description": "stop_id from stops.txt (e.g. from find_stops_near)"},
+                    "date": {"type": "string", "description": "Optional: service date YYYY-MM-DD (default today in the agency's timezone)"},
+                    "time": {"type": "string", "description": "Optional: HH:MM or HH:MM:SS (default now in the agency's timezone)"},
+                    "limit": {"type": "number", "description": "Max departures (default 10, max 100)"}
+                },
+                "required": ["agency_id", "stop_id"]
+            }
+        },
+        {
+            "name": "search",
+            "description": "Typo-tolerant search over agency names, route short/long names and stop names across all agencies (e.g. 'Yonge', 'Montreal', 'Rapidbus'). Returns ranked matches with IDs to use in other tools.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "Search text; accents and case are ignored"},
+                    "kinds": {"type": "array", "items": {"type": "string", "enum": ["agency", "route", "stop"]}, "description": "Optional: restrict to these match kinds (default all)"},
+                    "agency_id": {"type": "string", "description": "Optional: only match routes/stops of this agency"},
+                    "limit": {"type": "number", "description": "Max matches (default 20, max 200)"}
+                },
+                "required": ["query"]
+            }
+        },
+        {
+            "name": "aggregate",
+            "description": "National statistics in one call: count rows or distinct values of a GTFS file across ALL agencies, optionally grouped by a column or by agency (e.g. route_type histogram, trips per agency, which agencies have frequencies.txt). Runs in parallel without returning rows.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "file_name": {"type": "string", "description": "GTFS file to aggregate (e.g. 'routes.txt', 'trips.txt')"},
+                    "operation": {"type": "string", "enum": ["count", "count_distinct"], "description": "count rows (default) or count distinct values of `column`"},
+                    "column": {"type": "string", "description": "Column for count_distinct (e.g. 'route_id')"},
+                    "group_by": {"type": "string", "description": "Optional: a column name (e.g. 'route_type') or 'agency' for one group per agency"},
+                    "filters": {"type": "object", "description": "Optional: only count rows where column equals value, or is in a list of values"},
+                    "limit": {"type": "number", "description": "Max groups returned, largest first (default 1000)"}
+                },
+                "required": ["file_name"]
+            }
+        },
+        {
+            "name": "get_route_geometry",
+            "description": "Map geometry of a route (every shape its trips use) or of one shape, as compact encoded polylines or GeoJSON, optionally simplified. Much smaller than pulling shapes.txt through query_data.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "agency_id": {"type": "string", "description": "Agency ID from list_agencies"},
+                    "route_id": {"type": "string", "description": "route_id or route_short_name (e.g. '504')"},
+                    "shape_id": {"type": "string", "description": "A single shape_id instead of a route"},
+                    "tolerance_m": {"type": "number", "description": f"Optional: simplification tolerance in metres (default 0 = every point). {', '.join(str(level) for level in GEOMETRY_LEVELS)} are precomputed; others are simplified on request."},
+                    "format": {"type": "string", "enum": ["polyline", "geojson"], "description": "encoded polyline (default, precision 5) or GeoJSON FeatureCollection"}
+                },
+                "required": ["agency_id"]
+            }
+        },
+        {
+            "name": "route_service_summary",
+            "description": "How often a route runs: first and last departure, trips per hour and median/min/max headway per direction, for one date or per service pattern. Precomputed per agency, so no stop_times download is needed.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "agency_id": {"type": "string", "description": "Agency ID from list_agencies"},
+                    "route_id": {"type": "string", "description": "Optional: route_id or route_short_name (e.g. '504'); omit for every route"},
+                    "direction_id": {"type": "string", "description": "Optional: '0' or '1'"},
+                    "date": {"type": "string", "description": "Optional: service date (YYYY-MM-DD). Merges the service_ids running that day; omit to list each service_id with its weekdays."},
+                    "limit": {"type": "number", "description": "Max summaries (default 200, max 5000)"}
+                },
+                "required": ["agency_id"]
+            }
+        },
+        {
+            "name": "plan_trip",
+            "description": "Plan a journey between two stops (or stations) of one agency: the earliest arrival leaving at or after a time, with each ride, transfer and walk. Uses a precompiled timetable of every stop-to-stop connection, so no stop_times download is needed.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "agency_id": {"type": "string", "description": "Agency ID from list_agencies"},
+                    "from_stop_id": {"type": "string", "description": "Origin stop_id or station (e.g. from find_stops_near or search)"},
+                    "to_stop_id": {"type": "string", "description": "Destination stop_id or station"},
+                    "date": {"type": "string", "description": "Optional: service date YYYY-MM-DD (default today in the agency's timezone)"},
+                    "time": {"type": "string", "description": "Optional: leave at or after HH:MM or HH:MM:SS (default now in the agency's timezone)"},
+                    "arrive_by": {"type": "string", "description": "Optional: latest acceptable arrival HH:MM; no journey is returned if none arrives in time"},
+                    "min_transfer_minutes": {"type": "number", "description": "Optional: minimum minutes to change vehicles at the same stop (default 0, or the feed's transfers.txt time)"}
+                },
+                "required": ["agency_id", "from_stop_id", "to_stop_id"]
+            }
+        }
+    ]
+
+def describe_dataset_tool() -> Dict:
+    """Tool 1: Dataset overview"""
+    try:
+        metadata = data_loader.get_dataset_metadata()
+        
+        return {"content": [{"type": "text", "text": json.dumps({
+            "dataset": metadata['dataset_name'],
+            "source": metadata['source'],
+            "url": DATASET_URL,
+            "licence": LICENCE,
+            "licence_url": LICENCE_URL,
+            "total_agencies": metadata['total_agencies'],
+            "total_file_types": metadata['total_file_types'],
+            "total_bytes": metadata['total_bytes'],
+            "all_available_files": metadata['all_available_files'],
+            "core_files": metadata['core_files'],
+            "usage": metadata['usage'],
+            "note": "All 39 GTFS file types are supported. Use get_agency_files to see which files each agency has."
+        }, indent=2)}]}
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Failed to load metadata: {str(e)}"
+        })}], "isError": True}
+
+def list_agencies_tool(query: str = None) -> Dict:
+    """Tool 2: List/search agencies"""
+    try:
+        agencies = data_loader.search_agencies(query)
+        
+        if not agencies:
+            msg = "No agencies found"
+            if query:
+                msg += f" matching '{query}'"
+            return {"content": [{"type": "text", "text": json.dumps({
+                "agencies": [],
+                "count": 0,
+                "message": msg
+            })}]}
+        
+        results = []
+        for agency in agencies[:100]:
+            results.append({
+                "agency_id": agency.get('folder_name', ''),
+                "name": agency.get('agency_name', 'Unknown'),
+                "url": agency.get('agency_url', ''),
+                "phone": agency.get('agency_phone', ''),
+                "available_files": agency.get('available_files', 0)
+            })
+        
+        return {"content": [{"type": "text", "text": json.dumps({
+            "agencies": results,
+            "count": len(agencies),
+            "showing": len(results),
+            "message": f"Found {len(agencies)} agencies. Use get_agency_files to see available data files.",
+            "attribution": f"Data from Statistics Canada - {LICENCE}"
+        }, indent=2)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Failed to search agencies: {str(e)}"
+        })}], "isError": True}
+
+def get_agency_files_tool(agency_id: str) -> Dict:
+    """Tool 3: List files for an agency"""
+    try:
+        if not agency_id or not agency_id.strip():
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "agency_id is required"
+            })}], "isError": True}
+        
+        files = data_loader.get_agency_files(agency_id)
+        details = data_loader.get_agency_file_details(agency_id)
+        
+        if not files:
+            resolved = data_loader.resolve_agency_id(agency_id)
+            if not resolved:
+                return {"content": [{"type": "text", "text": json.dumps({
+                    "error": f"Agency '{agency_id}' not found. Use list_agencies to find valid IDs.",
+                    "files": []
+                })}], "isError": True}
+        
+        return {"content": [{"type": "text", "text": json.dumps({
+            "agency_id": agency_id,
+            "files": files,
+            "count": len(files),
+            "file_details": {name: {
+                "rows": info['rows'],
+                "bytes": info['bytes'],
+                "columns": info['columns']
+            } for name, info in details.items()},
+            "message": f"Agency has {len(files)} GTFS files. Use query_data with file_name to get data.",
+            "core_files": [f for f in files if f in ['agency.txt', 'routes.txt', 'stops.txt', 'stop_times.txt', 'trips.txt']]
+        }, indent=2)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Failed to get files: {str(e)}"
+        })}], "isError": True}
+
+def _page_rows(table: RowTable, output_format: str) -> List:
+    """Every row of a table as one query_data output format lays it out: dicts for records, value lists otherwise
+    
+    This is where rows stop being compact, once per response.
+    """
+    return table.dicts() if output_format in ("records", "minified") else table.values()
+
+def _page_payload(table: RowTable, rows: List, count: int, output_format: str) -> Dict:
+    """The first `count` of a table's laid out rows (see _page_rows) as a query_data payload"""
+    if output_format in ("records", "minified"):
+        return {"data": rows[:count]}
+    regular = table.first_long_row is None or table.first_long_row >= count
+    if regular and len(set(table.fields)) == len(table.fields):
+        fields = list(table.fields) if count else []
+        if output_format == "columnar":
+            return {"fields": fields, "rows": rows[:count]}
+        return {"fields": fields, "arrays": [list(column) for column in zip(*rows[:count])]}
+    # Records longer than the header add a None column holding the extras, as in csv.DictReader's dicts
+    data = table.dicts(0, count)
+    fields = list(data[0]) if data else []
+    known = set(fields)
+    for row in data:
+        # Rows only differ from the first when a record has more or fewer values than the header
+        if len(row) != len(fields) or row.keys() - known:
+            for name in row:
+                if name not in known:
+                    known.add(name)
+                    fields.append(name)
+    if output_format == "columnar":
+        return {"fields": fields, "rows": [[row.get(name) for name in fields] for row in data]}
+    return {"fields": fields, "arrays": [[row.get(name) for row in data] for name in fields]}
+
+def _row_overhead(fields: tuple, output_format: str) -> int:
+    """Encoded bytes of one row besides its values (keys, quotes, separators, indentation)"""
+    if output_format == "records":
+        return 8 + sum(len(str(name)) + 12 for name in fields)
+    if output_format == "minified":
+        return 2 + sum(len(str(name)) + 6 for name in fields)
+    return 2 + 3 * len(fields)
+
+def query_data_tool(agency_id: str, file_name: str, limit: int = 5000,
+                    filters: Dict = None, columns: list = None,
+                    cursor: str = None, offset: int = 0,
+                    output_format: str = "records", max_bytes: int = None) -> Dict:
+    """Tool 4: Query any GTFS file"""
+    try:
+        if not agency_id or not agency_id.strip():
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "agency_id is required"
+            })}], "isError": True}
+        
+        if not file_name or not file_name.strip():
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "file_name is required. Use get_agency_files to see available files."
+            })}], "isError": True}
+        
+        output_format = output_format or "records"
+        if output_format not in QUERY_FORMATS:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": f"Unknown format '{output_format}'. Use one of {list(QUERY_FORMATS)}"
+            })}], "isError": True}
+        
+        limit = int(min(limit if limit else 5000, 100000))
+        offset = max(int(offset or 0), 0)
+        budget = MAX_RESPONSE_BYTES
+        if max_bytes:
+            budget = min(max(int(max_bytes), MIN_RESPONSE_BYTES), MAX_RESPONSE_BYTES)
+        
+        try:
+            stream = data_loader.open_rows(agency_id, file_name, limit, filters, columns, cursor, offset)
+            # Rows are held compactly until the page is laid out; reading stops once the
+            # estimated size passes the budget, and the exact check follows below
+            table, positions = RowTable(stream.fields), []
+            estimate, overhead = 0, _row_overhead(stream.fields, output_format)
+            for values in stream.records():
+                estimate += overhead + sum(len(value) for value in values if value)
+                table.append(values)
+                positions.append(stream.last_position)
+                if estimate > budget and len(table) > 1:
+                    break
+        except ValueError as e:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": str(e),
+                "data": [],
+                "count": 0
+            })}], "isError": True}
+        
+        if not len(table) and not cursor and not offset:
+            resolved = data_loader.resolve_agency_id(agency_id)
+            if not resolved:
+                return {"content": [{"type": "text", "text": json.dumps({
+                    "error": f"Agency '{agency_id}' not found. Use list_agencies first.",
+                    "data": [],
+                    "count": 0
+                })}], "isError": True}
+            available_files = data_loader.get_agency_files(agency_id)
+            txt_name = file_name if file_name.endswith('.txt') else f"{file_name}.txt"
+            if txt_name not in available_files:
+                return {"content": [{"type": "text", "text": json.dumps({
+                    "error": f"File '{file_name}' not found for agency '{resolved}'. Available files: {available_files}",
+                    "data": [],
+                    "count": 0,
+                    "available_files": available_files
+                })}], "isError": True}
+        
+        meta = {
+            "agency_id": agency_id,
+            "file_name": file_name,
+            "format": output_format,
+            "limit_applied": limit,
+            "start_row": stream.start_row,
+            "attribution": f"Data from Statistics Canada - {LICENCE}"
+        }
+        if filters:
+            meta["filters"] = filters
+        if columns:
+            meta["columns"] = columns
+        
+        # A page cut while reading ends before the row that crossed the budget
+        kept = len(table) - 1 if estimate > budget and len(table) > 1 else len(table)
+        rows = _page_rows(table, output_format)
+        while True:
+            response = _page_payload(table, rows, kept, output_format)
+            response["count"] = kept
+            if kept < len(table):
+                # Resume at the first row left out; it has been read, so its exact position is known
+                response["next_cursor"] = stream.cursor_at(positions[kept])
+                response["truncated"] = True
+                response["message"] = (f"Retrieved {kept} records (cut to fit the {budget}-byte response "
+                                       f"budget; pass next_cursor to get the rest)")
+            else:
+                response["next_cursor"] = stream.next_cursor
+                response["truncated"] = False
+                response["message"] = f"Retrieved {kept} records" + (
+                    f" (limited to {limit}; pass next_cursor to get the next page)" if stream.next_cursor else "")
+            response.update(meta)
+            text = dumps(response, indent=output_format == "records")
+            size = len(text.encode('utf-8'))
+            if size <= budget or kept <= 1:
+                break
+            # Rows are similar in size, so scale down in proportion, with a little slack
+            kept = max(1, min(kept - 1, int(kept * budget / size * 0.97)))
+        return {"content": [{"type": "text", "text": text}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Query failed: {str(e)}"
+        })}], "isError": True}
+
+def _resolve_optional_agency(agency_id: str):
+    """(folder, error) for an optional agency_id argument"""
+    if not agency_id:
+        return None, None
+    resolved = data_loader.resolve_agency_id(agency_id)
+    if not resolved:
+        return None, f"Agency '{agency_id}' not found. Use list_agencies first."
+    return resolved, None
+
+def find_stops_near_tool(lat: float, lon: float, radius_m: float = 500, limit: int = 20,
+                         agency_id: str = None) -> Dict:
+    """Tool 5: Nearest stops across all agencies"""
+    try:
+        if lat is None or lon is None:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "lat and lon are required"
+            })}], "isError": True}
+        lat, lon = float(lat), float(lon)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "lat must be within [-90, 90] and lon within [-180, 180]"
+            })}], "isError": True}
+        radius_m = min(max(float(radius_m or 500), 1.0), 50000.0)
+        limit = int(min(limit if limit else 20, 1000))
+        agency, error = _resolve_optional_agency(agency_id)
+        if error:
+            return {"content": [{"type": "text", "text": json.dumps({"error": error, "stops": [], "count": 0})}], "isError": True}
+        
+        stops = data_loader.get_spatial_index().near(lat, lon, radius_m, limit, agency)
+        
+        return {"content": [{"type": "text", "text": json.dumps({
+            "stops": stops,
+            "count": len(stops),
+            "center": {"lat": lat, "lon": lon},
+            "radius_m": radius_m,
+            "message": f"Found {len(stops)} stops within {radius_m:g} m" + (f" (limited to {limit})" if len(stops) == limit else ""),
+            "attribution": f"Data from Statistics Canada - {LICENCE}"
+        }, indent=2)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Stop search failed: {str(e)}"
+        })}], "isError": True}
+
+def find_stops_in_bbox_tool(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                            limit: int = 100, agency_id: str = None) -> Dict:
+    """Tool 6: Stops inside a bounding box across all agencies"""
+    try:
+        if None in (min_lat, min_lon, max_lat, max_lon):
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "min_lat, min_lon, max_lat and max_lon are required"
+            })}], "isError": True}
+        min_lat, min_lon, max_lat, max_lon = float(min_lat), float(min_lon), float(max_lat), float(max_lon)
+        if min_lat > max_lat or min_lon > max_lon:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "min_lat/min_lon must not be greater than max_lat/max_lon"
+            })}], "isError": True}
+        limit = int(min(limit if limit else 100, 5000))
+        agency, error = _resolve_optional_agency(agency_id)
+        if error:
+            return {"content": [{"type": "text", "text": json.dumps({"error": error, "stops": [], "count": 0})}], "isError": True}
+        
+        found = data_loader.get_spatial_index().in_bbox(min_lat, min_lon, max_lat, max_lon, limit, agency)
+        
+        return {"content": [{"type": "text", "text": json.dumps({
+            "stops": found['stops'],
+            "count": len(found['stops']),
+            "total_in_bbox": found['total'],
+            "message": f"Found {found['total']} stops in bounding box" + (f" (showing {limit})" if found['total'] > limit else ""),
+            "attribution": f"Data from Statistics Canada - {LICENCE}"
+        }, indent=2)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Stop search failed: {str(e)}"
+        })}], "isError": True}
+
+def _agency_now(agency_folder: str) -> datetime:
+    """Current local time in the agency's timezone (server time if unknown)"""
+    timezone = (data_loader.load_agency_info(agency_folder) or {}).get('agency_timezone')
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.now(ZoneInfo(timezone))
+    except Exception:
+        return datetime.now()
+
+def next_departures_tool(agency_id: str, stop_id: str, date: str = None, time: str = None,
+                         limit: int = 10) -> Dict:
+    """Tool 7: Next departures at a stop"""
+    try:
+        if not agency_id or not stop_id:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "agency_id and stop_id are required"
+            })}], "isError": True}
+        resolved = data_loader.resolve_agency_id(agency_id)
+        if not resolved:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": f"Agency '{agency_id}' not found. Use list_agencies first."
+            })}], "isError": True}
+        limit = int(min(limit if limit else 10, 100))
+        
+        now = _agency_now(resolved)
+        try:
+            day = parse_service_date(date) if date else now.date()
+            seconds = parse_gtfs_time(time) if time else now.hour * 3600 + now.minute * 60 + now.second
+            if seconds is None:
+                raise ValueError(f"Invalid time '{time}'. Use HH:MM or HH:MM:SS.")
+            departures = data_loader.get_next_departures(resolved, str(stop_id), day, seconds, limit)
+        except ValueError as e:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": str(e),
+                "departures": [],
+                "count": 0
+            })}], "isError": True}
+        
+        return {"content": [{"type": "text", "text": json.dumps({
+            "agency_id": resolved,
+            "stop_id": stop_id,
+            "date": day.isoformat(),
+            "time": f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}",
+            "departures": departures,
+            "count": len(departures),
+            "message": f"Next {len(departures)} scheduled departures" if departures else "No more scheduled departures from this stop on this date",
+            "attribution": f"Data from Statistics Canada - {LICENCE}"
+        }, indent=2)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Departure lookup failed: {str(e)}"
+        })}], "isError": True}
+
+def search_tool(query: str, kinds: List[str] = None, agency_id: str = None, limit: int = 20) -> Dict:
+    """Tool 8: Fuzzy search over agencies, routes and stops"""
+    try:
+        if not query or not str(query).strip():
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "query is required"
+            })}], "isError": True}
+        kinds = set(kinds) if kinds else None
+        if kinds and not kinds <= {"agency", "route", "stop"}:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "kinds may only contain 'agency', 'route' and 'stop'"
+            })}], "isError": True}
+        limit = int(min(limit if limit else 20, 200))
+        agency, error = _resolve_optional_agency(agency_id)
+        if error:
+            return {"content": [{"type": "text", "text": json.dumps({"error": error, "matches": [], "count": 0})}], "isError": True}
+        
+        matches = data_loader.get_search_index().search(str(query), kinds, agency, limit)
+        
+        return {"content": [{"type": "text", "text": json.dumps({
+            "query": query,
+            "matches": matches,
+            "count": len(matches),
+            "message": f"Found {len(matches)} matches" if matches else f"Nothing matched '{query}'",
+            "attribution": f"Data from Statistics Canada - {LICENCE}"
+        }, indent=2)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Search failed: {str(e)}"
+        })}], "isError": True}
+
+def aggregate_tool(file_name: str, operation: str = "count", column: str = None, group_by: str = None,
+                   filters: Dict = None, limit: int = 1000) -> Dict:
+    """Tool 9: Cross-agency aggregates"""
+    try:
+        if not file_name or not file_name.strip():
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "file_name is required. Use describe_dataset to see available files."
+            })}], "isError": True}
+        limit = int(min(limit if limit else 1000, 100000))
+        operation = operation or "count"
+        
+        try:
+            result = data_loader.aggregate(aggregator, file_name, operation, column, group_by, filters)
+        except ValueError as e:
+            return {"content": [{"type": "text", "text": json.dumps({"error": str(e)})}], "isError": True}
+        
+        groups = sorted(result['groups'].items(), key=lambda item: (-item[1], str(item[0])))
+        response = {
+            "file_name": file_name,
+            "operation": operation,
+            "column": column,
+            "group_by": group_by,
+        }
+        if group_by:
+            response["groups"] = [{"value": value, "count": count} for value, count in groups[:limit]]
+            response["group_count"] = len(groups)
+        else:
+            response["result"] = groups[0][1] if groups else 0
+        if operation == "count":
+            response["total_rows"] = sum(count for _, count in groups)
+        if filters:
+            response["filters"] = filters
+        response.update({
+            "agencies_scanned": len(result['agencies_scanned']),
+            "agencies_without_file": result['agencies_without_file'],
+            "agencies_missing_column": result['agencies_missing_column'],
+            "errors": result['errors'],
+            "message": f"Aggregated {file_name} across {len(result['agencies_scanned'])} agencies" + (
+                f" (showing {limit} of {len(groups)} groups)" if group_by and len(groups) > limit else ""),
+            "attribution": f"Data from Statistics Canada - {LICENCE}"
+        })
+        return {"content": [{"type": "text", "text": json.dumps(response, indent=2)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Aggregate failed: {str(e)}"
+        })}], "isError": True}
+
+def get_route_geometry_tool(agency_id: str, route_id: str = None, shape_id: str = None,
+                            tolerance_m: float = 0, output_format: str = "polyline") -> Dict:
+    """Tool 10: Route shapes as polylines or GeoJSON"""
+    try:
+        if not agency_id or not agency_id.strip():
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "agency_id is required"
+            })}], "isError": True}
+        if not route_id and not shape_id:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "route_id or shape_id is required"
+            })}], "isError": True}
+        output_format = output_format or "polyline"
+        if output_format not in ("polyline", "geojson"):
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": f"Unknown format '{output_format}'. Use 'polyline' or 'geojson'"
+            })}], "isError": True}
+        tolerance_m = max(float(tolerance_m or 0), 0.0)
+        
+        try:
+            result = data_loader.get_route_geometry(agency_id, route_id, shape_id, tolerance_m)
+        except ValueError as e:
+            return {"content": [{"type": "text", "text": json.dumps({"error": str(e)})}], "isError": True}
+        
+        shapes = result['shapes']
+        meta = {
+            "agency_id": result['agency'],
+            "route_ids": result['route_ids'],
+            "tolerance_m": tolerance_m,
+            "count": len(shapes),
+            "missing_shapes": result['missing_shapes'],
+            "message": f"{len(shapes)} shapes, {sum(s['points'] for s in shapes)} of "
+                       f"{sum(s['points_full'] for s in shapes)} points kept",
+            "attribution": f"Data from Statistics Canada - {LICENCE}"
+        }
+        if output_format == "polyline":
+            response = {"shapes": shapes, "polyline_precision": POLYLINE_PRECISION}
+            response.update(meta)
+        else:
+            features = []
+            for shape in shapes:
+                lats, lons = decode_polyline(shape['polyline'])
+                properties = {key: value for key, value in shape.items() if key != 'polyline'}
+                features.append({
+                    "type": "Feature",
+                    "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat, lon in zip(lats, lons)]},
+                    "properties": properties
+                })
+            response = {"type": "FeatureCollection", "features": features}
+            response.update(meta)
+        return {"content": [{"type": "text", "text": dumps(response)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Route geometry failed: {str(e)}"
+        })}], "isError": True}
+
+def route_service_summary_tool(agency_id: str, route_id: str = None, direction_id: str = None,
+                               date_text: str = None, limit: int = 200) -> Dict:
+    """Tool 11: Route span, frequency and headways"""
+    try:
+        if not agency_id or not agency_id.strip():
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "agency_id is required"
+            })}], "isError": True}
+        limit = int(min(limit if limit else 200, 5000))
+        direction_id = None if direction_id in (None, "") else str(direction_id)
+        
+        try:
+            day = parse_service_date(date_text) if date_text else None
+            result = data_loader.get_route_service_summary(agency_id, route_id, direction_id, day)
+        except ValueError as e:
+            return {"content": [{"type": "text", "text": json.dumps({"error": str(e)})}], "isError": True}
+        
+        summaries = result['summaries']
+        response = {
+            "agency_id": result['agency'],
+            "route_id": route_id,
+            "direction_id": direction_id,
+            "date": day.isoformat() if day else None,
+            "summaries": summaries[:limit],
+            "count": min(len(summaries), limit),
+            "message": (f"{len(summaries)} route/direction summaries" + (f" for {day.isoformat()}" if day else " by service_id")
+                        + (f" (showing {limit})" if len(summaries) > limit else "")
+                        + ("" if summaries or not day else "; no service runs that day")),
+            "notes": "Departures are taken at each trip's first timed stop. Times past 24:00:00 run after midnight but belong to the service day they started on. Headways are minutes between consecutive departures in the same direction.",
+            "attribution": f"Data from Statistics Canada - {LICENCE}"
+        }
+        return {"content": [{"type": "text", "text": json.dumps(response, indent=2)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Service summary failed: {str(e)}"
+        })}], "isError": True}
+
+def plan_trip_tool(agency_id: str, from_stop_id: str, to_stop_id: str, date: str = None, time: str = None,
+                   arrive_by: str = None, min_transfer_minutes: float = 0) -> Dict:
+    """Tool 12: Earliest-arrival journey between two stops"""
+    try:
+        if not agency_id or not from_stop_id or not to_stop_id:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": "agency_id, from_stop_id and to_stop_id are required"
+            })}], "isError": True}
+        resolved = data_loader.resolve_agency_id(agency_id)
+        if not resolved:
+            return {"content": [{"type": "text", "text": json.dumps({
+                "error": f"Agency '{agency_id}' not found. Use list_agencies first."
+            })}], "isError": True}
+        
+        now = _agency_now(resolved)
+        try:
+            day = parse_service_date(date) if date else now.date()
+            seconds = parse_gtfs_time(time) if time else now.hour * 3600 + now.minute * 60 + now.second
+            if seconds is None:
+                raise ValueError(f"Invalid time '{time}'. Use HH:MM or HH:MM:SS.")
+            deadline = parse_gtfs_time(arrive_by) if arrive_by else None
+            if arrive_by and deadline is None:
+                raise ValueError(f"Invalid arrive_by '{arrive_by}'. Use HH:MM or HH:MM:SS.")
+            result = data_loader.plan_trip(resolved, str(from_stop_id), str(to_stop_id), day, seconds, deadline,
+                                           int(max(float(min_transfer_minutes or 0), 0) * 60))
+        except ValueError as e:
+            return {"content": [{"type": "text", "text": json.dumps({"error": str(e)})}], "isError": True}
+        
+        legs = result['legs']
+        response = {
+            "agency_id": resolved,
+            "from_stop_id": from_stop_id,
+            "to_stop_id": to_stop_id,
+            "date": day.isoformat(),
+            "depart_after": format_gtfs_time(seconds),
+            "arrive_by": format_gtfs_time(deadline) if deadline is not None else None,
+        }
+        if legs is None:
+            response.update(journey=None, message=(
+                f"No journey arrives by {format_gtfs_time(deadline)}" if deadline is not None else
+                f"No journey found leaving within {MAX_JOURNEY_S // 3600} hours of {format_gtfs_time(seconds)}"))
+        else:
+            rides = [leg for leg in legs if leg['mode'] == 'transit']
+            start = result['departure']
+            response.update(journey={
+                "departure_time": format_gtfs_time(start),
+                "arrival_time": format_gtfs_time(result['arrival']),
+                "duration_minutes": round((result['arrival'] - start) / 60, 1),
+                "transfers": max(len(rides) - 1, 0),
+                "legs": legs,
+            }, message=(f"Arrive {format_gtfs_time(result['arrival'])} with {max(len(rides) - 1, 0)} transfer(s)"
+                        if legs else "Origin and destination are the same stop"))
+        response.update(
+            notes=f"Earliest arrival by scheduled service. Times between timepoints are interpolated; walks use transfers.txt or stops within {WALK_RADIUS_M} m at {WALK_SPEED_MPS} m/s. Times past 24:00:00 belong to the service day they started on.",
+            attribution=f"Data from Statistics Canada - {LICENCE}")
+        return {"content": [{"type": "text", "text": json.dumps(response, indent=2)}]}
+    
+    except Exception as e:
+        return {"content": [{"type": "text", "text": json.dumps({
+            "error": f"Trip planning failed: {str(e)}"
+        })}], "isError": True}
+
+def call_tool(tool_name: str, tool_args: Dict) -> Dict:
+    """Run one tool synchronously; called on a worker thread"""
+    start()
+    if tool_name == "describe_dataset":
+        return describe_dataset_tool()
+    elif tool_name == "list_agencies":
+        return list_agencies_tool(tool_args.get("query"))
+    elif tool_name == "get_agency_files":
+        return get_agency_files_tool(tool_args.get("agency_id", ""))
+    elif tool_name == "query_data":
+        return query_data_tool(
+            tool_args.get("agency_id", ""),
+            tool_args.get("file_name", ""),
+            tool_args.get("limit", 5000),
+            tool_args.get("filters"),
+            tool_args.get("columns"),
+            tool_args.get("cursor"),
+            tool_args.get("offset", 0),
+            tool_args.get("format", "records"),
+            tool_args.get("max_bytes")
+        )
+    elif tool_name == "find_stops_near":
+        return find_stops_near_tool(
+            tool_args.get("lat"),
+            tool_args.get("lon"),
+            tool_args.get("radius_m", 500),
+            tool_args.get("limit", 20),
+            tool_args.get("agency_id")
+        )
+    elif tool_name == "find_stops_in_bbox":
+        return find_stops_in_bbox_tool(
+            tool_args.get("min_lat"),
+            tool_args.get("min_lon"),
+            tool_args.get("max_lat"),
+            tool_args.get("max_lon"),
+            tool_args.get("limit", 100),
+            tool_args.get("agency_id")
+        )
+    elif tool_name == "next_departures":
+        return next_departures_tool(
+            tool_args.get("agency_id", ""),
+            tool_args.get("stop_id", ""),
+            tool_args.get("date"),
+            tool_args.get("time"),
+            tool_args.get("limit", 10)
+        )
+    elif tool_name == "search":
+        return search_tool(
+            tool_args.get("query", ""),
+            tool_args.get("kinds"),
+            tool_args.get("agency_id"),
+            tool_args.get("limit", 20)
+        )
+    elif tool_name == "aggregate":
+        return aggregate_tool(
+            tool_args.get("file_name", ""),
+            tool_args.get("operation", "count"),
+            tool_args.get("column"),
+            tool_args.get("group_by"),
+            tool_args.get("filters"),
+            tool_args.get("limit", 1000)
+        )
+    elif tool_name == "get_route_geometry":
+        return get_route_geometry_tool(
+            tool_args.get("agency_id", ""),
+            tool_args.get("route_id"),
+            tool_args.get("shape_id"),
+            tool_args.get("tolerance_m", 0),
+            tool_args.get("format", "polyline")
+        )
+    elif tool_name == "route_service_summary":
+        return route_service_summary_tool(
+            tool_args.get("agency_id", ""),
+            tool_args.get("route_id"),
+            tool_args.get("direction_id"),
+            tool_args.get("date"),
+            tool_args.get("limit", 200)
+        )
+    elif tool_name == "plan_trip":
+        return plan_trip_tool(
+            tool_args.get("agency_id", ""),
+            tool_args.get("from_stop_id", ""),
+            tool_args.get("to_stop_id", ""),
+            tool_args.get("date"),
+            tool_args.get("time"),
+            tool_args.get("arrive_by"),
+            tool_args.get("min_transfer_minutes", 0)
+        )
+    raise ValueError(f"Unknown tool: {tool_name}")
+
+TOOL_NAMES = {tool['name'] for tool in get_tools()}
+
+def call_tool_encoded(tool_name: str, tool_args: Dict) -> Tuple[bytes, bool]:
+    """Run one tool and return its JSON-encoded result and its isError flag, serving query_data from the result cache"""
+    start()
+    with slow_requests.track(tool_name, {"arguments": tool_args}):
+        return _call_tool_encoded(tool_name, tool_args)
+
+def _call_tool_encoded(tool_name: str, tool_args: Dict) -> Tuple[bytes, bool]:
+    key = None
+    if tool_name == "query_data":
+        signature = data_loader.get_file_signature(tool_args.get("agency_id") or "", tool_args.get("file_name") or "")
+        if signature is not None:
+            # The file's mtime/size is part of the key, so a changed file never serves stale bytes
+            key = (tool_name, signature, json.dumps(tool_args, sort_keys=True, default=str))
+            cached = result_cache.get(key)
+            if cached is not None:
+                return cached, False
+    result = call_tool(tool_name, tool_args)
+    encoded, is_error = dumps_bytes(result), bool(result.get("isError"))
+    # Errors (e.g. a file briefly unreadable) are not cached: they'd take room from results and outlive their cause
+    if key is not None and not is_error:
+        result_cache.put(key, encoded)
+    return encoded, is_error
+
+def rpc_body(request_id, result_bytes: bytes) -> bytes:
+    """JSON-RPC success response around an already-encoded result"""
+    return b'{"jsonrpc":"2.0","id":' + json.dumps(request_id).encode('utf-8') + b',"result":' + result_bytes + b'}'
+
+def rpc_error(request_id, code: int, message: str) -> bytes:
+    return dumps_bytes({"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}})
+
+def method_result(method: str) -> Optional[bytes]:
+    """Encoded result of a JSON-RPC method that runs no tool (initialize, tools/list, ping); None if unknown"""
+    if method == "initialize":
+        return dumps_bytes({"protocolVersion": PROTOCOL_VERSION, "serverInfo": SERVER_INFO, "capabilities": {"tools": {}}})
+    if method == "tools/list":
+        return dumps_bytes({"tools": get_tools()})
+    if method == "ping":
+        return b'{}'
+    return None
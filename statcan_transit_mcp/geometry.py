@@ -0,0 +1,139 @@
+"""Route Geometry - Shapes grouped per shape_id, Douglas-Peucker simplification and encoded polylines"""
+import math
+from array import array
+from typing import Dict, List, Tuple
+
+GEOMETRY_VERSION = 2
+# Precomputed tolerances in metres: 0 keeps every point, the others suit street, city and region zooms
+LEVELS = (0, 5, 25, 100)
+POLYLINE_PRECISION = 5
+EARTH_RADIUS_M = 6371008.8
+_METRES_PER_DEGREE = math.radians(1) * EARTH_RADIUS_M
+
+
+def group_shapes(shapes: Dict[str, List[str]]) -> Dict[str, Tuple[array, array]]:
+    """shape_id -> (lats, lons) in shape_pt_sequence order; points without valid coordinates are dropped"""
+    per_shape: Dict[str, List[Tuple[float, float, float]]] = {}
+    shape_ids = shapes.get('shape_id', [])
+    sequences = shapes.get('shape_pt_sequence') or [''] * len(shape_ids)
+    for shape_id, lat, lon, sequence in zip(shape_ids, shapes.get('shape_pt_lat', []),
+                                            shapes.get('shape_pt_lon', []), sequences):
+        try:
+            per_shape.setdefault(shape_id, []).append((float(sequence or 0), float(lat), float(lon)))
+        except ValueError:
+            continue
+    grouped = {}
+    for shape_id, points in per_shape.items():
+        points.sort()
+        grouped[shape_id] = (array('d', (p[1] for p in points)), array('d', (p[2] for p in points)))
+    return grouped
+
+
+def _project(lats, lons) -> Tuple[List[float], List[float]]:
+    """Equirectangular metres around the shape's mean latitude; accurate to well under 1% at city scale"""
+    kx = _METRES_PER_DEGREE * math.cos(math.radians(sum(lats) / len(lats)))
+    return [lon * kx for lon in lons], [lat * _METRES_PER_DEGREE for lat in lats]
+
+
+def length_m(lats, lons) -> float:
+    if len(lats) < 2:
+        return 0.0
+    xs, ys = _project(lats, lons)
+    return sum(math.hypot(xs[i] - xs[i - 1], ys[i] - ys[i - 1]) for i in range(1, len(xs)))
+
+
+def simplify(lats, lons, tolerance_m: float) -> List[int]:
+    """Indices of the points Douglas-Peucker keeps at `tolerance_m`
+
+    Iterative (no recursion limit on long shapes) and measured against the
+    segment rather than the infinite line, so loops and out-and-back shapes
+    keep their turning points.
+    """
+    count = len(lats)
+    if tolerance_m <= 0 or count < 3:
+        return list(range(count))
+    xs, ys = _project(lats, lons)
+    keep = bytearray(count)
+    keep[0] = keep[count - 1] = 1
+    threshold = tolerance_m * tolerance_m
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        segment = dx * dx + dy * dy
+        worst, worst_at = threshold, -1
+        for i in range(first + 1, last):
+            px, py = xs[i] - ax, ys[i] - ay
+            if segment:
+                t = (px * dx + py * dy) / segment
+                t = 0.0 if t < 0 else 1.0 if t > 1 else t
+                px -= t * dx
+                py -= t * dy
+            distance = px * px + py * py
+            if distance > worst:
+                worst, worst_at = distance, i
+        if worst_at >= 0:
+            keep[worst_at] = 1
+            stack.append((first, worst_at))
+            stack.append((worst_at, last))
+    return [i for i in range(count) if keep[i]]
+
+
+def encode_polyline(lats, lons, precision: int = POLYLINE_PRECISION) -> str:
+    """Google encoded polyline (lat, lon order)"""
+    factor = 10 ** precision
+    out = []
+    previous_lat = previous_lon = 0
+    for lat, lon in zip(lats, lons):
+        scaled_lat, scaled_lon = round(lat * factor), round(lon * factor)
+        for delta in (scaled_lat - previous_lat, scaled_lon - previous_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        previous_lat, previous_lon = scaled_lat, scaled_lon
+    return ''.join(out)
+
+
+def decode_polyline(text: str, precision: int = POLYLINE_PRECISION) -> Tuple[List[float], List[float]]:
+    factor = 10 ** precision
+    lats, lons = [], []
+    index = lat = lon = 0
+    while index < len(text):
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                byte = ord(text[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        lats.append(lat / factor)
+        lons.append(lon / factor)
+    return lats, lons
+
+
+def build_geometry(shapes: Dict[str, List[str]]) -> Dict:
+    """Every shape of one agency at each precomputed level"""
+    entries = {}
+    for shape_id, (lats, lons) in group_shapes(shapes).items():
+        levels = {}
+        for tolerance in LEVELS:
+            kept = simplify(lats, lons, tolerance)
+            levels[str(tolerance)] = {
+                "points": len(kept),
+                "polyline": encode_polyline([lats[i] for i in kept], [lons[i] for i in kept]),
+            }
+        entries[shape_id] = {
+            "length_m": round(length_m(lats, lons), 1),
+            "bbox": [round(min(lons), 6), round(min(lats), 6), round(max(lons), 6), round(max(lats), 6)],
+            "levels": levels,
+        }
+    return {"shapes": entries}
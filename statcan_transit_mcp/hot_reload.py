@@ -0,0 +1,204 @@
+"""Hot Reload - Picks up changed agency feeds and swaps in a freshly warmed loader"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No leader election (Windows); every worker watches the feeds itself
+
+
+def diff_snapshots(old: Dict[str, Dict[str, str]], new: Dict[str, Dict[str, str]]) -> Dict[str, List[str]]:
+    """Agencies added, removed or modified between two {agency: {file: "mtime_ns:size"}} snapshots"""
+    return {
+        "added": sorted(set(new) - set(old)),
+        "removed": sorted(set(old) - set(new)),
+        "modified": sorted(agency for agency in set(old) & set(new) if old[agency] != new[agency]),
+    }
+
+
+class FeedGeneration:
+    """Counter in the shared store that worker processes bump after reloading feeds and poll to follow
+
+    A worker that reloads (its watcher or /admin/reload) publishes a new
+    generation; the others see it change and reload too, mapping the indexes
+    the first one already rebuilt. The watcher itself runs in one worker: the
+    holder of an exclusive lock on the leader file, kept for its lifetime.
+    """
+
+    def __init__(self, directory: Path):
+        self.path = directory / "reload.generation"
+        self._leader_path = directory / "reload.leader"
+        self._leader = None
+
+    @property
+    def leading(self) -> bool:
+        return self._leader is not None
+
+    def read(self) -> int:
+        try:
+            return int(self.path.read_text(encoding='utf-8') or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self) -> int:
+        """Publish the next generation; returns it"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(f"{self.path.name}.lock"), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                generation = self.read() + 1
+                tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                tmp.write_text(str(generation), encoding='utf-8')
+                os.replace(tmp, self.path)
+                return generation
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def is_leader(self) -> bool:
+        """Whether this process runs the watcher; takes the lead if no live process holds it"""
+        if self._leader is not None or fcntl is None:
+            return True
+        self._leader_path.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(self._leader_path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        # Released by the OS when the process exits, so a restarted worker can take over
+        self._leader = handle
+        return True
+
+
+class FeedReloader:
+    """Rebuilds the loader for changed agency feeds in the background, then swaps it in
+
+    get_loader() returns the loader currently serving requests, make_loader()
+    a new one over the same data source and swap(loader) publishes it. The new
+    loader takes over the old one's in-memory state for unchanged agencies and
+    is warmed for the changed ones only; requests keep being served by the old
+    loader until the swap, a single assignment.
+    """
+
+    def __init__(self, get_loader: Callable, make_loader: Callable, swap: Callable):
+        self.get_loader = get_loader
+        self.make_loader = make_loader
+        self.swap = swap
+        self.reloads = 0
+        self.last_report: Optional[Dict] = None
+        self.generation: Optional[FeedGeneration] = None
+        self._seen = 0
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._follower: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def share(self, directory: Path):
+        """Coordinate with the other worker processes through a FeedGeneration in `directory`"""
+        self.generation = FeedGeneration(directory)
+        self._seen = self.generation.read()
+
+    def reload(self, publish: bool = True) -> Dict:
+        """Check for changes and reload if there are any; returns a report (status "running" if one is under way)
+
+        With a shared generation, a reload is published to the other workers
+        unless `publish` is False (following one they published).
+        """
+        if not self._lock.acquire(blocking=False):
+            return {"status": "running"}
+        started = time.perf_counter()
+        report = {"started_at": datetime.now(timezone.utc).isoformat(timespec='seconds')}
+        try:
+            current = self.get_loader()
+            loader = self.make_loader()
+            changes = diff_snapshots(current.snapshot, loader.snapshot)
+            report.update(changes)
+            changed = changes["added"] + changes["modified"]
+            if not changed and not changes["removed"]:
+                report["status"] = "unchanged"
+            else:
+                loader.adopt(current, [agency for agency in loader.snapshot if agency not in changed])
+                loader.catalog.refresh()
+                loader.warm_up(changed)
+                self.swap(loader)
+                self.reloads += 1
+                report["status"] = "reloaded"
+                if publish and self.generation is not None:
+                    self._seen = self.generation.bump()
+        except Exception as e:
+            print(f"Feed reload failed: {e}")
+            report.update(status="error", error=str(e))
+        finally:
+            report["duration_s"] = round(time.perf_counter() - started, 3)
+            self.last_report = report
+            self._lock.release()
+        if report["status"] == "reloaded":
+            print(f"✓ Reloaded feeds in {report['duration_s']}s: {len(report['added'])} added, "
+                  f"{len(report['removed'])} removed, {len(report['modified'])} modified")
+        return report
+
+    def start(self) -> bool:
+        """Reload in a background thread; False if a reload is already running"""
+        if self.running:
+            return False
+        threading.Thread(target=self.reload, daemon=True).start()
+        return True
+
+    def catch_up(self) -> Optional[Dict]:
+        """Reload if another worker published a newer generation; None if there is none"""
+        if self.generation is None:
+            return None
+        generation = self.generation.read()
+        if generation == self._seen:
+            return None
+        report = self.reload(publish=False)
+        if report["status"] not in ("running", "error"):
+            self._seen = generation
+        return report
+
+    def watch(self, interval_s: float):
+        """Check for changed feeds every interval_s seconds in a daemon thread
+
+        With a shared generation only the leader checks; the other workers
+        keep trying for the lead, in case the leader exits.
+        """
+        if self._watcher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval_s)
+                if self.generation is None or self.generation.is_leader():
+                    self.reload()
+
+        self._watcher = threading.Thread(target=loop, daemon=True, name="feed-watcher")
+        self._watcher.start()
+
+    def follow(self, interval_s: float):
+        """Pick up generations published by other workers, checking every interval_s seconds in a daemon thread"""
+        if self._follower is not None or self.generation is None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval_s)
+                self.catch_up()
+
+        self._follower = threading.Thread(target=loop, daemon=True, name="feed-follower")
+        self._follower.start()
+
+    def status(self) -> Dict:
+        status = {"running": self.running, "reloads": self.reloads, "last": self.last_report}
+        if self.generation is not None:
+            status.update(generation=self._seen, leader=self.generation.leading)
+        return status
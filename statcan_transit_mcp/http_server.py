@@ -5,230 +5,199 @@ Universal Data Access - All 39 GTFS File Types Supported
 """
 
 import asyncio
+import contextlib
+import hmac
 import json
+import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional
 from starlette.applications import Starlette
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response, StreamingResponse
 from starlette.routing import Route
 from sse_starlette.sse import EventSourceResponse
 import uvicorn
 
 sys.path.insert(0, str(Path(__file__).parent))
-from data_loader import GTFSDataLoader
+import engine
+from engine import (LICENCE, PROTOCOL_VERSION, SERVER_INFO, TOOL_NAMES, call_tool_encoded, get_tools,
+                    method_result, rpc_body, rpc_error)
+from tool_executor import ToolExecutor
+from metrics import REGISTRY, TOOL_CALLS, TOOL_IN_FLIGHT, TOOL_RESPONSE_BYTES, TOOL_SECONDS, gauge_lines
 
-DATASET_URL = "https://www150.statcan.gc.ca/n1/pub/23-26-0003/232600032025001-eng.htm"
-LICENCE = "Open Government Licence - Canada"
-LICENCE_URL = "https://open.canada.ca/en/open-government-licence-canada"
+# Streamed responses are flushed in chunks of about this many bytes
+STREAM_CHUNK_BYTES = 64 * 1024
 
-data_loader = GTFSDataLoader()
+# Seconds between checks for changed agency feeds (0 = only on POST /admin/reload)
+RELOAD_INTERVAL_S = float(os.environ.get("MCP_RELOAD_INTERVAL_S", "0"))
 
-def get_tools():
-    """Define MCP tools - Universal data access"""
-    return [
-        {
-            "name": "describe_dataset",
-            "description": "Get dataset overview: total agencies (138), all available file types (39 different GTFS files), and usage instructions.",
-            "inputSchema": {
-                "type": "object",
-                "properties": {},
-                "required": []
-            }
-        },
-        {
-            "name": "list_agencies",
-            "description": "List all 138 transit agencies or search by name/location. Returns agency IDs and file counts.",
-            "inputSchema": {
-                "type": "object",
-                "properties": {
-                    "query": {"type": "string", "description": "Optional: search term (e.g., 'Montreal', 'BC', 'Ontario')"}
-                },
-                "required": []
-            }
-        },
-        {
-            "name": "get_agency_files",
-            "description": "List all available GTFS files for a specific agency. Shows which of the 39 file types this agency has.",
-            "inputSchema": {
-                "type": "object",
-                "properties": {
-                    "agency_id": {"type": "string", "description": "Agency ID from list_agencies"}
-                },
-                "required": ["agency_id"]
-            }
-        },
-        {
-            "name": "query_data",
-            "description": "Get data from ANY GTFS file for any agency. Supports all 39 file types including: agency, routes, stops, stop_times, trips, shapes, calendar, calendar_dates, feed_info, transfers, fare_attributes, fare_rules, frequencies, and 26 more specialized files. Returns complete data as JSON.",
-            "inputSchema": {
-                "type": "object",
-                "properties": {
-                    "agency_id": {"type": "string", "description": "Agency ID from list_agencies"},
-                    "file_name": {"type": "string", "description": "File name (e.g., 'stops', 'routes', 'transfers.txt'). Can omit .txt extension."},
-                    "limit": {"type": "number", "description": "Max records (default 5000, max 100000)"}
-                },
-                "required": ["agency_id", "file_name"]
-            }
-        }
-    ]
+# Most calls accepted in one JSON-RPC batch
+MAX_BATCH_SIZE = int(os.environ.get("MCP_MAX_BATCH_SIZE", "50"))
 
-def describe_dataset_tool() -> Dict:
-    """Tool 1: Dataset overview"""
-    try:
-        metadata = data_loader.get_dataset_metadata()
-        
-        return {"content": [{"type": "text", "text": json.dumps({
-            "dataset": metadata['dataset_name'],
-            "source": metadata['source'],
-            "url": DATASET_URL,
-            "licence": LICENCE,
-            "licence_url": LICENCE_URL,
-            "total_agencies": metadata['total_agencies'],
-            "total_file_types": metadata['total_file_types'],
-            "all_available_files": metadata['all_available_files'],
-            "core_files": metadata['core_files'],
-            "usage": metadata['usage'],
-            "note": "All 39 GTFS file types are supported. Use get_agency_files to see which files each agency has."
-        }, indent=2)}]}
-    except Exception as e:
-        return {"content": [{"type": "text", "text": json.dumps({
-            "error": f"Failed to load metadata: {str(e)}"
-        })}]}
+# Bearer token for /admin/* routes; unset disables them
+ADMIN_TOKEN = os.environ.get("MCP_ADMIN_TOKEN", "")
+# uvicorn worker processes; >1 builds every index once up front, then each worker maps the shared copies
+WORKERS = int(os.environ.get("MCP_WORKERS", "1"))
+# Seconds between a worker's checks for feeds another worker reloaded (with WORKERS > 1)
+FOLLOW_INTERVAL_S = float(os.environ.get("MCP_FOLLOW_INTERVAL_S", "5"))
 
-def list_agencies_tool(query: str = None) -> Dict:
-    """Tool 2: List/search agencies"""
-    try:
-        agencies = data_loader.search_agencies(query)
-        
-        if not agencies:
-            msg = "No agencies found"
-            if query:
-                msg += f" matching '{query}'"
-            return {"content": [{"type": "text", "text": json.dumps({
-                "agencies": [],
-                "count": 0,
-                "message": msg
-            })}]}
-        
-        results = []
-        for agency in agencies[:100]:
-            results.append({
-                "agency_id": agency.get('folder_name', ''),
-                "name": agency.get('agency_name', 'Unknown'),
-                "url": agency.get('agency_url', ''),
-                "phone": agency.get('agency_phone', ''),
-                "available_files": agency.get('available_files', 0)
-            })
-        
-        return {"content": [{"type": "text", "text": json.dumps({
-            "agencies": results,
-            "count": len(agencies),
-            "showing": len(results),
-            "message": f"Found {len(agencies)} agencies. Use get_agency_files to see available data files.",
-            "attribution": f"Data from Statistics Canada - {LICENCE}"
-        }, indent=2)}]}
-    
-    except Exception as e:
-        return {"content": [{"type": "text", "text": json.dumps({
-            "error": f"Failed to search agencies: {str(e)}"
-        })}]}
+# Tools, the loader and the caches live in engine (shared with the stdio server). Each worker starts the
+# engine in lifespan, never at import: the aggregate pool's spawned processes re-import this module
+tool_executor = ToolExecutor(engine.TOOL_WORKERS)
+# /health has its own thread, so liveness probes never queue behind tool calls on the pool
+health_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="health")
 
-def get_agency_files_tool(agency_id: str) -> Dict:
-    """Tool 3: List files for an agency"""
-    try:
-        if not agency_id or not agency_id.strip():
-            return {"content": [{"type": "text", "text": json.dumps({
-                "error": "agency_id is required"
-            })}]}
-        
-        files = data_loader.get_agency_files(agency_id)
-        
-        if not files:
-            resolved = data_loader.resolve_agency_id(agency_id)
-            if not resolved:
-                return {"content": [{"type": "text", "text": json.dumps({
-                    "error": f"Agency '{agency_id}' not found. Use list_agencies to find valid IDs.",
-                    "files": []
-                })}]}
-        
-        return {"content": [{"type": "text", "text": json.dumps({
-            "agency_id": agency_id,
-            "files": files,
-            "count": len(files),
-            "message": f"Agency has {len(files)} GTFS files. Use query_data with file_name to get data.",
-            "core_files": [f for f in files if f in ['agency.txt', 'routes.txt', 'stops.txt', 'stop_times.txt', 'trips.txt']]
-        }, indent=2)}]}
-    
-    except Exception as e:
-        return {"content": [{"type": "text", "text": json.dumps({
-            "error": f"Failed to get files: {str(e)}"
-        })}]}
-
-def query_data_tool(agency_id: str, file_name: str, limit: int = 5000) -> Dict:
-    """Tool 4: Query any GTFS file"""
-    try:
-        if not agency_id or not agency_id.strip():
-            return {"content": [{"type": "text", "text": json.dumps({
-                "error": "agency_id is required"
-            })}]}
-        
-        if not file_name or not file_name.strip():
-            return {"content": [{"type": "text", "text": json.dumps({
-                "error": "file_name is required. Use get_agency_files to see available files."
-            })}]}
-        
-        limit = min(limit if limit else 5000, 100000)
-        
-        data = data_loader.get_gtfs_data(agency_id, file_name, limit=limit)
-        
-        if not data:
-            resolved = data_loader.resolve_agency_id(agency_id)
-            if not resolved:
-                return {"content": [{"type": "text", "text": json.dumps({
-                    "error": f"Agency '{agency_id}' not found. Use list_agencies first.",
-                    "data": [],
-                    "count": 0
-                })}]}
-            else:
-                available_files = data_loader.get_agency_files(agency_id)
-                return {"content": [{"type": "text", "text": json.dumps({
-                    "error": f"File '{file_name}' not found for agency '{resolved}'. Available files: {available_files}",
-                    "data": [],
-                    "count": 0,
-                    "available_files": available_files
-                })}]}
-        
-        return {"content": [{"type": "text", "text": json.dumps({
-            "data": data,
-            "count": len(data),
-            "agency_id": agency_id,
-            "file_name": file_name,
-            "limit_applied": limit,
-            "message": f"Retrieved {len(data)} records" + (f" (limited to {limit})" if len(data) == limit else ""),
-            "attribution": f"Data from Statistics Canada - {LICENCE}"
-        }, indent=2)}]}
-    
-    except Exception as e:
-        return {"content": [{"type": "text", "text": json.dumps({
-            "error": f"Query failed: {str(e)}"
-        })}]}
+def _catalog_counts():
+    """(agencies, file types) from the catalog once it is built; (None, None) while it is being built"""
+    catalog = engine.start().catalog.peek()
+    if catalog is None:
+        return None, None
+    return len(catalog['agencies']), len(catalog['all_files'])
 
 async def health(request):
     """Health check"""
-    count = len(data_loader.get_all_agency_folders())
-    metadata = data_loader.get_dataset_metadata()
+    agencies, file_types = await asyncio.get_running_loop().run_in_executor(health_executor, _catalog_counts)
     return JSONResponse({
         "status": "healthy",
         "dataset": "Canadian Public Transit Network Database",
         "source": "Statistics Canada",
-        "agencies": count,
-        "file_types": metadata['total_file_types'],
-        "tools": 4,
+        "agencies": agencies,
+        "file_types": file_types,
+        "tools": len(get_tools()),
+        "result_cache": engine.result_cache.stats(),
+        "reload": engine.feed_reloader.status() if engine.feed_reloader is not None else None,
+        "worker": {"pid": os.getpid(), "workers": WORKERS},
         "version": "1.0.0",
         "licence": LICENCE
     })
 
+def _server_metrics():
+    """Scrape-time samples from the result cache, worker pool and slow-request log"""
+    cache = engine.result_cache.stats()
+    lines = []
+    for name, help_text, value, kind in [
+        ("mcp_result_cache_hits_total", "query_data result cache hits", cache["hits"], "counter"),
+        ("mcp_result_cache_misses_total", "query_data result cache misses", cache["misses"], "counter"),
+        ("mcp_result_cache_evictions_total", "query_data result cache evictions", cache["evictions"], "counter"),
+        ("mcp_result_cache_hit_ratio", "query_data result cache hits / lookups", cache["hit_ratio"], "gauge"),
+        ("mcp_result_cache_bytes", "Bytes held by the result cache", cache["bytes"], "gauge"),
+        ("mcp_result_cache_entries", "Entries in the result cache", cache["entries"], "gauge"),
+        ("mcp_executor_running_keys", "Distinct tool calls running or queued on the worker pool", tool_executor.in_flight, "gauge"),
+        ("mcp_executor_coalesced_total", "Calls that joined an identical in-flight call", tool_executor.coalesced, "counter"),
+        ("mcp_executor_workers", "Worker pool size", tool_executor.max_workers, "gauge"),
+        ("mcp_slow_requests_total", "Tool calls logged as slow", engine.slow_requests.logged, "counter"),
+        ("mcp_feed_reloads_total", "Changed agency feeds swapped in without a restart", engine.feed_reloader.reloads if engine.feed_reloader is not None else 0, "counter"),
+    ]:
+        lines.extend(gauge_lines(name, help_text, value, kind))
+    return lines
+
+REGISTRY.add_collector(_server_metrics)
+
+async def metrics(request):
+    """Prometheus text exposition"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def admin_reload(request):
+    """POST: check for changed agency feeds and reload them in the background (other workers follow); GET: reload status"""
+    if not ADMIN_TOKEN:
+        return JSONResponse({"error": "Admin routes are disabled. Set MCP_ADMIN_TOKEN to enable them."}, status_code=404)
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {ADMIN_TOKEN}"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    engine.start()
+    if request.method == "POST":
+        started = engine.feed_reloader.start()
+        return JSONResponse({"status": "started" if started else "running"}, status_code=202)
+    return JSONResponse(engine.feed_reloader.status())
+
+def _ndjson_chunks(stream, meta: Dict):
+    """Encode rows as NDJSON in ~STREAM_CHUNK_BYTES chunks, ending with a _meta line"""
+    buffer, size = [], 0
+    try:
+        for row in stream:
+            line = json.dumps(row).encode('utf-8') + b"\n"
+            buffer.append(line)
+            size += len(line)
+            if size >= STREAM_CHUNK_BYTES:
+                yield b"".join(buffer)
+                buffer, size = [], 0
+    finally:
+        stream.close()
+    meta.update(count=stream.count, next_cursor=stream.next_cursor)
+    buffer.append(json.dumps({"_meta": meta}).encode('utf-8') + b"\n")
+    yield b"".join(buffer)
+
+def _int_field(args: Dict, name: str) -> int:
+    """Integer field of a request body (0 when absent); ValueError for anything else"""
+    value = args.get(name) or 0
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+async def query_stream(request):
+    """Stream query_data rows as chunked NDJSON (one row per line, then a _meta line)"""
+    try:
+        args = await request.json()
+        if not isinstance(args, dict):
+            return JSONResponse({"error": "The request body must be a JSON object"}, status_code=400)
+        agency_id, file_name = args.get("agency_id", ""), args.get("file_name", "")
+        if not agency_id or not file_name or not isinstance(agency_id, str) or not isinstance(file_name, str):
+            return JSONResponse({"error": "agency_id and file_name are required"}, status_code=400)
+        limit, offset = _int_field(args, "limit"), _int_field(args, "offset")
+        loader = engine.start()
+        stream = await tool_executor.run(
+            None, loader.open_rows, agency_id, file_name,
+            limit or None, args.get("filters"), args.get("columns"),
+            args.get("cursor"), max(offset, 0)
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    
+    if stream.agency is None:
+        resolved = await tool_executor.run(None, loader.resolve_agency_id, agency_id)
+        if not resolved:
+            return JSONResponse({"error": f"Agency '{agency_id}' not found. Use list_agencies first."}, status_code=404)
+        return JSONResponse({"error": f"File '{file_name}' not found for agency '{resolved}'."}, status_code=404)
+    
+    chunks = _ndjson_chunks(stream, {
+        "agency_id": agency_id,
+        "file_name": stream.file_name,
+        "start_row": stream.start_row,
+        "attribution": f"Data from Statistics Canada - {LICENCE}"
+    })
+    
+    # Chunks are produced and the generator closed on the worker pool; the lock keeps close() from
+    # running while a next() is still executing there
+    producing = threading.Lock()
+    
+    def next_chunk():
+        with producing:
+            return next(chunks, None)
+    
+    def close_chunks():
+        with producing:
+            chunks.close()
+    
+    async def body():
+        # Each chunk is produced on the worker pool, so parsing never blocks the event loop
+        try:
+            while True:
+                chunk = await tool_executor.run(None, next_chunk)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            # Also when the client disconnects: the open CSV or mapping is released now, not at garbage collection.
+            # Not awaited, since a cancelled request can't wait for it
+            tool_executor.submit(close_chunks)
+    
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
 async def sse_endpoint(request):
     """SSE endpoint"""
     async def event_generator():
@@ -238,11 +207,8 @@ async def sse_endpoint(request):
                 "jsonrpc": "2.0",
                 "method": "notifications/initialized",
                 "params": {
-                    "protocolVersion": "2024-11-05",
-                    "serverInfo": {
-                        "name": "statcan-transit",
-                        "version": "1.0.0"
-                    },
+                    "protocolVersion": PROTOCOL_VERSION,
+                    "serverInfo": SERVER_INFO,
                     "capabilities": {"tools": {}}
                 }
             })
@@ -254,69 +220,110 @@ async def sse_endpoint(request):
             pass
     return EventSourceResponse(event_generator())
 
+async def _call_rpc_tool(tool_name: str, tool_args: Dict) -> bytes:
+    """Encoded result of one tools/call, run on the worker pool with metrics"""
+    labels = (tool_name,)
+    status = "exception"
+    TOOL_IN_FLIGHT.inc(labels)
+    started = time.perf_counter()
+    try:
+        result_bytes, is_error = await tool_executor.run(
+            (tool_name, json.dumps(tool_args, sort_keys=True, default=str)),
+            call_tool_encoded, tool_name, tool_args
+        )
+        status = "error" if is_error else "ok"
+    finally:
+        TOOL_IN_FLIGHT.dec(labels)
+        TOOL_SECONDS.observe(labels, time.perf_counter() - started)
+        TOOL_CALLS.inc((tool_name, status))
+    TOOL_RESPONSE_BYTES.observe(labels, len(result_bytes))
+    return result_bytes
+
+async def _dispatch(data) -> bytes:
+    """Encoded JSON-RPC response to one request object"""
+    if not isinstance(data, dict):
+        return rpc_error(None, -32600, "Invalid Request: expected a JSON-RPC object")
+    method = data.get("method")
+    params = data.get("params", {})
+    request_id = data.get("id")
+    
+    if method == "tools/call":
+        tool_name = params.get("name")
+        tool_args = params.get("arguments", {})
+        if tool_name not in TOOL_NAMES:
+            return rpc_error(request_id, -32601, f"Unknown tool: {tool_name}")
+        return rpc_body(request_id, await _call_rpc_tool(tool_name, tool_args))
+    result_bytes = method_result(method)
+    if result_bytes is None:
+        return rpc_error(request_id, -32601, f"Method not found: {method}")
+    return rpc_body(request_id, result_bytes)
+
+async def _dispatch_batch(batch: List) -> Optional[bytes]:
+    """Encoded array of responses to a JSON-RPC batch, in request order; None if it held only notifications
+    
+    Calls run concurrently, bounded by the worker pool. Identical calls share
+    one run and, through the result cache and the per-file indexes, files are
+    read once for the whole batch.
+    """
+    if not batch:
+        return rpc_error(None, -32600, "Invalid Request: empty batch")
+    if len(batch) > MAX_BATCH_SIZE:
+        return rpc_error(None, -32600, f"Invalid Request: batches are limited to {MAX_BATCH_SIZE} calls")
+    
+    async def respond(item):
+        try:
+            return await _dispatch(item)
+        except Exception as e:
+            return rpc_error(item.get("id") if isinstance(item, dict) else None, -32603, str(e))
+    
+    responses = await asyncio.gather(*(respond(item) for item in batch))
+    # Notifications (no "id" member) get no entry
+    parts = [body for item, body in zip(batch, responses) if not isinstance(item, dict) or "id" in item]
+    if not parts:
+        return None
+    return b"[" + b",".join(parts) + b"]"
+
 async def mcp_handler(request):
-    """MCP JSON-RPC handler"""
+    """MCP JSON-RPC handler: one request object, or a batch (array) of them"""
     try:
         data = await request.json()
-        method = data.get("method")
-        params = data.get("params", {})
-        request_id = data.get("id")
-        
-        if method == "initialize":
-            result = {
-                "protocolVersion": "2024-11-05",
-                "serverInfo": {
-                    "name": "statcan-transit",
-                    "version": "1.0.0"
-                },
-                "capabilities": {"tools": {}}
-            }
-        elif method == "tools/list":
-            result = {"tools": get_tools()}
-        elif method == "tools/call":
-            tool_name = params.get("name")
-            tool_args = params.get("arguments", {})
-            
-            if tool_name == "describe_dataset":
-                result = describe_dataset_tool()
-            elif tool_name == "list_agencies":
-                result = list_agencies_tool(tool_args.get("query"))
-            elif tool_name == "get_agency_files":
-                result = get_agency_files_tool(tool_args.get("agency_id", ""))
-            elif tool_name == "query_data":
-                result = query_data_tool(
-                    tool_args.get("agency_id", ""),
-                    tool_args.get("file_name", ""),
-                    tool_args.get("limit", 5000)
-                )
-            else:
-                return JSONResponse({
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "error": {"code": -32601, "message": f"Unknown tool: {tool_name}"}
-                })
-        else:
-            return JSONResponse({
-                "jsonrpc": "2.0",
-                "id": request_id,
-                "error": {"code": -32601, "message": f"Method not found: {method}"}
-            })
-        
-        return JSONResponse({
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "result": result
-        })
+        if isinstance(data, list):
+            body = await _dispatch_batch(data)
+            if body is None:
+                return Response(status_code=202)
+            return Response(body, media_type="application/json")
+        return Response(await _dispatch(data), media_type="application/json")
     except Exception as e:
         return JSONResponse({
             "jsonrpc": "2.0",
             "error": {"code": -32603, "message": str(e)}
         }, status_code=500)
 
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Runs in every worker: warm this process's loader (mapping what is already built) and watch for changed feeds
+
+    With several workers sharing a cache dir, one of them (the lock holder)
+    watches the feeds; every worker follows reloads the others publish.
+    """
+    loader = engine.start()
+    threading.Thread(target=loader.warm_up, daemon=True).start()
+    if WORKERS > 1 and loader.shared_enabled:
+        engine.feed_reloader.share(loader.cache_root / "shared")
+        engine.feed_reloader.follow(FOLLOW_INTERVAL_S)
+    if RELOAD_INTERVAL_S > 0:
+        engine.feed_reloader.watch(RELOAD_INTERVAL_S)
+    yield
+
+
 app = Starlette(
     debug=False,
+    lifespan=lifespan,
     routes=[
         Route("/health", health),
+        Route("/metrics", metrics),
+        Route("/admin/reload", admin_reload, methods=["GET", "POST"]),
+        Route("/query/stream", query_stream, methods=["POST"]),
         Route("/sse", sse_endpoint),
         Route("/sse", mcp_handler, methods=["POST"]),
         Route("/", mcp_handler, methods=["POST"]),
@@ -332,12 +339,34 @@ if __name__ == "__main__":
     print(f"Source: Statistics Canada")
     print(f"Licence: {LICENCE}")
     print("=" * 80)
-    print("Loading agencies...")
-    count = len(data_loader.get_all_agency_folders())
-    metadata = data_loader.get_dataset_metadata()
+    print("Loading dataset catalog...")
+    engine.start()
+    metadata = engine.data_loader.get_dataset_metadata()
+    count = metadata['total_agencies']
     print(f"✓ Loaded {count} transit agencies")
     print(f"✓ {metadata['total_file_types']} different GTFS file types available")
-    print(f"✓ 4 MCP tools: describe_dataset, list_agencies, get_agency_files, query_data")
-    print(f"✓ Server ready on http://0.0.0.0:3000")
-    print("=" * 80)
-    uvicorn.run(app, host="0.0.0.0", port=3000)
+    tools = [tool['name'] for tool in get_tools()]
+    print(f"✓ {len(tools)} MCP tools: {', '.join(tools)}")
+    
+    if RELOAD_INTERVAL_S > 0:
+        print(f"✓ Checking for changed agency feeds every {RELOAD_INTERVAL_S:g}s"
+              + (" in one worker" if WORKERS > 1 else ""))
+    if WORKERS > 1:
+        if not engine.data_loader.shared_enabled:
+            print(f"⚠ Cache dir {engine.data_loader.cache_dir} missing: each worker builds its own indexes")
+        print(f"Building indexes once for {WORKERS} workers...")
+        started = time.perf_counter()
+        engine.data_loader.warm_up()
+        print(f"✓ Indexes built in {time.perf_counter() - started:.1f}s: {engine.data_loader.cache_root / 'shared'}")
+        print(f"✓ Server ready on http://0.0.0.0:3000 ({WORKERS} workers)")
+        print("=" * 80)
+        # Workers import the module afresh; the import string is resolved from this file's directory
+        uvicorn.run("http_server:app", host="0.0.0.0", port=3000, workers=WORKERS,
+                    app_dir=str(Path(__file__).resolve().parent))
+    else:
+        if engine.data_loader.columnar.enabled:
+            print(f"✓ Compiling columnar cache in background: {engine.data_loader.columnar.root}")
+        print(f"✓ Building nationwide stop and search indexes, route geometry, service summaries and trip-planning timetables in background")
+        print(f"✓ Server ready on http://0.0.0.0:3000")
+        print("=" * 80)
+        uvicorn.run(app, host="0.0.0.0", port=3000)
@@ -0,0 +1,439 @@
+"""Journey Planning - Compiled connection timetable and Connection Scan earliest-arrival queries"""
+import heapq
+import math
+from array import array
+from bisect import bisect_left
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from departures import DAY_SECONDS, headway_windows, parse_gtfs_time, run_starts
+from shared_store import SharedStore, write_store
+
+INDEX_VERSION = 1
+# Stops this close are linked by a walking footpath unless transfers.txt says otherwise
+WALK_RADIUS_M = 400
+WALK_SPEED_MPS = 1.25
+# Connections departing more than this after the requested time are not scanned
+MAX_JOURNEY_S = 6 * 3600
+METRES_PER_DEGREE = 111320.0
+# Connection flags from pickup_type / drop_off_type = 1 (not available)
+NO_PICKUP = 1
+NO_DROP_OFF = 2
+# Footpath kinds
+WALK_PROXIMITY = 0
+WALK_TRANSFER = 1
+_UNREACHED = 1 << 40
+
+
+def _walk_seconds(metres: float) -> int:
+    return int(math.ceil(metres / WALK_SPEED_MPS))
+
+
+def _distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Equirectangular distance; well under 1% off at walking range"""
+    kx = math.cos(math.radians((lat1 + lat2) / 2)) * METRES_PER_DEGREE
+    return math.hypot((lon2 - lon1) * kx, (lat2 - lat1) * METRES_PER_DEGREE)
+
+
+def _trip_times(rows: List[Tuple[int, Optional[int], Optional[int], int]]) -> List[Tuple[int, int, int, int]]:
+    """(stop, arrival, departure, flags) of one trip's stop_times in sequence order, untimed stops interpolated
+
+    Stops between two timepoints get times spread evenly by position, as
+    GTFS consumers are expected to do; untimed stops before the first or
+    after the last timepoint are dropped.
+    """
+    timed = [k for k, (_, arrival, departure, _) in enumerate(rows) if arrival is not None or departure is not None]
+    if len(timed) < 2:
+        return []
+    out = []
+    for a, b in zip(timed, timed[1:]):
+        stop, arrival, departure, flags = rows[a]
+        start = departure if departure is not None else arrival
+        out.append((stop, arrival if arrival is not None else start, start, flags))
+        end = rows[b][1] if rows[b][1] is not None else rows[b][2]
+        for k in range(a + 1, b):
+            seconds = start + (end - start) * (k - a) // (b - a)
+            out.append((rows[k][0], seconds, seconds, rows[k][3]))
+    stop, arrival, departure, flags = rows[timed[-1]]
+    out.append((stop, arrival if arrival is not None else departure, departure if departure is not None else arrival, flags))
+    return out
+
+
+class ConnectionTimetable:
+    """Every stop-to-stop hop of every trip of one agency, sorted by departure time, plus walking footpaths
+
+    A connection is one vehicle moving between consecutive stops of a run
+    (a trip, or one departure of a frequencies.txt trip); its departure,
+    arrival, stops, run and pickup/drop-off flags are parallel arrays.
+    Footpaths are per-stop slices of (to stop, seconds, metres, kind), from
+    transfers.txt and from stops within WALK_RADIUS_M. save()/load() move
+    the same layout through a shared store.
+    """
+
+    def __init__(self, stop_times: Dict[str, List[str]], trips: Dict[str, List[str]], stops: Dict[str, List[str]],
+                 transfers: Dict[str, List[str]], frequencies: Dict[str, List[str]]):
+        trip_ids = trips.get('trip_id', [])
+        count = len(trip_ids)
+        self.trip_ids = trip_ids
+        self.trip_route = trips.get('route_id') or [None] * count
+        self.trip_headsign = trips.get('trip_headsign') or [None] * count
+        service_codes: Dict[Optional[str], int] = {}
+        self.trip_service_codes = array('i', (service_codes.setdefault(service_id, len(service_codes))
+                                              for service_id in (trips.get('service_id') or [None] * count)))
+        self.service_ids = list(service_codes)
+        self._service_codes = service_codes
+        trip_codes = {trip_id: code for code, trip_id in enumerate(trip_ids)}
+
+        # Stops: every stops.txt stop that is served, then any served stop stops.txt lacks
+        served = set(stop_times.get('stop_id', []))
+        listed = [stop_id for stop_id in stops.get('stop_id', []) if stop_id in served]
+        self.stop_ids = sorted(set(listed) | served)
+        stop_codes = {stop_id: code for code, stop_id in enumerate(self.stop_ids)}
+        names = dict(zip(stops.get('stop_id', []), stops.get('stop_name') or []))
+        self.stop_names = [names.get(stop_id) for stop_id in self.stop_ids]
+        self.stop_lats = array('d', repeat(math.nan, len(self.stop_ids)))
+        self.stop_lons = array('d', repeat(math.nan, len(self.stop_ids)))
+        for stop_id, lat, lon in zip(stops.get('stop_id', []), stops.get('stop_lat') or [], stops.get('stop_lon') or []):
+            code = stop_codes.get(stop_id)
+            if code is None:
+                continue
+            try:
+                self.stop_lats[code], self.stop_lons[code] = float(lat), float(lon)
+            except ValueError:
+                continue
+
+        self._build_connections(stop_times, trip_codes, stop_codes, frequencies)
+        self._build_footpaths(stops, transfers, stop_codes)
+
+    def _build_connections(self, stop_times: Dict[str, List[str]], trip_codes: Dict[str, int],
+                           stop_codes: Dict[str, int], frequencies: Dict[str, List[str]]):
+        trip_column = stop_times.get('trip_id', [])
+        rows = len(trip_column)
+        stop_column = stop_times.get('stop_id', [])
+        arrivals = stop_times.get('arrival_time') or [None] * rows
+        departures = stop_times.get('departure_time') or [None] * rows
+        sequences = stop_times.get('stop_sequence') or [None] * rows
+        pickups = stop_times.get('pickup_type') or repeat('')
+        drop_offs = stop_times.get('drop_off_type') or repeat('')
+
+        # One entry per usable stop_times row, in parallel arrays (-1 = no time) to keep millions of rows compact
+        parsed = {None: -1, '': -1}
+        keys = []
+        entry_stops, entry_arrivals, entry_departures, entry_flags = array('i'), array('i'), array('i'), bytearray()
+        for trip_id, stop_id, arrival, departure, sequence, pickup, drop_off in zip(
+                trip_column, stop_column, arrivals, departures, sequences, pickups, drop_offs):
+            trip = trip_codes.get(trip_id)
+            if trip is None:
+                continue
+            try:
+                order = int(sequence) if sequence else len(keys)
+            except ValueError:
+                continue
+            arrival_s = parsed.get(arrival)
+            if arrival_s is None:
+                value = parse_gtfs_time(arrival)
+                arrival_s = parsed[arrival] = value if value is not None else -1
+            departure_s = parsed.get(departure)
+            if departure_s is None:
+                value = parse_gtfs_time(departure)
+                departure_s = parsed[departure] = value if value is not None else -1
+            keys.append((trip << 32) | order)
+            entry_stops.append(stop_codes[stop_id])
+            entry_arrivals.append(arrival_s)
+            entry_departures.append(departure_s)
+            entry_flags.append((NO_PICKUP if pickup == '1' else 0) | (NO_DROP_OFF if drop_off == '1' else 0))
+
+        headways = {trip_codes[trip_id]: windows for trip_id, windows in headway_windows(frequencies).items()
+                    if trip_id in trip_codes}
+
+        self.run_trips = array('i')
+        departure_times, arrival_times = array('i'), array('i')
+        from_stops, to_stops, runs = array('i'), array('i'), array('i')
+        flags = bytearray()
+
+        def add_run(trip: int, times: List[Tuple[int, int, int, int]], shift: int):
+            run = len(self.run_trips)
+            self.run_trips.append(trip)
+            for (stop, _, departure, board_flags), (next_stop, arrival, _, alight_flags) in zip(times, times[1:]):
+                departure_times.append(departure + shift)
+                arrival_times.append(arrival + shift)
+                from_stops.append(stop)
+                to_stops.append(next_stop)
+                runs.append(run)
+                flags.append((board_flags & NO_PICKUP) | (alight_flags & NO_DROP_OFF))
+
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        position = 0
+        while position < len(order):
+            trip = keys[order[position]] >> 32
+            end = position
+            while end < len(order) and keys[order[end]] >> 32 == trip:
+                end += 1
+            times = _trip_times([(entry_stops[i], entry_arrivals[i] if entry_arrivals[i] >= 0 else None,
+                                  entry_departures[i] if entry_departures[i] >= 0 else None, entry_flags[i])
+                                 for i in order[position:end]])
+            position = end
+            if not times:
+                continue
+            if trip in headways:
+                # frequencies.txt: stop_times are a template, run once per headway from its first departure
+                first = times[0][2]
+                for start in run_starts(headways[trip]):
+                    add_run(trip, times, start - first)
+            else:
+                add_run(trip, times, 0)
+
+        # By departure, ties broken by arrival so zero-length hops come before what they connect to
+        by_time = sorted(range(len(departure_times)),
+                         key=lambda i: (departure_times[i] << 20) | min(max(arrival_times[i] - departure_times[i], 0), (1 << 20) - 1))
+        self.departures = array('i', (departure_times[i] for i in by_time))
+        self.arrivals = array('i', (arrival_times[i] for i in by_time))
+        self.from_stops = array('i', (from_stops[i] for i in by_time))
+        self.to_stops = array('i', (to_stops[i] for i in by_time))
+        self.runs = array('i', (runs[i] for i in by_time))
+        self.flags = bytes(flags[i] for i in by_time)
+
+    def _build_footpaths(self, stops: Dict[str, List[str]], transfers: Dict[str, List[str]], stop_codes: Dict[str, int]):
+        lats, lons = self.stop_lats, self.stop_lons
+        paths: Dict[int, Dict[int, Tuple[int, int, int]]] = {}
+        self.change_seconds = array('i', repeat(0, len(self.stop_ids)))
+
+        located = [code for code in range(len(self.stop_ids)) if not math.isnan(lats[code])]
+        if located:
+            cell_lat = WALK_RADIUS_M / METRES_PER_DEGREE
+            widest = max(abs(lats[code]) for code in located)
+            cell_lon = cell_lat / max(math.cos(math.radians(min(widest, 89.0))), 0.01)
+            cells: Dict[Tuple[int, int], List[int]] = {}
+            for code in located:
+                cells.setdefault((math.floor(lats[code] / cell_lat), math.floor(lons[code] / cell_lon)), []).append(code)
+            for (row, col), members in cells.items():
+                nearby = [other for dr in (-1, 0, 1) for dc in (-1, 0, 1) for other in cells.get((row + dr, col + dc), ())]
+                for code in members:
+                    for other in nearby:
+                        if other == code:
+                            continue
+                        metres = _distance_m(lats[code], lons[code], lats[other], lons[other])
+                        if metres <= WALK_RADIUS_M:
+                            paths.setdefault(code, {})[other] = (_walk_seconds(metres), int(metres), WALK_PROXIMITY)
+
+        # transfers.txt entries between stations apply to their platforms
+        children: Dict[str, List[int]] = {}
+        for stop_id, parent in zip(stops.get('stop_id', []), stops.get('parent_station') or []):
+            if parent and stop_id in stop_codes:
+                children.setdefault(parent, []).append(stop_codes[stop_id])
+
+        def expand(stop_id: str) -> List[int]:
+            codes = list(children.get(stop_id, []))
+            if stop_id in stop_codes:
+                codes.append(stop_codes[stop_id])
+            return codes
+
+        count = len(transfers.get('from_stop_id', []))
+        types = transfers.get('transfer_type') or [''] * count
+        minimums = transfers.get('min_transfer_time') or [''] * count
+        # Transfers tied to particular trips or routes don't hold for every connection at the stop
+        specific = [any(values) for values in zip(*(transfers.get(name) or [''] * count for name in
+                                                    ('from_trip_id', 'to_trip_id', 'from_route_id', 'to_route_id')))]
+        for from_id, to_id, kind, minimum, is_specific in zip(transfers.get('from_stop_id', []),
+                                                              transfers.get('to_stop_id', []), types, minimums, specific):
+            if is_specific or kind not in ('', '0', '1', '2', '3'):
+                continue
+            for source in expand(from_id):
+                for target in expand(to_id):
+                    if kind == '3':
+                        paths.get(source, {}).pop(target, None)
+                        continue
+                    try:
+                        seconds = int(minimum) if kind == '2' and minimum else None
+                    except ValueError:
+                        seconds = None
+                    if source == target:
+                        if seconds is not None:
+                            self.change_seconds[source] = seconds
+                        continue
+                    metres = (_distance_m(lats[source], lons[source], lats[target], lons[target])
+                              if not (math.isnan(lats[source]) or math.isnan(lats[target])) else -1)
+                    if seconds is None:
+                        seconds = _walk_seconds(metres) if metres >= 0 else 0
+                    paths.setdefault(source, {})[target] = (seconds, int(metres), WALK_TRANSFER)
+
+        self.footpath_starts = array('q', [0])
+        self.footpath_stops = array('i')
+        self.footpath_seconds = array('i')
+        self.footpath_metres = array('i')
+        self.footpath_kinds = bytearray()
+        for code in range(len(self.stop_ids)):
+            for target, (seconds, metres, kind) in sorted(paths.get(code, {}).items()):
+                self.footpath_stops.append(target)
+                self.footpath_seconds.append(seconds)
+                self.footpath_metres.append(metres)
+                self.footpath_kinds.append(kind)
+            self.footpath_starts.append(len(self.footpath_stops))
+        self.footpath_kinds = bytes(self.footpath_kinds)
+
+    def __len__(self):
+        return len(self.departures)
+
+    def save(self, path: Path, signature: str):
+        write_store(path, signature,
+                    {'departures': self.departures, 'arrivals': self.arrivals, 'from_stops': self.from_stops,
+                     'to_stops': self.to_stops, 'runs': self.runs, 'flags': array('B', self.flags),
+                     'run_trips': self.run_trips, 'trip_service_codes': self.trip_service_codes,
+                     'stop_lats': self.stop_lats, 'stop_lons': self.stop_lons, 'change_seconds': self.change_seconds,
+                     'footpath_starts': self.footpath_starts, 'footpath_stops': self.footpath_stops,
+                     'footpath_seconds': self.footpath_seconds, 'footpath_metres': self.footpath_metres,
+                     'footpath_kinds': array('B', self.footpath_kinds)},
+                    {'stop_ids': self.stop_ids, 'stop_names': self.stop_names, 'trip_ids': self.trip_ids,
+                     'trip_route': self.trip_route, 'trip_headsign': self.trip_headsign, 'service_ids': self.service_ids})
+
+    @classmethod
+    def load(cls, store: SharedStore) -> 'ConnectionTimetable':
+        """Timetable backed by a mapped store"""
+        timetable = cls.__new__(cls)
+        for name in ('departures', 'arrivals', 'from_stops', 'to_stops', 'runs', 'flags', 'run_trips',
+                     'trip_service_codes', 'stop_lats', 'stop_lons', 'change_seconds', 'footpath_starts',
+                     'footpath_stops', 'footpath_seconds', 'footpath_metres', 'footpath_kinds'):
+            setattr(timetable, name, store.array(name))
+        for name in ('stop_ids', 'stop_names', 'trip_ids', 'trip_route', 'trip_headsign', 'service_ids'):
+            setattr(timetable, name, store.strings(name))
+        timetable._service_codes = {service_id: code for code, service_id in enumerate(timetable.service_ids)}
+        return timetable
+
+    def stop_code(self, stop_id: str) -> Optional[int]:
+        i = bisect_left(self.stop_ids, stop_id)
+        return i if i < len(self.stop_ids) and self.stop_ids[i] == stop_id else None
+
+    def _scan(self, start: int, seconds: int, yesterday: bool) -> Iterable[Tuple[int, int, int]]:
+        """(connection, day shift, run offset) in departure order from `seconds`
+
+        Yesterday's after-midnight hops are merged in, shifted back a day and
+        with run numbers offset so they count as separate runs.
+        """
+        departures = self.departures
+        late = bisect_left(departures, seconds + DAY_SECONDS) if yesterday else len(departures)
+        if late == len(departures):
+            return zip(range(start, len(departures)), repeat(0), repeat(0))
+        offset = len(self.run_trips)
+        return ((i, shift, shift and offset) for _, i, shift in heapq.merge(
+            ((departures[i], i, 0) for i in range(start, len(departures))),
+            ((departures[i] - DAY_SECONDS, i, DAY_SECONDS) for i in range(late, len(departures)))))
+
+    def earliest_arrival(self, sources: List[int], targets: List[int], seconds: int, services_today: Set[str],
+                         services_yesterday: Set[str], arrive_by: Optional[int] = None,
+                         min_transfer_s: int = 0) -> Optional[List[Tuple]]:
+        """Legs of the earliest-arriving journey from any source stop at `seconds` to any target stop, or None
+
+        Connection Scan: one pass over connections in departure order from
+        `seconds`, stopping once they depart after the best arrival found (or
+        arrive_by, or MAX_JOURNEY_S later). A leg is ("ride", board connection,
+        alight connection, day shift) or ("walk", from stop, to stop, footpath).
+        """
+        today = {self._service_codes[s] for s in services_today if s in self._service_codes}
+        yesterday = {self._service_codes[s] for s in services_yesterday if s in self._service_codes}
+        departures, arrivals, from_stops, to_stops = self.departures, self.arrivals, self.from_stops, self.to_stops
+        runs, flags, run_trips, service = self.runs, self.flags, self.run_trips, self.trip_service_codes
+        change, starts, path_stops, path_seconds = (self.change_seconds, self.footpath_starts,
+                                                    self.footpath_stops, self.footpath_seconds)
+        stop_count = len(self.stop_ids)
+        arrival = [_UNREACHED] * stop_count
+        ready = [_UNREACHED] * stop_count
+        # Walks start from ride arrivals, which may come after the stop was first reached on foot
+        ridden = [_UNREACHED] * stop_count
+        via: Dict[int, Tuple] = {}
+        ride_via: Dict[int, Tuple] = {}
+        is_target = bytearray(stop_count)
+        for target in targets:
+            is_target[target] = 1
+
+        def walk_from(stop: int, at: int) -> int:
+            """Relax the stop's footpaths; returns the earliest target arrival they give"""
+            found = _UNREACHED
+            for k in range(starts[stop], starts[stop + 1]):
+                neighbour, reached = path_stops[k], at + path_seconds[k]
+                if reached < arrival[neighbour]:
+                    arrival[neighbour] = ready[neighbour] = reached
+                    via[neighbour] = ("walk", stop, neighbour, k)
+                    if is_target[neighbour] and reached < found:
+                        found = reached
+            return found
+
+        best = _UNREACHED
+        for source in sources:
+            arrival[source] = ready[source] = ridden[source] = seconds
+            if is_target[source]:
+                best = seconds
+        for source in sources:
+            best = min(best, walk_from(source, seconds))
+
+        # Scanning stops at the first connection departing at or after `limit`
+        horizon = (seconds + MAX_JOURNEY_S if arrive_by is None else arrive_by) + 1
+        limit = min(best, horizon)
+        on_board = bytearray(2 * len(run_trips))
+        boarded: Dict[int, int] = {}
+        for i, shift, offset in self._scan(bisect_left(departures, seconds), seconds, bool(yesterday)):
+            departure = departures[i] - shift
+            if departure >= limit:
+                break
+            run = runs[i] + offset
+            if not on_board[run]:
+                if ready[from_stops[i]] > departure or flags[i] & NO_PICKUP:
+                    continue
+                if service[run_trips[run - offset]] not in (yesterday if shift else today):
+                    continue
+                on_board[run] = 1
+                boarded[run] = i
+            if flags[i] & NO_DROP_OFF:
+                continue
+            stop, reached = to_stops[i], arrivals[i] - shift
+            if reached < ridden[stop]:
+                ridden[stop] = reached
+                ride_via[stop] = ("ride", boarded[run], i, shift)
+                if reached < arrival[stop]:
+                    arrival[stop] = reached
+                    ready[stop] = reached + max(change[stop], min_transfer_s)
+                    via[stop] = ride_via[stop]
+                    if is_target[stop] and reached < best:
+                        best = reached
+                best = min(best, walk_from(stop, reached))
+                limit = min(best, horizon)
+
+        if best == _UNREACHED or (arrive_by is not None and best > arrive_by):
+            return None
+        stop = min((t for t in targets if arrival[t] == best), key=lambda t: 0 if t in via else 1)
+        legs = []
+        lookup = via
+        while stop in lookup and len(legs) <= 2 * stop_count:
+            leg = lookup[stop]
+            legs.append(leg)
+            # A ride was boarded at the best time reached by any means; a walk left a ride arrival
+            stop, lookup = (from_stops[leg[1]], via) if leg[0] == "ride" else (leg[1], ride_via)
+        legs.reverse()
+        return self._without_loops(legs)
+
+    def _without_loops(self, legs: List[Tuple]) -> List[Tuple]:
+        """Cut out legs that return to a stop the journey already passed
+
+        With one walk per transfer, the fastest plan can ride out and back
+        only to walk on from a stop it first reached on foot. Reaching that
+        stop the first time and waiting there arrives no later.
+        """
+        kept: List[Tuple] = []
+        starts: List[int] = []
+        for leg in legs:
+            start = self.from_stops[leg[1]] if leg[0] == "ride" else leg[1]
+            if start in starts:
+                del kept[starts.index(start):]
+                del starts[starts.index(start):]
+            kept.append(leg)
+            starts.append(start)
+        return kept
+
+    def trip_details(self, run: int) -> Dict:
+        trip = self.run_trips[run]
+        return {
+            "trip_id": self.trip_ids[trip],
+            "route_id": self.trip_route[trip],
+            "trip_headsign": self.trip_headsign[trip],
+            "service_id": self.service_ids[self.trip_service_codes[trip]],
+        }
@@ -0,0 +1,27 @@
+"""JSON Codec - orjson when installed, the standard library otherwise"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODER = "orjson" if orjson is not None else "json"
+
+
+def dumps_bytes(obj, indent: bool = False) -> bytes:
+    """UTF-8 JSON; compact unless indent (2 spaces, same layout as json.dumps(indent=2))"""
+    if orjson is not None:
+        # Non-string keys: rows with more fields than the header carry a None key
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib encoder handles them
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def dumps(obj, indent: bool = False) -> str:
+    return dumps_bytes(obj, indent).decode('utf-8')
@@ -0,0 +1,237 @@
+"""Metrics - Prometheus-format counters/histograms and a sampling slow-request log"""
+import json
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FILE_LATENCY_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+                                for labels, value in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, labels: Tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: Tuple, value: float):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket (non-cumulative) counts with a final +Inf slot, then sum
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = self.header()
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                bucket_labels = _labels(self.label_names, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics plus collector callbacks evaluated at scrape time"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+def gauge_lines(name: str, help_text: str, value: float, kind: str = 'gauge') -> List[str]:
+    """One unlabelled sample, for collectors"""
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {_number(value)}"]
+
+
+REGISTRY = Registry()
+
+TOOL_SECONDS = REGISTRY.register(Histogram(
+    "mcp_tool_duration_seconds", "Tool call latency seen by mcp_handler, including queueing", ["tool"]))
+TOOL_CALLS = REGISTRY.register(Counter(
+    "mcp_tool_calls_total", "Tool calls by outcome (ok, error = error payload, exception = handler failure)",
+    ["tool", "status"]))
+TOOL_RESPONSE_BYTES = REGISTRY.register(Histogram(
+    "mcp_tool_response_bytes", "Encoded tool result size", ["tool"], SIZE_BUCKETS))
+TOOL_IN_FLIGHT = REGISTRY.register(Gauge(
+    "mcp_tool_in_flight", "Tool calls currently queued or running", ["tool"]))
+FILE_READ_SECONDS = REGISTRY.register(Histogram(
+    "gtfs_file_read_duration_seconds", "Time spent reading one GTFS file for a request",
+    ["agency", "file", "source"], FILE_LATENCY_BUCKETS))
+ROWS_PARSED = REGISTRY.register(Counter(
+    "gtfs_rows_parsed_total", "Rows decoded from CSV or columnar files", ["agency", "file", "source"]))
+BYTES_READ = REGISTRY.register(Counter(
+    "gtfs_csv_bytes_read_total", "CSV bytes consumed", ["agency", "file"]))
+COLUMNAR_LOOKUPS = REGISTRY.register(Counter(
+    "gtfs_columnar_cache_lookups_total", "Columnar cache lookups (hit = compiled entry used)", ["result"]))
+
+
+def record_file_read(agency: str, file_name: str, source: str, rows: int, csv_bytes: int, seconds: float):
+    FILE_READ_SECONDS.observe((agency, file_name, source), seconds)
+    ROWS_PARSED.inc((agency, file_name, source), rows)
+    if csv_bytes:
+        BYTES_READ.inc((agency, file_name), csv_bytes)
+
+
+class SlowRequestLog:
+    """Logs requests slower than threshold_ms together with a sampled profile
+
+    While a tracked call runs past the threshold, a sampler thread records
+    the worker thread's stack every `interval` seconds; the log line lists
+    the most frequent stacks. Calls that finish under the threshold cost
+    two dict operations.
+    """
+
+    def __init__(self, threshold_ms: float, interval: float = 0.01, max_stacks: int = 5, depth: int = 12):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.depth = depth
+        self.logged = 0
+        self._active: Dict[int, Tuple[int, float, Tally]] = {}
+        self._lock = threading.Lock()
+        self._next_token = 0
+        self._sampler: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def _start_sampler(self):
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name="slow-request-sampler", daemon=True)
+                self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                overdue = [(thread_id, samples) for thread_id, started, samples in self._active.values()
+                           if now - started >= self.threshold]
+            if not overdue:
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in overdue:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                samples[tuple(stack)] += 1
+
+    @contextmanager
+    def track(self, name: str, details: Dict):
+        """Wrap a blocking call on the thread that runs it"""
+        if not self.enabled:
+            yield
+            return
+        self._start_sampler()
+        started = time.perf_counter()
+        samples = Tally()
+        with self._lock:
+            token = self._next_token
+            self._next_token += 1
+            self._active[token] = (threading.get_ident(), started, samples)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active.pop(token, None)
+            elapsed = time.perf_counter() - started
+            if elapsed >= self.threshold:
+                self.logged += 1
+                print("SLOW REQUEST " + json.dumps({
+                    "name": name,
+                    "duration_ms": round(elapsed * 1000, 1),
+                    "details": details,
+                    "samples": sum(samples.values()),
+                    "sample_interval_ms": self.interval * 1000,
+                    "top_stacks": [{"count": count, "stack": list(stack)}
+                                   for stack, count in samples.most_common(self.max_stacks)],
+                }, default=str), flush=True)
@@ -0,0 +1,113 @@
+"""Pagination - Opaque cursors and sparse row -> byte offset indexes for GTFS files"""
+import base64
+import csv
+import json
+from array import array
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+# One checkpoint every STRIDE rows: reaching any row costs one seek plus < STRIDE parsed rows
+STRIDE = 1024
+
+
+def file_signature(path: Path) -> str:
+    stat = path.stat()
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def encode_cursor(agency: str, file_name: str, signature: str, row: int, offset: Optional[int]) -> str:
+    payload = {"a": agency, "f": file_name, "v": signature, "r": row, "o": offset}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Dict:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(payload.get("r"), int) or payload["r"] < 0:
+            raise ValueError
+        if payload.get("o") is not None and not isinstance(payload["o"], int):
+            raise ValueError
+        return payload
+    except Exception:
+        raise ValueError("Invalid cursor. Use the next_cursor value from a previous query_data response.")
+
+
+def _decode_line(line: bytes) -> str:
+    # Match text-mode universal newlines so rows are identical to csv.DictReader over open(..., 'r')
+    text = line.decode('utf-8')
+    if text.endswith('\r\n'):
+        text = text[:-2] + '\n'
+    return text
+
+
+def iter_records(path: Path, offset: int = 0) -> Iterator[Tuple[int, List[str]]]:
+    """Yield (byte offset, fields) for each CSV record, starting at a record boundary"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        yield from iter_stream_records(f, offset)
+
+
+def iter_stream_records(f: IO[bytes], offset: int = 0) -> Iterator[Tuple[int, List[str]]]:
+    """iter_records over an open binary stream (e.g. a zip member) positioned at byte `offset`"""
+    position = offset
+
+    def lines():
+        nonlocal position
+        for line in iter(f.readline, b''):
+            position += len(line)
+            yield _decode_line(line)
+
+    start = offset
+    for record in csv.reader(lines()):
+        yield start, record
+        start = position
+
+
+def read_header(path: Path) -> Tuple[List[str], int]:
+    """Column names and the byte offset of the first data row"""
+    with open(path, 'rb') as f:
+        return read_stream_header(f)
+
+
+def read_stream_header(f: IO[bytes]) -> Tuple[List[str], int]:
+    records = iter_stream_records(f)
+    for _, record in records:
+        next_start = next(records, (None, None))[0]
+        return record, next_start if next_start is not None else f.tell()
+    return [], 0
+
+
+def as_row(fields: List[str], record: List[str]) -> Dict:
+    """Same dict csv.DictReader would build for this record"""
+    row = dict(zip(fields, record))
+    if len(record) > len(fields):
+        row[None] = record[len(fields):]
+    elif len(record) < len(fields):
+        for name in fields[len(record):]:
+            row[name] = None
+    return row
+
+
+class SparseOffsetIndex:
+    """Byte offset of every STRIDE-th data row of one file"""
+
+    def __init__(self, path: Path):
+        self.signature = file_signature(path)
+        self.fields, data_start = read_header(path)
+        self.offsets = array('q')
+        self.num_rows = 0
+        for start, record in iter_records(path, data_start):
+            if not record:
+                continue
+            if self.num_rows % STRIDE == 0:
+                self.offsets.append(start)
+            self.num_rows += 1
+
+    def seek_point(self, row: int) -> Tuple[int, int]:
+        """(row number, byte offset) of the nearest checkpoint at or before row"""
+        checkpoint = min(row // STRIDE, len(self.offsets) - 1)
+        if checkpoint < 0:
+            return 0, None
+        return checkpoint * STRIDE, self.offsets[checkpoint]
@@ -0,0 +1,128 @@
+"""Row Tables - Compact in-memory rows: one shared schema per file, rows as tuples of interned values"""
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from pagination import as_row
+
+# Stored as ints when the text round-trips exactly; anything else (e.g. "8:05:00") is kept as text
+INT_COLUMNS = {'stop_sequence', 'shape_pt_sequence', 'headway_secs', 'min_transfer_time'}
+TIME_COLUMNS = {'arrival_time', 'departure_time', 'start_time', 'end_time'}
+
+_SCHEMAS: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+
+def shared_schema(fields: Iterable[str]) -> Tuple[str, ...]:
+    """The one tuple of these column names, shared by every table (and response row) using them"""
+    fields = tuple(fields)
+    return _SCHEMAS.setdefault(fields, fields)
+
+
+def _encode_int(value: Optional[str]):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return value
+    return number if str(number) == value else value
+
+
+def _encode_time(value: Optional[str]):
+    # Only the canonical HH:MM:SS that format_gtfs_time writes back becomes seconds
+    if value is None or len(value) != 8 or value[2] != ':' or value[5] != ':' or not value.isascii():
+        return value
+    hours, minutes, seconds = value[:2], value[3:5], value[6:]
+    if not (hours.isdigit() and minutes.isdigit() and seconds.isdigit()) or minutes > '59' or seconds > '59':
+        return value
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+class _Decoder(dict):
+    """stored value -> text; filled in as values are interned, anything else is its own text"""
+
+    def __missing__(self, value):
+        return value
+
+
+class _Interner(dict):
+    """text -> stored value; each distinct value is encoded once and then shared by every row"""
+
+    def __init__(self, encode: Optional[Callable] = None):
+        super().__init__()
+        self.encode = encode
+        self.decoder = _Decoder()
+
+    def __missing__(self, value):
+        stored = self[value] = self.encode(value) if self.encode is not None else value
+        if stored is not value:
+            self.decoder[stored] = value
+        return stored
+
+
+class RowTable:
+    """Rows of one file (or projection of it) as tuples in `fields` order
+
+    Values are interned per column, so repeated trip_ids, stop_ids and
+    flags are one object each, and sequence and time columns hold ints.
+    Rows read back as text, exactly as in the file, and only become dicts
+    when asked for (the response boundary). A record with more or fewer
+    values than the header keeps its own length, as with csv.DictReader.
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = shared_schema(fields)
+        self.rows: List[tuple] = []
+        # Time columns share one interner: arrival and departure times are mostly the same text
+        times = _Interner(_encode_time)
+        self._interners = [times if name in TIME_COLUMNS else _Interner(_encode_int if name in INT_COLUMNS else None)
+                           for name in self.fields]
+        self._decoders = [interner.decoder for interner in self._interners]
+        self._width = len(self.fields)
+        self._extras = _Interner()
+        self.first_long_row: Optional[int] = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def append(self, record: Sequence[Optional[str]]):
+        # dict.__getitem__ falls back to __missing__, so this loop stays in C for values seen before
+        row = tuple(map(dict.__getitem__, self._interners, record))
+        if len(record) > self._width:
+            if self.first_long_row is None:
+                self.first_long_row = len(self.rows)
+            row += tuple(self._extras[value] for value in record[self._width:])
+        self.rows.append(row)
+
+    def extend(self, records: Iterable[Sequence[Optional[str]]]) -> 'RowTable':
+        for record in records:
+            self.append(record)
+        return self
+
+    def text(self, row: tuple) -> List[Optional[str]]:
+        """One row's values as they appear in the file"""
+        values = list(map(dict.__getitem__, self._decoders, row))
+        if len(row) > self._width:
+            values.extend(row[self._width:])
+        return values
+
+    def values(self, start: int = 0, stop: Optional[int] = None) -> List[List[Optional[str]]]:
+        """Rows as lists of text, short records padded with None"""
+        width, decoders, text = self._width, self._decoders, self.text
+        rows = []
+        for row in self.rows[start:stop]:
+            if len(row) == width:
+                rows.append(list(map(dict.__getitem__, decoders, row)))
+            else:
+                values = text(row)
+                values.extend([None] * (width - len(values)))
+                rows.append(values)
+        return rows
+
+    def iter_dicts(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict]:
+        """Rows as the dicts csv.DictReader would build, one at a time"""
+        fields, width, decoders = self.fields, self._width, self._decoders
+        for row in self.rows[start:stop]:
+            if len(row) == width:
+                yield dict(zip(fields, map(dict.__getitem__, decoders, row)))
+            else:
+                yield as_row(fields, self.text(row))
+
+    def dicts(self, start: int = 0, stop: Optional[int] = None) -> List[Dict]:
+        return list(self.iter_dicts(start, stop))
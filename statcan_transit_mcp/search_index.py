@@ -0,0 +1,318 @@
+"""Search Index - Token/trigram inverted index over agency, route and stop names"""
+import json
+import re
+import unicodedata
+from array import array
+import heapq
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+from shared_store import SharedStore, write_store
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+# Similarity a vocabulary token needs to count as a match for a query token
+MIN_SIMILARITY = 0.45
+# Documents gathered from postings before common query tokens ("st", "at") stop adding candidates
+CANDIDATE_LIMIT = 5000
+INDEX_VERSION = 1
+KINDS = ('agency', 'route', 'stop')
+
+
+def normalize(text: str) -> str:
+    """Lowercase, fold accents (Montréal -> montreal) and turn punctuation into spaces"""
+    folded = unicodedata.normalize('NFKD', text or '')
+    folded = ''.join(c for c in folded if not unicodedata.combining(c)).lower()
+    return _NON_ALNUM.sub(' ', folded).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    return normalize(text).split()
+
+
+def acronym(name: str) -> Optional[str]:
+    """'Société de transport de Montréal' -> 'stm'; short connecting words are skipped"""
+    words = tokenize(name)
+    if len(words) < 2:
+        return None
+    letters = ''.join(w[0] for w in words if len(w) > 2 and not w.isdigit())
+    return letters if len(letters) >= 2 else None
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"${token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, cap: int) -> int:
+    """Levenshtein distance, giving up (returning cap + 1) once it must exceed cap"""
+    if abs(len(a) - len(b)) > cap:
+        return cap + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > cap:
+            return cap + 1
+        previous = current
+    return previous[-1]
+
+
+class SearchIndex:
+    """Documents are agencies, routes and distinct stop names per agency
+
+    Query tokens are matched against the vocabulary of document tokens
+    (exact, prefix, trigram overlap, small edit distance), then scored
+    documents are collected from the matched tokens' postings.
+
+    freeze() packs everything into flat arrays: token ids become positions
+    in the sorted vocabulary, postings and trigram lists are slices of one
+    array each, and documents are JSON strings with their kind, agency and
+    name length alongside. save()/load() move that layout through a shared
+    store unchanged.
+    """
+
+    def __init__(self):
+        self.docs: List[Dict] = []
+        self._doc_tokens: List[tuple] = []
+        self._token_ids: Dict[str, int] = {}
+        self._building_vocab: List[str] = []
+        self._building_postings: List[List[int]] = []
+        self._stop_docs: Dict[tuple, int] = {}
+        self._agency_text: Dict[str, str] = {}
+        self._agency_ids: List[str] = []
+        # Frozen layout
+        self._vocab: Sequence[str] = []
+        self._posting_starts = array('q', [0])
+        self._posting_docs = array('i')
+        self._grams: Sequence[str] = []
+        self._gram_starts = array('q', [0])
+        self._gram_tokens = array('i')
+        self._doc_token_starts = array('q', [0])
+        self._doc_token_ids = array('i')
+        self._doc_json: Sequence[str] = []
+        self._doc_kinds = array('b')
+        self._doc_agencies = array('i')
+        self._doc_name_lengths = array('i')
+
+    def __len__(self):
+        return len(self._doc_json) or len(self.docs)
+
+    def add(self, doc: Dict, text: str) -> int:
+        doc_id = len(self.docs)
+        self.docs.append(doc)
+        token_ids = []
+        for token in set(tokenize(text)):
+            token_id = self._token_ids.get(token)
+            if token_id is None:
+                token_id = self._token_ids[token] = len(self._building_vocab)
+                self._building_vocab.append(token)
+                self._building_postings.append([])
+            self._building_postings[token_id].append(doc_id)
+            token_ids.append(token_id)
+        self._doc_tokens.append(tuple(token_ids))
+        return doc_id
+
+    def add_agency(self, folder: str, agency: Optional[Dict], aliases: Iterable[str] = ()):
+        agency = agency or {}
+        name = agency.get('agency_name') or folder
+        url = agency.get('agency_url') or ''
+        host = re.sub(r'^https?://(www\.)?', '', url).split('/')[0]
+        text = ' '.join([folder.replace('_', ' '), name, host, *aliases])
+        self._agency_text[folder] = f"{folder} {name} {url}".lower()
+        self.add({"kind": "agency", "agency_id": folder, "id": folder, "name": name, "url": url}, text)
+
+    def add_routes(self, folder: str, routes: Dict[str, List[str]]):
+        route_ids = routes.get('route_id', [])
+        shorts = routes.get('route_short_name') or [''] * len(route_ids)
+        longs = routes.get('route_long_name') or [''] * len(route_ids)
+        for route_id, short, long in zip(route_ids, shorts, longs):
+            name = ' - '.join(part for part in (short, long) if part) or route_id
+            self.add({"kind": "route", "agency_id": folder, "id": route_id, "name": name,
+                      "route_short_name": short, "route_long_name": long}, f"{short} {long}")
+
+    def add_stops(self, folder: str, stops: Dict[str, List[str]]):
+        """One document per distinct stop name in an agency; platforms sharing a name are grouped"""
+        for stop_id, name in zip(stops.get('stop_id', []), stops.get('stop_name', [])):
+            if not name:
+                continue
+            key = (folder, normalize(name))
+            doc_id = self._stop_docs.get(key)
+            if doc_id is None:
+                self._stop_docs[key] = self.add({"kind": "stop", "agency_id": folder, "id": stop_id,
+                                                 "name": name, "stop_ids": [stop_id]}, name)
+            elif len(self.docs[doc_id]["stop_ids"]) < 20:
+                self.docs[doc_id]["stop_ids"].append(stop_id)
+
+    def freeze(self):
+        """Pack the built index into its flat, sorted layout"""
+        order = sorted(range(len(self._building_vocab)), key=self._building_vocab.__getitem__)
+        rank = array('i', bytes(4 * len(order)))
+        for position, token_id in enumerate(order):
+            rank[token_id] = position
+        self._vocab = [self._building_vocab[token_id] for token_id in order]
+        for token_id in order:
+            self._posting_docs.extend(self._building_postings[token_id])
+            self._posting_starts.append(len(self._posting_docs))
+
+        gram_index: Dict[str, List[int]] = {}
+        for token_id, token in enumerate(self._vocab):
+            for gram in trigrams(token):
+                gram_index.setdefault(gram, []).append(token_id)
+        self._grams = sorted(gram_index)
+        for gram in self._grams:
+            self._gram_tokens.extend(gram_index[gram])
+            self._gram_starts.append(len(self._gram_tokens))
+
+        agency_codes = {}
+        for doc, token_ids in zip(self.docs, self._doc_tokens):
+            self._doc_token_ids.extend(rank[token_id] for token_id in token_ids)
+            self._doc_token_starts.append(len(self._doc_token_ids))
+            self._doc_kinds.append(KINDS.index(doc["kind"]))
+            code = agency_codes.get(doc["agency_id"])
+            if code is None:
+                code = agency_codes[doc["agency_id"]] = len(self._agency_ids)
+                self._agency_ids.append(doc["agency_id"])
+            self._doc_agencies.append(code)
+            self._doc_name_lengths.append(len(doc["name"]))
+        self._doc_json = [json.dumps(doc, ensure_ascii=False) for doc in self.docs]
+        self.docs, self._doc_tokens, self._token_ids = [], [], {}
+        self._building_vocab, self._building_postings, self._stop_docs = [], [], {}
+
+    def save(self, path: Path, signature: str):
+        write_store(path, signature,
+                    {'posting_starts': self._posting_starts, 'posting_docs': self._posting_docs,
+                     'gram_starts': self._gram_starts, 'gram_tokens': self._gram_tokens,
+                     'doc_token_starts': self._doc_token_starts, 'doc_token_ids': self._doc_token_ids,
+                     'doc_kinds': self._doc_kinds, 'doc_agencies': self._doc_agencies,
+                     'doc_name_lengths': self._doc_name_lengths},
+                    {'vocab': self._vocab, 'grams': self._grams, 'doc_json': self._doc_json},
+                    {'agency_ids': self._agency_ids, 'agency_text': self._agency_text})
+
+    @classmethod
+    def load(cls, store: SharedStore) -> 'SearchIndex':
+        """Index backed by a mapped store"""
+        index = cls()
+        for name in ('posting_starts', 'posting_docs', 'gram_starts', 'gram_tokens', 'doc_token_starts',
+                     'doc_token_ids', 'doc_kinds', 'doc_agencies', 'doc_name_lengths'):
+            setattr(index, f"_{name}", store.array(name))
+        for name in ('vocab', 'grams', 'doc_json'):
+            setattr(index, f"_{name}", store.strings(name))
+        index._agency_ids = list(store.meta['agency_ids'])
+        index._agency_text = dict(store.meta['agency_text'])
+        return index
+
+    def _find(self, ordered: Sequence[str], value: str) -> Optional[int]:
+        i = bisect_left(ordered, value)
+        return i if i < len(ordered) and ordered[i] == value else None
+
+    def _postings(self, token_id: int):
+        return self._posting_docs[self._posting_starts[token_id]:self._posting_starts[token_id + 1]]
+
+    def _doc_token_list(self, doc_id: int):
+        return self._doc_token_ids[self._doc_token_starts[doc_id]:self._doc_token_starts[doc_id + 1]]
+
+    def _similar_tokens(self, token: str) -> Dict[int, float]:
+        """Vocabulary token id -> similarity to one query token"""
+        matches = {}
+        vocab = self._vocab
+        exact = self._find(vocab, token)
+        if exact is not None:
+            matches[exact] = 1.0
+        if len(token) >= 2:
+            for i in range(bisect_left(vocab, token), len(vocab)):
+                if not vocab[i].startswith(token):
+                    break
+                matches.setdefault(i, 0.9 if len(token) >= 3 else 0.6)
+                if len(matches) > 500:
+                    break
+        if len(token) < 3:
+            return matches
+
+        grams = trigrams(token)
+        shared = {}
+        for gram in grams:
+            position = self._find(self._grams, gram)
+            if position is None:
+                continue
+            for token_id in self._gram_tokens[self._gram_starts[position]:self._gram_starts[position + 1]]:
+                shared[token_id] = shared.get(token_id, 0) + 1
+        cap = 0 if len(token) <= 3 else 1 if len(token) < 7 else 2
+        for token_id, count in shared.items():
+            if token_id in matches:
+                continue
+            candidate = vocab[token_id]
+            dice = 2 * count / (len(grams) + len(candidate) + 2)
+            if dice < 0.25:
+                continue
+            score = dice
+            distance = edit_distance(token, candidate, cap)
+            if distance <= cap:
+                score = max(score, 0.85 if distance == 1 else 0.7)
+            if score >= MIN_SIMILARITY:
+                matches[token_id] = score
+        return matches
+
+    def search(self, query: str, kinds: Optional[Set[str]] = None, agency: Optional[str] = None,
+               limit: int = 20) -> List[Dict]:
+        """Ranked documents; score is the mean best similarity of each query token (1.0 = all exact)
+
+        The rarest query tokens gather candidates from their postings (at most
+        CANDIDATE_LIMIT); common tokens ("st", "at") then only score the
+        candidates already found instead of walking their huge postings.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        starts = self._posting_starts
+        per_token = []
+        for token in tokens:
+            matches = sorted(self._similar_tokens(token).items(), key=lambda item: -item[1])
+            per_token.append((sum(starts[token_id + 1] - starts[token_id] for token_id, _ in matches), matches))
+        per_token.sort(key=lambda item: item[0])
+
+        wanted = None
+        if kinds or agency:
+            kind_codes = {KINDS.index(kind) for kind in kinds if kind in KINDS} if kinds else None
+            agency_code = self._agency_ids.index(agency) if agency in self._agency_ids else -1
+            doc_kinds, doc_agencies = self._doc_kinds, self._doc_agencies
+            wanted = lambda doc_id: ((kind_codes is None or doc_kinds[doc_id] in kind_codes)
+                                     and (not agency or doc_agencies[doc_id] == agency_code))
+        scores: Dict[int, float] = {}
+        for postings_size, matches in per_token:
+            best: Dict[int, float] = {}
+            if not scores or postings_size + len(scores) <= CANDIDATE_LIMIT:
+                # Highest similarity first, so truncation only drops the weakest matches
+                room = CANDIDATE_LIMIT - len(scores)
+                for token_id, similarity in matches:
+                    for doc_id in self._postings(token_id):
+                        if doc_id in best or (wanted is not None and not wanted(doc_id)):
+                            continue
+                        best[doc_id] = similarity
+                        if len(best) >= room:
+                            break
+                    if len(best) >= room:
+                        break
+            else:
+                similarity_of = dict(matches)
+                for doc_id in scores:
+                    best[doc_id] = max((similarity_of.get(t, 0.0) for t in self._doc_token_list(doc_id)), default=0.0)
+            for doc_id, similarity in best.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + similarity
+
+        ranked = []
+        name_lengths = self._doc_name_lengths
+        for doc_id, total in scores.items():
+            score = total / len(tokens)
+            # Prefer documents that are mostly made of the query (e.g. "Yonge" over "Yonge St at Bloor")
+            coverage = min(len(tokens) / max(len(self._doc_token_list(doc_id)), 1), 1.0)
+            ranked.append((-(score + 0.05 * coverage), name_lengths[doc_id], doc_id, score))
+        top = heapq.nsmallest(limit, ranked)
+        return [dict(json.loads(self._doc_json[doc_id]), score=round(score, 3)) for _, _, doc_id, score in top]
+
+    def agency_substring_matches(self, query: str) -> List[str]:
+        """Agency folders whose folder/name/url contains the query verbatim (the original list_agencies rule)"""
+        needle = query.lower()
+        return [folder for folder, text in self._agency_text.items() if needle in text]
@@ -1,84 +1,118 @@
 #!/usr/bin/env python3
 """
-MCP Server for Statistics Canada LODE Dataset - Canadian Public Transit Network Database
+MCP stdio Server for Statistics Canada - Canadian Public Transit Network Database
+
+Same tools as http_server.py, over stdin/stdout (one JSON-RPC message per
+line) for desktop MCP clients that launch it for every session. Startup
+imports only the tool engine, so initialize and tools/list are answered
+before any data module loads; the loader is started in the background once
+tools are listed and reads the prebuilt catalog and indexes from
+MCP_CACHE_DIR as tools need them.
 """
 
-import asyncio
+import time
+
+STARTED = time.perf_counter()
+
 import json
-from typing import Any
-from mcp.server.models import InitializationOptions
-from mcp.server import NotificationOptions, Server
-from mcp.server.stdio import stdio_server
-from mcp import types
-
-STATCAN_BASE_URL = "https://www150.statcan.gc.ca/n1/pub/23-26-0003/232600032025001-eng.htm"
-
-app = Server("statcan-transit-mcp")
-
-@app.list_tools()
-async def handle_list_tools() -> list[types.Tool]:
-    """List available tools."""
-    return [
-        types.Tool(
-            name="get_dataset_info",
-            description="Get information about the Canadian Public Transit Network Database",
-            inputSchema={"type": "object", "properties": {}},
-        ),
-        types.Tool(
-            name="search_transit_agencies",
-            description="Search for transit agencies",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "province": {"type": "string", "description": "Province code (e.g., ON, QC)"},
-                    "city": {"type": "string", "description": "City name"},
-                },
-            },
-        ),
-    ]
-
-@app.call_tool()
-async def handle_call_tool(name: str, arguments: dict[str, Any] | None) -> list[types.TextContent]:
-    """Handle tool execution."""
-    if name == "get_dataset_info":
-        return [types.TextContent(
-            type="text",
-            text=json.dumps({
-                "dataset": "Canadian Public Transit Network Database",
-                "source": "Statistics Canada",
-                "url": STATCAN_BASE_URL,
-                "coverage": "150 transit agencies across Canada",
-            }, indent=2)
-        )]
-    elif name == "search_transit_agencies":
-        return [types.TextContent(
-            type="text",
-            text=json.dumps({
-                "note": "Placeholder data - integrate real GTFS data",
-                "example": [
-                    {"id": "ttc", "name": "Toronto Transit Commission", "province": "ON"},
-                    {"id": "stm", "name": "STM Montreal", "province": "QC"},
-                ]
-            }, indent=2)
-        )]
-    raise ValueError(f"Unknown tool: {name}")
-
-async def main():
-    """Run the MCP server."""
-    async with stdio_server() as (read_stream, write_stream):
-        await app.run(
-            read_stream,
-            write_stream,
-            InitializationOptions(
-                server_name="statcan-transit-mcp",
-                server_version="0.1.0",
-                capabilities=app.get_capabilities(
-                    notification_options=NotificationOptions(),
-                    experimental_capabilities={},
-                ),
-            ),
-        )
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
 
-if __name__ == "__main__":
-    asyncio.run(main())
+sys.path.insert(0, str(Path(__file__).parent))
+import engine
+from engine import TOOL_NAMES, call_tool_encoded, method_result, rpc_body, rpc_error
+
+_write_lock = threading.Lock()
+
+
+def _send(out, body: Optional[bytes]):
+    if body is None:
+        return
+    with _write_lock:
+        out.write(body + b"\n")
+        out.flush()
+
+
+def _respond(data) -> Optional[bytes]:
+    """Encoded response to one request object; None for notifications (no "id" member)"""
+    if not isinstance(data, dict):
+        return rpc_error(None, -32600, "Invalid Request: expected a JSON-RPC object")
+    method = data.get("method")
+    params = data.get("params", {})
+    request_id = data.get("id")
+    try:
+        if method == "tools/call":
+            tool_name = params.get("name")
+            tool_args = params.get("arguments", {})
+            if tool_name not in TOOL_NAMES:
+                body = rpc_error(request_id, -32601, f"Unknown tool: {tool_name}")
+            else:
+                result_bytes, _ = call_tool_encoded(tool_name, tool_args)
+                body = rpc_body(request_id, result_bytes)
+        else:
+            result_bytes = method_result(method)
+            if result_bytes is None:
+                body = rpc_error(request_id, -32601, f"Method not found: {method}")
+            else:
+                body = rpc_body(request_id, result_bytes)
+    except Exception as e:
+        body = rpc_error(request_id, -32603, str(e))
+    return body if "id" in data else None
 
+
+def _respond_batch(batch: List) -> Optional[bytes]:
+    """Encoded array of responses to a JSON-RPC batch, in request order; None if it held only notifications"""
+    if not batch:
+        return rpc_error(None, -32600, "Invalid Request: empty batch")
+    parts = [body for body in map(_respond, batch) if body is not None]
+    if not parts:
+        return None
+    return b"[" + b",".join(parts) + b"]"
+
+
+def _listed():
+    """First tools/list answered: record the startup time, then load the data while the client is idle"""
+    print(f"First tools/list reply {(time.perf_counter() - STARTED) * 1000:.0f} ms after start", file=sys.stderr)
+    threading.Thread(target=engine.start, daemon=True).start()
+
+
+def main():
+    """Serve MCP over stdin/stdout until stdin closes"""
+    out = sys.stdout.buffer
+    # The data modules report progress with print(); keep stdout for protocol messages only
+    sys.stdout = sys.stderr
+    # Tool calls run on the pool so a slow one doesn't hold up pings or other calls
+    pool = ThreadPoolExecutor(max_workers=engine.TOOL_WORKERS, thread_name_prefix="tool")
+    listed = False
+    try:
+        for line in sys.stdin.buffer:
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                _send(out, rpc_error(None, -32700, "Parse error"))
+                continue
+            if isinstance(data, list):
+                pool.submit(lambda batch: _send(out, _respond_batch(batch)), data)
+            elif isinstance(data, dict) and data.get("method") == "tools/call":
+                pool.submit(lambda message: _send(out, _respond(message)), data)
+            else:
+                _send(out, _respond(data))
+                if not listed and isinstance(data, dict) and data.get("method") == "tools/list":
+                    listed = True
+                    _listed()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Answer what was already asked before exiting
+        pool.shutdown(wait=True)
+        if engine.aggregator is not None:
+            engine.aggregator.shutdown()
+
+
+if __name__ == "__main__":
+    main()
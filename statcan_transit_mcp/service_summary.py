@@ -0,0 +1,63 @@
+"""Service Summaries - Span, trips per hour and headways per route, direction and service_id"""
+import statistics
+from collections import Counter
+from typing import Dict, List
+
+from departures import first_departures, format_gtfs_time, headway_windows, run_starts
+
+SUMMARY_VERSION = 1
+
+
+def summarize(departures: List[int]) -> Dict:
+    """First/last departure, trips per hour and headways (minutes) of sorted departure seconds"""
+    per_hour = Counter(seconds // 3600 for seconds in departures)
+    headways = [later - earlier for earlier, later in zip(departures, departures[1:])]
+    return {
+        "trips": len(departures),
+        "first_departure": format_gtfs_time(departures[0]) if departures else None,
+        "last_departure": format_gtfs_time(departures[-1]) if departures else None,
+        "trips_per_hour": {f"{hour:02d}": count for hour, count in sorted(per_hour.items())},
+        "peak_trips_per_hour": max(per_hour.values()) if per_hour else 0,
+        "headway_minutes": {
+            "median": round(statistics.median(headways) / 60, 1),
+            "min": round(min(headways) / 60, 1),
+            "max": round(max(headways) / 60, 1),
+        } if headways else None,
+    }
+
+
+def build_service_summaries(stop_times: Dict[str, List[str]], trips: Dict[str, List[str]],
+                            frequencies: Dict[str, List[str]]) -> Dict:
+    """{"routes": {route_id: [entry per (direction_id, service_id)]}}
+
+    Each entry keeps its sorted departures, so summaries for a date (several
+    service_ids running at once) are merges of stored lists. A frequencies.txt
+    trip departs once per run, as in the departure index and trip planner.
+    """
+    firsts = first_departures(stop_times)
+    windows = headway_windows(frequencies)
+    trip_ids = trips.get('trip_id', [])
+    routes = trips.get('route_id') or [''] * len(trip_ids)
+    services = trips.get('service_id') or [''] * len(trip_ids)
+    directions = trips.get('direction_id') or [''] * len(trip_ids)
+    grouped: Dict[tuple, List[int]] = {}
+    for trip_id, route_id, service_id, direction_id in zip(trip_ids, routes, services, directions):
+        seconds = firsts.get(trip_id)
+        if seconds is None:
+            continue
+        departures = grouped.setdefault((route_id, direction_id or '', service_id), [])
+        if trip_id in windows:
+            # Each run's first timepoint is the run's start
+            departures.extend(run_starts(windows[trip_id]))
+        else:
+            departures.append(seconds)
+    view: Dict[str, List[Dict]] = {}
+    for (route_id, direction_id, service_id), departures in sorted(grouped.items()):
+        departures.sort()
+        view.setdefault(route_id, []).append({
+            "direction_id": direction_id,
+            "service_id": service_id,
+            "departures": departures,
+            "summary": summarize(departures),
+        })
+    return {"routes": view}
@@ -0,0 +1,175 @@
+"""Shared Store - Read-only arrays and string lists in one memory-mapped file
+
+Indexes built once are written here and mapped by every worker process, so
+all workers share one copy in the page cache instead of each holding its own.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No cross-process build lock (Windows); concurrent builders just race to the same result
+
+MAGIC = b"GTFSSHM1"
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class StringList:
+    """Sequence of strings (or None) stored as int64 offsets into a utf-8 blob, decoded on access"""
+
+    def __init__(self, offsets: memoryview, blob: memoryview, nulls: Optional[memoryview] = None):
+        self.offsets = offsets.cast('q')
+        self.blob = blob
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def _encode_strings(values: Sequence[Optional[str]]) -> Dict[str, bytes]:
+    offsets = array('q', [0])
+    parts = []
+    position = 0
+    nulls = bytearray(len(values))
+    for i, value in enumerate(values):
+        if value is None:
+            nulls[i] = 1
+        else:
+            data = value.encode('utf-8')
+            parts.append(data)
+            position += len(data)
+        offsets.append(position)
+    sections = {'offsets': offsets.tobytes(), 'blob': b''.join(parts)}
+    if any(nulls):
+        sections['nulls'] = bytes(nulls)
+    return sections
+
+
+def write_store(path: Path, signature: str, arrays: Dict[str, array], strings: Dict[str, Sequence[Optional[str]]],
+                meta: Optional[Dict] = None):
+    """Write a store atomically; readers that mapped the previous file keep their copy"""
+    payloads = []
+    sections = {}
+    position = 0
+
+    def add(name: str, data: bytes, typecode: str):
+        nonlocal position
+        sections[name] = [position, len(data), typecode]
+        payloads.append(data + b'\0' * (_align(len(data)) - len(data)))
+        position += _align(len(data))
+
+    for name, values in arrays.items():
+        add(name, values.tobytes(), values.typecode)
+    for name, values in strings.items():
+        for part, data in _encode_strings(values).items():
+            add(f"{name}.{part}", data, 'B')
+
+    header = json.dumps({'signature': signature, 'meta': meta or {}, 'sections': sections,
+                         'strings': sorted(strings)}).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + struct.pack('<q', len(header)) + header)
+            f.write(b'\0' * (data_start - f.tell()))
+            for payload in payloads:
+                f.write(payload)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+class SharedStore:
+    """A store mapped read-only; arrays come back as memoryviews over the mapping"""
+
+    def __init__(self, path: Path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mmap = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        if self._mmap is None or self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a shared store")
+        (header_length,) = struct.unpack_from('<q', self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mmap[header_start:header_start + header_length])
+        self.signature = header['signature']
+        self.meta = header['meta']
+        self._sections = header['sections']
+        self._strings = set(header['strings'])
+        self._data_start = _align(header_start + header_length)
+        self._view = memoryview(self._mmap)
+
+    def _section(self, name: str) -> memoryview:
+        offset, length, typecode = self._sections[name]
+        start = self._data_start + offset
+        view = self._view[start:start + length]
+        return view.cast(typecode) if typecode != 'B' else view
+
+    def array(self, name: str) -> memoryview:
+        return self._section(name)
+
+    def strings(self, name: str) -> StringList:
+        if name not in self._strings:
+            raise KeyError(name)
+        nulls = self._section(f"{name}.nulls") if f"{name}.nulls" in self._sections else None
+        return StringList(self._section(f"{name}.offsets"), self._section(f"{name}.blob"), nulls)
+
+
+def _open_fresh(path: Path, signature: str) -> Optional[SharedStore]:
+    if not path.exists():
+        return None
+    try:
+        store = SharedStore(path)
+    except Exception as e:
+        print(f"Ignoring unreadable shared store {path}: {e}")
+        return None
+    return store if store.signature == signature else None
+
+
+def load_or_build(path: Path, signature: str, write: Callable[[Path], None]) -> SharedStore:
+    """Map the store at `path`, first building it with write(path) if it is missing or stale
+
+    Builds are serialized across processes with a lock file, so when several
+    workers need the same store at once one builds it and the rest map it.
+    """
+    store = _open_fresh(path, signature)
+    if store is not None:
+        return store
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(f"{path.name}.lock"), 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            store = _open_fresh(path, signature)
+            if store is None:
+                write(path)
+                store = _open_fresh(path, signature)
+                if store is None:
+                    raise RuntimeError(f"Shared store {path} was not written")
+            return store
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,185 @@
+"""Spatial Index - Nationwide nearest-stop and bounding-box search over every agency's stops.txt"""
+import heapq
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from shared_store import SharedStore, write_store
+
+EARTH_RADIUS_M = 6371008.8
+METRES_PER_DEGREE_LAT = math.radians(1) * EARTH_RADIUS_M
+# Grid cell size in degrees (~1.1 km north-south); a 500 m radius touches at most a 3x3 block of cells
+CELL_DEG = 0.01
+INDEX_VERSION = 1
+# Cell (row, col) packs into one sortable integer key; both fit easily in 21 bits at CELL_DEG
+_KEY_BIAS = 1 << 20
+_COL_BITS = 21
+
+
+def _cell(lat: float, lon: float):
+    return (math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG))
+
+
+def _cell_key(row: int, col: int) -> int:
+    return ((row + _KEY_BIAS) << _COL_BITS) | (col + _KEY_BIAS)
+
+
+def _key_cell(key: int):
+    return (key >> _COL_BITS) - _KEY_BIAS, (key & ((1 << _COL_BITS) - 1)) - _KEY_BIAS
+
+
+class StopSpatialIndex:
+    """Uniform lat/lon grid over parallel arrays of stop coordinates
+
+    Once frozen, occupied cells are a sorted array of cell keys with each
+    cell's stops in one members array, which is also the layout saved to a
+    shared store, so a loaded index is used exactly like a built one.
+    """
+
+    def __init__(self):
+        self.lats = array('d')
+        self.lons = array('d')
+        self.agency_codes = array('i')
+        self.agencies = []
+        self.stop_ids = []
+        self.stop_names = []
+        self._building = {}
+        self.cell_keys = array('q')
+        self.cell_starts = array('q', [0])
+        self.cell_members = array('i')
+
+    def __len__(self):
+        return len(self.lats)
+
+    def add_agency(self, agency: str, stops: Iterable[Dict]):
+        code = len(self.agencies)
+        self.agencies.append(agency)
+        for stop in stops:
+            try:
+                lat, lon = float(stop['stop_lat']), float(stop['stop_lon'])
+            except (TypeError, ValueError):
+                continue
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180) or (lat == 0 and lon == 0):
+                continue
+            i = len(self.lats)
+            self.lats.append(lat)
+            self.lons.append(lon)
+            self.agency_codes.append(code)
+            self.stop_ids.append(stop.get('stop_id'))
+            self.stop_names.append(stop.get('stop_name'))
+            self._building.setdefault(_cell_key(*_cell(lat, lon)), []).append(i)
+
+    def freeze(self):
+        """Pack per-cell member lists into sorted key / start / member arrays once building is done"""
+        for key in sorted(self._building):
+            self.cell_keys.append(key)
+            self.cell_members.extend(self._building[key])
+            self.cell_starts.append(len(self.cell_members))
+        self._building = {}
+
+    def save(self, path: Path, signature: str):
+        write_store(path, signature,
+                    {'lats': self.lats, 'lons': self.lons, 'agency_codes': self.agency_codes,
+                     'cell_keys': self.cell_keys, 'cell_starts': self.cell_starts, 'cell_members': self.cell_members},
+                    {'stop_ids': self.stop_ids, 'stop_names': self.stop_names},
+                    {'agencies': self.agencies})
+
+    @classmethod
+    def load(cls, store: SharedStore) -> 'StopSpatialIndex':
+        """Index backed by a mapped store: arrays and strings are read from the shared pages"""
+        index = cls()
+        for name in ('lats', 'lons', 'agency_codes', 'cell_keys', 'cell_starts', 'cell_members'):
+            setattr(index, name, store.array(name))
+        index.stop_ids = store.strings('stop_ids')
+        index.stop_names = store.strings('stop_names')
+        index.agencies = list(store.meta['agencies'])
+        return index
+
+    def _candidates(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+        (row_lo, col_lo), (row_hi, col_hi) = _cell(min_lat, min_lon), _cell(max_lat, max_lon)
+        keys, starts, members = self.cell_keys, self.cell_starts, self.cell_members
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > len(keys):
+            # Very large boxes: walking the occupied cells is cheaper than walking the box
+            for i, key in enumerate(keys):
+                row, col = _key_cell(key)
+                if row_lo <= row <= row_hi and col_lo <= col <= col_hi:
+                    yield members[starts[i]:starts[i + 1]]
+            return
+        for row in range(row_lo, row_hi + 1):
+            # A row's cells are contiguous in key order
+            first = bisect_left(keys, _cell_key(row, col_lo))
+            last = bisect_right(keys, _cell_key(row, col_hi), first)
+            for i in range(first, last):
+                yield members[starts[i]:starts[i + 1]]
+
+    def _stop(self, i: int, distance: Optional[float] = None) -> Dict:
+        stop = {
+            "agency_id": self.agencies[self.agency_codes[i]],
+            "stop_id": self.stop_ids[i],
+            "stop_name": self.stop_names[i],
+            "stop_lat": self.lats[i],
+            "stop_lon": self.lons[i],
+        }
+        if distance is not None:
+            stop["distance_m"] = round(distance, 1)
+        return stop
+
+    def near(self, lat: float, lon: float, radius_m: float, limit: int = 20,
+             agency: Optional[str] = None) -> List[Dict]:
+        """Stops within radius_m of (lat, lon), nearest first"""
+        dlat = radius_m / METRES_PER_DEGREE_LAT
+        # The circle is widest in longitude at its poleward edge; one reaching a pole spans every longitude
+        poleward = abs(lat) + dlat
+        dlon = 180.0 if poleward >= 90.0 else min(dlat / math.cos(math.radians(poleward)), 180.0)
+        if dlon >= 180.0:
+            windows = [(-180.0, 180.0)]
+        elif lon - dlon < -180.0:
+            windows = [(-180.0, lon + dlon), (lon - dlon + 360.0, 180.0)]
+        elif lon + dlon > 180.0:
+            windows = [(lon - dlon, 180.0), (-180.0, lon + dlon - 360.0)]
+        else:
+            windows = [(lon - dlon, lon + dlon)]
+        agency_code = self.agencies.index(agency) if agency in self.agencies else None
+        if agency is not None and agency_code is None:
+            return []
+
+        lats, lons, codes = self.lats, self.lons, self.agency_codes
+        lat_r, sin, cos, asin, sqrt, radians = math.radians(lat), math.sin, math.cos, math.asin, math.sqrt, math.radians
+        cos_lat_r = cos(lat_r)
+        min_lat, max_lat = lat - dlat, lat + dlat
+        hits = []
+        # A circle crossing the antimeridian is scanned as two longitude windows
+        for min_lon, max_lon in windows:
+            for members in self._candidates(min_lat, min_lon, max_lat, max_lon):
+                for i in members:
+                    if agency_code is not None and codes[i] != agency_code:
+                        continue
+                    p_lat, p_lon = lats[i], lons[i]
+                    if not (min_lat <= p_lat <= max_lat and min_lon <= p_lon <= max_lon):
+                        continue
+                    p_lat_r = radians(p_lat)
+                    a = (sin((p_lat_r - lat_r) / 2) ** 2
+                         + cos_lat_r * cos(p_lat_r) * sin(radians(p_lon - lon) / 2) ** 2)
+                    distance = 2 * EARTH_RADIUS_M * asin(min(1.0, sqrt(a)))
+                    if distance <= radius_m:
+                        hits.append((distance, i))
+        return [self._stop(i, distance) for distance, i in heapq.nsmallest(limit, hits)]
+
+    def in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                limit: int = 100, agency: Optional[str] = None) -> Dict:
+        """Stops inside a bounding box; returns the first `limit` plus the total count"""
+        agency_code = self.agencies.index(agency) if agency in self.agencies else None
+        if agency is not None and agency_code is None:
+            return {"stops": [], "total": 0}
+        lats, lons, codes = self.lats, self.lons, self.agency_codes
+        matches = []
+        for members in self._candidates(min_lat, min_lon, max_lat, max_lon):
+            for i in members:
+                if agency_code is not None and codes[i] != agency_code:
+                    continue
+                if min_lat <= lats[i] <= max_lat and min_lon <= lons[i] <= max_lon:
+                    matches.append(i)
+        matches.sort()
+        return {"stops": [self._stop(i) for i in matches[:limit]], "total": len(matches)}
@@ -0,0 +1,49 @@
+"""Tool Executor - Bounded worker pool with single-flight coalescing"""
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class ToolExecutor:
+    """Runs blocking tool calls off the event loop
+
+    At most `max_workers` calls run at once; the rest queue. Calls sharing a
+    key while one is already running wait for that run instead of starting
+    their own, and every waiter gets the same result (or exception).
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    async def run(self, key: Optional[Hashable], fn: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        if key is None:
+            return await loop.run_in_executor(self._pool, fn, *args)
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = loop.run_in_executor(self._pool, fn, *args)
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # Shield so one cancelled waiter (client disconnect) doesn't cancel the shared run
+        return await asyncio.shield(future)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Run fn on the pool without waiting for it, e.g. cleanup after a cancelled request"""
+        return self._pool.submit(fn, *args)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,92 @@
+"""View Cache - Per-agency derived data computed once per source-file version and persisted"""
+import json
+import os
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+
+class AgencyViewCache:
+    """One JSON-serializable view per agency, recomputed when its signature changes
+
+    The signature identifies the source files the view was computed from
+    (e.g. their mtime/size). Views are held in memory and, when the cache
+    dir exists, persisted to <cache_dir>/<name>/<agency>.json so restarts
+    skip the computation. Concurrent gets of the same agency and signature
+    share one computation; other agencies build alongside it.
+    """
+
+    def __init__(self, cache_dir: str, name: str, version: int):
+        self.root = Path(cache_dir) / name
+        self.name = name
+        self.version = version
+        self.enabled = Path(cache_dir).is_dir()
+        self._views: Dict[str, Dict] = {}
+        self._inflight: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, agency: str, signature: str, build: Callable[[], Dict]) -> Dict:
+        key = (agency, signature)
+        with self._lock:
+            cached = self._views.get(agency)
+            if cached is not None and cached["signature"] == signature:
+                return cached["view"]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()["view"]
+        try:
+            cached = self._load(agency, signature)
+            if cached is None:
+                cached = {"version": self.version, "signature": signature, "view": build()}
+                self._save(agency, cached)
+            with self._lock:
+                self._views[agency] = cached
+            future.set_result(cached)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return cached["view"]
+
+    def adopt(self, previous: 'AgencyViewCache', agencies: set):
+        """Reuse `previous`'s in-memory views of these agencies (signatures are still checked on get)"""
+        with self._lock:
+            self._views.update({agency: view for agency, view in list(previous._views.items()) if agency in agencies})
+
+    def _path(self, agency: str) -> Path:
+        return self.root / f"{agency}.json"
+
+    def _load(self, agency: str, signature: str) -> Optional[Dict]:
+        if not self.enabled or not self._path(agency).exists():
+            return None
+        try:
+            with open(self._path(agency), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable {self.name} cache for {agency}: {e}")
+            return None
+        if data.get("version") != self.version or data.get("signature") != signature or "view" not in data:
+            return None
+        return data
+
+    def _save(self, agency: str, data: Dict):
+        if not self.enabled:
+            return
+        target = self._path(agency)
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp, target)
+        except Exception as e:
+            print(f"Error saving {self.name} cache for {agency}: {e}")
+        finally:
+            if tmp.exists():
+                tmp.unlink()
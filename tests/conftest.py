@@ -0,0 +1,109 @@
+"""Shared fixtures: a small handwritten GTFS feed and loaders over it"""
+import sys
+from pathlib import Path
+
+import pytest
+
+# Modules import each other as top-level siblings, as when the servers run
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "statcan_transit_mcp"))
+
+AGENCY = "metro_transit"
+
+# Four stops about 1.1 km apart (beyond walking range), on one line.
+# F1 runs every 10 minutes 06:00-09:00 through frequencies.txt; T1 passes S1
+# at 07:02 without taking passengers; T2 is a plain timed trip.
+FEED = {
+    "agency.txt": [
+        ["agency_id", "agency_name", "agency_url", "agency_timezone"],
+        ["MT", "Metro Transit", "https://metro.example", "America/Toronto"],
+    ],
+    "stops.txt": [
+        ["stop_id", "stop_name", "stop_lat", "stop_lon", "parent_station"],
+        ["S1", "First St", "45.000", "-75.000", ""],
+        ["S2", "Second St", "45.010", "-75.000", ""],
+        ["S3", "Third St", "45.020", "-75.000", ""],
+        ["S4", "Fourth St", "45.030", "-75.000", ""],
+    ],
+    "routes.txt": [
+        ["route_id", "agency_id", "route_short_name", "route_long_name", "route_type"],
+        ["R1", "MT", "1", "Main Frequent", "3"],
+        ["R2", "MT", "2", "Main Local", "3"],
+    ],
+    "trips.txt": [
+        ["route_id", "service_id", "trip_id", "trip_headsign", "direction_id", "shape_id"],
+        ["R1", "WK", "F1", "To Fourth", "0", "SH1"],
+        ["R2", "WK", "T1", "To Fourth", "0", "SH1"],
+        ["R2", "WK", "T2", "To Fourth", "0", "SH1"],
+    ],
+    "stop_times.txt": [
+        ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence", "pickup_type", "drop_off_type"],
+        ["F1", "06:00:00", "06:00:00", "S1", "1", "0", "0"],
+        ["F1", "06:05:00", "06:05:00", "S2", "2", "0", "0"],
+        ["F1", "06:10:00", "06:10:00", "S3", "3", "0", "0"],
+        ["T1", "07:02:00", "07:02:00", "S1", "1", "1", "0"],
+        ["T1", "07:07:00", "07:07:00", "S2", "2", "0", "0"],
+        ["T1", "07:12:00", "07:12:00", "S3", "3", "0", "0"],
+        ["T2", "07:15:00", "07:15:00", "S1", "1", "0", "0"],
+        ["T2", "07:20:00", "07:20:00", "S2", "2", "0", "0"],
+        ["T2", "07:25:00", "07:25:00", "S3", "3", "0", "0"],
+        ["T2", "07:30:00", "07:30:00", "S4", "4", "0", "0"],
+    ],
+    "frequencies.txt": [
+        ["trip_id", "start_time", "end_time", "headway_secs"],
+        ["F1", "06:00:00", "09:00:00", "600"],
+    ],
+    "calendar.txt": [
+        ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+         "start_date", "end_date"],
+        ["WK", "1", "1", "1", "1", "1", "0", "0", "20250101", "20261231"],
+    ],
+    "shapes.txt": [
+        ["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence"],
+        ["SH1", "45.000", "-75.000", "1"],
+        ["SH1", "45.015", "-75.0001", "2"],
+        ["SH1", "45.030", "-75.000", "3"],
+    ],
+}
+
+
+def write_feed(root: Path, files=None, agency: str = AGENCY) -> Path:
+    """Write one agency folder of CSV files under root; returns root"""
+    folder = root / agency
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, rows in (files or FEED).items():
+        with open(folder / name, 'w', encoding='utf-8', newline='') as f:
+            f.write("".join(",".join(row) + "\n" for row in rows))
+    return root
+
+
+@pytest.fixture
+def feed_dir(tmp_path) -> Path:
+    return write_feed(tmp_path / "gtfs")
+
+
+@pytest.fixture
+def loader(feed_dir, tmp_path):
+    """Loader without a cache dir: every read parses the CSV"""
+    from data_loader import GTFSDataLoader
+    return GTFSDataLoader(str(feed_dir), str(tmp_path / "no-cache"))
+
+
+@pytest.fixture
+def cached_loader(feed_dir, tmp_path):
+    """Loader with a cache dir: what it derives from the feed is persisted there"""
+    from data_loader import GTFSDataLoader
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    return GTFSDataLoader(str(feed_dir), str(cache))
+
+
+@pytest.fixture
+def served(loader, monkeypatch):
+    """The tool engine serving `loader`, with an empty result cache and no aggregate pool"""
+    import engine
+    from hot_reload import FeedReloader
+    from result_cache import ResultCache
+    monkeypatch.setattr(engine, "data_loader", loader)
+    monkeypatch.setattr(engine, "result_cache", ResultCache(16 * 1024 * 1024))
+    monkeypatch.setattr(engine, "feed_reloader", FeedReloader(lambda: engine.data_loader, lambda: loader, lambda new: None))
+    return engine
@@ -0,0 +1,123 @@
+import fcntl
+import io
+import zipfile
+
+import pytest
+
+import archive as archive_module
+from archive import GTFSArchive
+from conftest import AGENCY, FEED
+
+NESTED = "lakeside"
+
+
+def _csv(rows):
+    return "".join(",".join(row) + "\n" for row in rows)
+
+
+@pytest.fixture
+def dataset_zip(tmp_path):
+    """Dataset zip shaped like the real one: agency folders, plus an agency shipped as its own gtfs.zip"""
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, rows in FEED.items():
+            z.writestr(f"feed/{name}", _csv(rows))
+    path = tmp_path / "dataset.zip"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, rows in FEED.items():
+            z.writestr(f"gtfs/{AGENCY}/{name}", _csv(rows))
+        z.writestr(f"gtfs/{NESTED}/gtfs.zip", inner.getvalue())
+    return path
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    path = tmp_path / "cache"
+    path.mkdir()
+    return path
+
+
+def test_index_covers_folders_and_nested_zips(dataset_zip, cache_dir, monkeypatch):
+    archive = GTFSArchive(dataset_zip, str(cache_dir))
+    assert archive.folders() == [NESTED, AGENCY]
+    assert archive.files(NESTED) == sorted(FEED)
+    assert archive.stat(NESTED, "stops.txt").st_size == len(_csv(FEED["stops.txt"]))
+
+    # A restart reads the persisted index instead of listing the zip again
+    monkeypatch.setattr(GTFSArchive, "_build_index", lambda self: pytest.fail("index rebuilt"))
+    assert GTFSArchive(dataset_zip, str(cache_dir)).index == archive.index
+
+
+@pytest.mark.parametrize("agency", [AGENCY, NESTED])
+def test_rows_match_the_extracted_csv(dataset_zip, cache_dir, loader, agency):
+    from data_loader import GTFSDataLoader
+    zipped = GTFSDataLoader(str(dataset_zip), str(cache_dir))
+    for name in FEED:
+        assert list(zipped.open_rows(agency, name)) == list(loader.open_rows(AGENCY, name))
+    assert zipped.get_column_values(agency, "stop_times.txt", ["trip_id"]) == \
+        loader.get_column_values(AGENCY, "stop_times.txt", ["trip_id"])
+
+
+def test_first_pages_read_the_member_without_extracting(dataset_zip, cache_dir, loader):
+    from data_loader import GTFSDataLoader
+    zipped = GTFSDataLoader(str(dataset_zip), str(cache_dir))
+    first = zipped.open_rows(AGENCY, "stop_times.txt", limit=4)
+    rows = list(first)
+    assert first.source == "zip" and not zipped.archive.is_hot(AGENCY, "stop_times.txt")
+    # The cursor's byte offset is valid in the extracted copy the next page reads
+    second = zipped.open_rows(AGENCY, "stop_times.txt", limit=4, cursor=first.next_cursor)
+    rows += list(second)
+    assert second.source == "csv" and zipped.archive.is_hot(AGENCY, "stop_times.txt")
+    assert rows == list(loader.open_rows(AGENCY, "stop_times.txt", limit=8))
+
+
+def test_copies_in_use_are_not_evicted(dataset_zip, cache_dir):
+    archive = GTFSArchive(dataset_zip, str(cache_dir), hot_bytes=1)
+    with archive.use(AGENCY, "stop_times.txt") as pinned:
+        with archive.use(AGENCY, "stops.txt"):
+            pass
+        assert pinned.exists()
+    with archive.use(AGENCY, "trips.txt"):
+        pass
+    assert not pinned.exists()
+
+
+def test_copies_pinned_by_another_process_are_not_evicted(dataset_zip, cache_dir):
+    archive = GTFSArchive(dataset_zip, str(cache_dir), hot_bytes=1)
+    with archive.use(AGENCY, "stop_times.txt") as path:
+        pass
+    # flock conflicts between separate opens of the file, as between processes
+    with open(path, "rb") as reader:
+        fcntl.flock(reader, fcntl.LOCK_SH)
+        with archive.use(AGENCY, "stops.txt"):
+            pass
+        assert path.exists()
+
+
+def test_other_processes_copies_are_left_alone(dataset_zip, cache_dir):
+    first = GTFSArchive(dataset_zip, str(cache_dir))
+    with first.use(AGENCY, "stop_times.txt") as path:
+        pass
+    second = GTFSArchive(dataset_zip, str(cache_dir), hot_bytes=1)
+    with second.use(AGENCY, "stops.txt"), second.use(AGENCY, "trips.txt"):
+        pass
+    assert path.exists()
+
+
+def test_evicted_copy_is_extracted_again(dataset_zip, cache_dir):
+    archive = GTFSArchive(dataset_zip, str(cache_dir))
+    with archive.use(AGENCY, "stops.txt") as path:
+        pass
+    path.unlink()
+    with archive.use(AGENCY, "stops.txt") as again:
+        assert again.read_text(encoding="utf-8") == _csv(FEED["stops.txt"])
+
+
+def test_without_cache_dir_one_scratch_dir_is_reused(dataset_zip, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive_module, "_scratch", None)
+    first = GTFSArchive(dataset_zip, None)
+    second = GTFSArchive(dataset_zip, str(tmp_path / "missing"))
+    assert first.root == second.root and first.root.is_dir()
+    scratch = archive_module._scratch
+    scratch.cleanup()
+    assert not first.root.exists()
@@ -0,0 +1,99 @@
+import csv
+import os
+
+import pytest
+
+import columnar_cache
+from columnar_cache import ColumnarCache
+from conftest import AGENCY, write_feed
+
+# Ints, floats that round-trip, floats that don't ("45.000" must come back as written), blanks and non-ASCII
+STOPS = [
+    ["stop_id", "stop_code", "stop_name", "stop_lat", "stop_lon", "wheelchair_boarding"],
+    ["S1", "101", "Gare Centrale", "45.5", "-73.56", "1"],
+    ["S2", "102", "Côte-des-Neiges", "45.000", "-73.6", ""],
+    ["S3", "", "Rue \"Saint\" Denis", "45.51", "-73.5", "2"],
+]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    write_feed(tmp_path / "gtfs", {"stops.txt": STOPS})
+    (tmp_path / "cache").mkdir()
+    return ColumnarCache(str(tmp_path / "cache"), tmp_path / "gtfs")
+
+
+def _csv_rows(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [tuple(row.values()) for row in csv.DictReader(f)]
+
+
+def test_values_match_the_csv(cache):
+    table = cache.compile(AGENCY, "stops.txt")
+    assert [values for _, values in table.iter_select()] == _csv_rows(cache.data_dir / AGENCY / "stops.txt")
+    types = {spec["name"]: spec["type"] for spec in table.meta["columns"]}
+    assert types["stop_lon"] == "float" and types["stop_lat"] == "str" and types["stop_id"] == "str"
+
+
+def test_filters_and_projection(cache):
+    table = cache.compile(AGENCY, "stops.txt")
+    selected = list(table.iter_select({"stop_id": ["S3", "S1"]}, ["stop_name", "wheelchair_boarding"]))
+    assert selected == [(0, ("Gare Centrale", "1")), (2, ('Rue "Saint" Denis', "2"))]
+    with pytest.raises(ValueError, match="Unknown column"):
+        table.iter_select(columns=["platform_code"])
+
+
+def test_changed_source_is_recompiled(cache):
+    cache.compile(AGENCY, "stops.txt")
+    source = cache.data_dir / AGENCY / "stops.txt"
+    with open(source, "a", encoding="utf-8") as f:
+        f.write("S4,104,Atwater,45.49,-73.58,1\n")
+    table = cache.get_table(AGENCY, "stops.txt")
+    assert len(table) == 4 and table.is_fresh(source.stat())
+
+
+def test_touched_source_is_stale(cache):
+    table = cache.compile(AGENCY, "stops.txt")
+    source = cache.data_dir / AGENCY / "stops.txt"
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert not table.is_fresh(source.stat())
+    assert cache.get_table(AGENCY, "stops.txt").is_fresh(source.stat())
+
+
+def test_entry_from_another_format_version_is_ignored(cache, monkeypatch):
+    with monkeypatch.context() as patched:
+        patched.setattr(columnar_cache, "FORMAT_VERSION", columnar_cache.FORMAT_VERSION + 1)
+        cache.compile(AGENCY, "stops.txt")
+    # A restarted server on the current format reads the CSV until the entry is recompiled
+    restarted = ColumnarCache(str(cache.root.parent), cache.data_dir)
+    assert restarted.get_table(AGENCY, "stops.txt") is None
+    assert restarted.compile(AGENCY, "stops.txt").meta["version"] == columnar_cache.FORMAT_VERSION
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: b"not a columnar file",
+    lambda data: data[:len(data) // 2],
+    lambda data: b"",
+])
+def test_unreadable_entry_is_recompiled(cache, damage):
+    compiled = cache.compile(AGENCY, "stops.txt")
+    compiled.close()
+    entry = cache.entry_path(AGENCY, "stops.txt")
+    entry.write_bytes(damage(entry.read_bytes()))
+    restarted = ColumnarCache(str(cache.root.parent), cache.data_dir)
+    # Read as missing (CSV fallback) until warm-up compiles it again
+    assert restarted.get_table(AGENCY, "stops.txt") is None
+    assert restarted.compile_all([AGENCY]) == 1
+    table = restarted.get_table(AGENCY, "stops.txt")
+    assert [values for _, values in table.iter_select()] == _csv_rows(cache.data_dir / AGENCY / "stops.txt")
+
+
+def test_loader_reads_the_same_rows_either_way(loader, cached_loader):
+    assert cached_loader.build_cache() == 8
+    for name in ("stops.txt", "stop_times.txt", "frequencies.txt"):
+        assert cached_loader.get_gtfs_data(AGENCY, name) == loader.get_gtfs_data(AGENCY, name)
+        assert cached_loader.columnar.get_table(AGENCY, name) is not None
+    query = {"filters": {"trip_id": ["T2", "T1"]}, "columns": ["stop_id", "trip_id"]}
+    assert cached_loader.get_gtfs_data(AGENCY, "stop_times.txt", **query) == \
+        loader.get_gtfs_data(AGENCY, "stop_times.txt", **query)
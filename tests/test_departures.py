@@ -0,0 +1,68 @@
+from datetime import date
+
+import pytest
+
+from conftest import AGENCY, FEED, write_feed
+from departures import active_service_ids, parse_gtfs_time
+
+TUESDAY = date(2025, 6, 3)
+
+
+def _times(departures):
+    return [(d["departure_time"], d["trip_id"]) for d in departures]
+
+
+@pytest.mark.parametrize("fixture", ["loader", "cached_loader"])
+def test_frequency_trip_departs_once_per_headway(request, fixture):
+    loader = request.getfixturevalue(fixture)
+    departures = loader.get_next_departures(AGENCY, "S2", TUESDAY, 7 * 3600, limit=4)
+    # F1's template reaches S2 five minutes after its first stop
+    assert _times(departures) == [("07:05:00", "F1"), ("07:07:00", "T1"), ("07:15:00", "F1"), ("07:20:00", "T2")]
+
+
+def test_frequency_window_end_is_exclusive(loader):
+    departures = loader.get_next_departures(AGENCY, "S1", TUESDAY, 8 * 3600 + 45 * 60, limit=5)
+    assert _times(departures) == [("08:50:00", "F1")]
+
+
+def test_stop_without_pickup_is_not_a_departure(loader):
+    departures = loader.get_next_departures(AGENCY, "S1", TUESDAY, 7 * 3600 + 60, limit=3)
+    assert "T1" not in [d["trip_id"] for d in departures]
+    assert _times(departures) == [("07:10:00", "F1"), ("07:15:00", "T2"), ("07:20:00", "F1")]
+
+
+@pytest.mark.parametrize("minute", [0, 1, 3, 11, 14])
+def test_next_departure_agrees_with_plan_trip(loader, minute):
+    seconds = 7 * 3600 + minute * 60
+    first = loader.get_next_departures(AGENCY, "S1", TUESDAY, seconds, limit=1)[0]
+    leg = loader.plan_trip(AGENCY, "S1", "S3", TUESDAY, seconds)["legs"][0]
+    assert (leg["departure_time"], leg["trip_id"]) == (first["departure_time"], first["trip_id"])
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("07:05:09", 25509), ("7:05:09", 25509), ("25:30:00", 91800), (" 06:00 ", 21600), ("23:59:59", 86399),
+    ("", None), (None, None), ("7h05", None), ("8:75", None), ("08:00:60", None), ("-1:00", None),
+    ("12:-5", None), ("+7:00", None), ("7:00:00:00", None), ("7", None), ("7: 05", None), ("٧:٠٥", None),
+])
+def test_parse_gtfs_time(value, seconds):
+    assert parse_gtfs_time(value) == seconds
+
+
+def test_calendar_dates_exceptions():
+    calendar = {"service_id": ["WK"], "tuesday": ["1"], "start_date": ["20250101"], "end_date": ["20251231"]}
+    calendar_dates = {"service_id": ["WK", "HOL"], "date": ["20250701", "20250701"], "exception_type": ["2", "1"]}
+    assert active_service_ids(calendar, calendar_dates, date(2025, 6, 3)) == {"WK"}
+    assert active_service_ids(calendar, calendar_dates, date(2025, 7, 1)) == {"HOL"}
+    assert active_service_ids(calendar, calendar_dates, date(2026, 6, 2)) == set()
+
+
+def test_after_midnight_trips_run_on_the_next_day(tmp_path):
+    from data_loader import GTFSDataLoader
+    files = dict(FEED, **{"stop_times.txt": FEED["stop_times.txt"] + [
+        ["T1", "24:40:00", "24:40:00", "S4", "4", "0", "0"],
+    ]})
+    loader = GTFSDataLoader(str(write_feed(tmp_path / "late", files)), str(tmp_path / "no-cache"))
+    # Tuesday's 24:40 is Wednesday 00:40
+    [departure] = loader.get_next_departures(AGENCY, "S4", date(2025, 6, 4), 30 * 60, limit=1)
+    assert (departure["trip_id"], departure["departure_time"]) == ("T1", "00:40:00")
+    assert (departure["scheduled_time"], departure["service_date"]) == ("24:40:00", "2025-06-03")
@@ -0,0 +1,96 @@
+import shutil
+
+import pytest
+
+import hot_reload
+from conftest import AGENCY, FEED, write_feed
+from hot_reload import diff_snapshots
+
+
+class Worker:
+    """One server process's view: its loader and the reloader that swaps it"""
+
+    def __init__(self, feed_dir, cache_dir):
+        from data_loader import GTFSDataLoader
+        self.loader = GTFSDataLoader(str(feed_dir), str(cache_dir))
+        self.reloader = hot_reload.FeedReloader(lambda: self.loader,
+                                                lambda: GTFSDataLoader(str(feed_dir), str(cache_dir)),
+                                                self._swap)
+
+    def _swap(self, loader):
+        self.loader = loader
+
+
+def _add_stop(feed_dir):
+    files = dict(FEED, **{"stops.txt": FEED["stops.txt"] + [["S5", "Fifth St", "45.040", "-75.000", ""]]})
+    write_feed(feed_dir, files)
+
+
+def _stop_ids(loader):
+    return set(loader.get_column_values(AGENCY, "stops.txt", ["stop_id"])["stop_id"])
+
+
+def test_diff_snapshots():
+    old = {"a": {"stops.txt": "1:10"}, "b": {"stops.txt": "1:10"}, "c": {"stops.txt": "1:10"}}
+    new = {"a": {"stops.txt": "1:10"}, "b": {"stops.txt": "2:12"}, "d": {"stops.txt": "1:10"}}
+    assert diff_snapshots(old, new) == {"added": ["d"], "removed": ["c"], "modified": ["b"]}
+    assert diff_snapshots(old, old) == {"added": [], "removed": [], "modified": []}
+
+
+def test_reload_swaps_in_added_modified_and_removed_agencies(feed_dir, tmp_path):
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    worker = Worker(feed_dir, cache)
+    before = worker.loader
+    assert worker.reloader.reload()["status"] == "unchanged" and worker.loader is before
+
+    write_feed(feed_dir, agency="lakeside")
+    _add_stop(feed_dir)
+    report = worker.reloader.reload()
+    assert (report["status"], report["added"], report["modified"]) == ("reloaded", ["lakeside"], [AGENCY])
+    assert worker.loader is not before and worker.reloader.status()["reloads"] == 1
+    assert "S5" in _stop_ids(worker.loader)
+    assert worker.loader.resolve_agency_id("lakeside") == "lakeside"
+
+    shutil.rmtree(feed_dir / "lakeside")
+    assert worker.reloader.reload()["removed"] == ["lakeside"]
+    assert not worker.loader.resolve_agency_id("lakeside")
+
+
+@pytest.fixture
+def workers(feed_dir, tmp_path):
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    pair = [Worker(feed_dir, cache), Worker(feed_dir, cache)]
+    for worker in pair:
+        worker.reloader.share(cache / "shared")
+    return pair
+
+
+def test_one_worker_leads(workers):
+    first, second = workers
+    assert first.reloader.generation.is_leader()
+    assert not second.reloader.generation.is_leader()
+    assert first.reloader.generation.is_leader()
+
+
+def test_other_workers_follow_a_published_reload(workers, feed_dir):
+    first, second = workers
+    _add_stop(feed_dir)
+    assert first.reloader.reload()["status"] == "reloaded"
+    assert first.reloader.status()["generation"] == 1
+    assert "S5" in _stop_ids(first.loader)
+
+    report = second.reloader.catch_up()
+    assert report["status"] == "reloaded" and report["modified"] == [AGENCY]
+    assert "S5" in _stop_ids(second.loader)
+    # Following doesn't publish again
+    assert second.reloader.generation.read() == 1
+    assert first.reloader.catch_up() is None
+    assert second.reloader.catch_up() is None
+
+
+def test_unchanged_feeds_are_not_published(workers):
+    first, second = workers
+    assert first.reloader.reload()["status"] == "unchanged"
+    assert second.reloader.catch_up() is None
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+from conftest import AGENCY
+
+
+@pytest.fixture
+def client(served):
+    import http_server
+    # Without the context manager the lifespan (warm-up, feed watcher) doesn't run
+    return TestClient(http_server.app)
+
+
+def _ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_query_stream_rows_then_meta(client):
+    response = client.post("/query/stream", json={"agency_id": AGENCY, "file_name": "stops", "limit": 3,
+                                                  "columns": ["stop_id"]})
+    assert response.status_code == 200
+    lines = _ndjson(response)
+    assert lines[:3] == [{"stop_id": "S1"}, {"stop_id": "S2"}, {"stop_id": "S3"}]
+    assert lines[3]["_meta"]["count"] == 3 and lines[3]["_meta"]["next_cursor"]
+
+
+@pytest.mark.parametrize("body", [
+    [], "x", 3, None,
+    {"file_name": "stops"},
+    {"agency_id": ["x"], "file_name": "stops"},
+    {"agency_id": AGENCY, "file_name": "stops", "limit": [1]},
+    {"agency_id": AGENCY, "file_name": "stops", "offset": "ten"},
+    {"agency_id": AGENCY, "file_name": "stops", "filters": ["stop_id", "S1"]},
+    {"agency_id": AGENCY, "file_name": "stops", "columns": "stop_id"},
+    {"agency_id": AGENCY, "file_name": "stops", "columns": ["stop_id", 2]},
+    {"agency_id": AGENCY, "file_name": "stops", "cursor": 7},
+    {"agency_id": AGENCY, "file_name": "stops", "columns": ["platform"]},
+])
+def test_query_stream_rejects_malformed_bodies(client, body):
+    response = client.post("/query/stream", content=json.dumps(body))
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_query_stream_invalid_json(client):
+    response = client.post("/query/stream", content=b"{not json")
+    assert response.status_code == 400
+
+
+def test_query_stream_unknown_file(client):
+    response = client.post("/query/stream", json={"agency_id": AGENCY, "file_name": "fare_rules"})
+    assert response.status_code == 404
+
+
+def _call(request_id, name, **arguments):
+    return {"jsonrpc": "2.0", "id": request_id, "method": "tools/call", "params": {"name": name, "arguments": arguments}}
+
+
+def test_batch_answers_in_request_order(client):
+    batch = [
+        _call(1, "query_data", agency_id=AGENCY, file_name="stops", limit=1),
+        {"jsonrpc": "2.0", "id": "two", "method": "tools/list"},
+        _call(3, "get_agency_files", agency_id="nowhere"),
+        _call(4, "no_such_tool"),
+        "not an object",
+    ]
+    response = client.post("/", json=batch)
+    assert response.status_code == 200
+    replies = response.json()
+    assert [reply.get("id") for reply in replies] == [1, "two", 3, 4, None]
+    assert json.loads(replies[0]["result"]["content"][0]["text"])["data"][0]["stop_id"] == "S1"
+    assert replies[1]["result"]["tools"]
+    assert replies[2]["result"]["isError"] is True
+    assert replies[3]["error"]["code"] == -32601 and replies[4]["error"]["code"] == -32600
+
+
+def test_notifications_in_a_batch_get_no_reply(client):
+    notification = {"jsonrpc": "2.0", "method": "notifications/initialized"}
+    response = client.post("/", json=[notification, {"jsonrpc": "2.0", "id": 7, "method": "tools/list"}])
+    assert [reply["id"] for reply in response.json()] == [7]
+    response = client.post("/", json=[notification, notification])
+    assert response.status_code == 202 and not response.content
+
+
+def test_empty_and_oversized_batches_are_rejected(client, monkeypatch):
+    import http_server
+    reply = client.post("/", json=[]).json()
+    assert reply["error"]["code"] == -32600 and reply["id"] is None
+    monkeypatch.setattr(http_server, "MAX_BATCH_SIZE", 2)
+    reply = client.post("/", json=[{"jsonrpc": "2.0", "id": n, "method": "tools/list"} for n in range(3)]).json()
+    assert reply["error"]["code"] == -32600 and "limited to 2" in reply["error"]["message"]
+    assert len(client.post("/", json=[{"jsonrpc": "2.0", "id": n, "method": "tools/list"} for n in range(2)]).json()) == 2
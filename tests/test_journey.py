@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+
+from conftest import AGENCY, FEED, write_feed
+
+TUESDAY = date(2025, 6, 3)
+SATURDAY = date(2025, 6, 7)
+
+# T3 shuttles S3 -> S4 at 07:13, so changing from F1 (at S3 07:10) beats riding T2 through
+FILES = dict(FEED, **{
+    "trips.txt": FEED["trips.txt"] + [["R2", "WK", "T3", "To Fourth", "0", "SH1"]],
+    "stop_times.txt": FEED["stop_times.txt"] + [
+        ["T3", "07:13:00", "07:13:00", "S3", "1", "0", "0"],
+        ["T3", "07:18:00", "07:18:00", "S4", "2", "0", "0"],
+    ],
+})
+
+
+@pytest.fixture(params=["loader", "cached_loader"])
+def planner(request, tmp_path):
+    from data_loader import GTFSDataLoader
+    write_feed(tmp_path / "transfers", FILES)
+    cache = tmp_path / "cache"
+    if request.param == "cached_loader":
+        cache.mkdir()
+    return GTFSDataLoader(str(tmp_path / "transfers"), str(cache))
+
+
+def _legs(journey):
+    return [(leg["trip_id"], leg["from"]["stop_id"], leg["to"]["stop_id"], leg["departure_time"], leg["arrival_time"])
+            for leg in journey["legs"]]
+
+
+def test_direct_trip(loader):
+    journey = loader.plan_trip(AGENCY, "S1", "S4", TUESDAY, 7 * 3600)
+    assert _legs(journey) == [("T2", "S1", "S4", "07:15:00", "07:30:00")]
+
+
+def test_transfer_reaches_earlier(planner):
+    journey = planner.plan_trip(AGENCY, "S1", "S4", TUESDAY, 7 * 3600)
+    assert _legs(journey) == [("F1", "S1", "S3", "07:00:00", "07:10:00"),
+                              ("T3", "S3", "S4", "07:13:00", "07:18:00")]
+
+
+def test_min_transfer_time_misses_the_connection(planner):
+    journey = planner.plan_trip(AGENCY, "S1", "S4", TUESDAY, 7 * 3600, min_transfer_s=5 * 60)
+    assert journey["arrival"] == 7 * 3600 + 30 * 60
+
+
+def test_frequency_runs_are_boarded(loader):
+    journey = loader.plan_trip(AGENCY, "S2", "S3", TUESDAY, 8 * 3600 + 46 * 60)
+    assert _legs(journey) == [("F1", "S2", "S3", "08:55:00", "09:00:00")]
+
+
+def test_arrive_by_and_inactive_service(loader):
+    assert loader.plan_trip(AGENCY, "S1", "S3", TUESDAY, 7 * 3600, arrive_by=7 * 3600 + 5 * 60)["legs"] is None
+    assert loader.plan_trip(AGENCY, "S1", "S3", SATURDAY, 7 * 3600)["legs"] is None
@@ -0,0 +1,109 @@
+import csv
+import io
+
+import pytest
+
+import pagination
+from conftest import AGENCY, FEED
+from pagination import SparseOffsetIndex, as_row, decode_cursor, encode_cursor
+from row_table import RowTable
+
+STOP_TIMES = [dict(zip(FEED["stop_times.txt"][0], row)) for row in FEED["stop_times.txt"][1:]]
+
+
+def _pages(loader, limit, **kwargs):
+    """Every page of stop_times.txt, following next_cursor"""
+    pages, cursor = [], None
+    while True:
+        page = loader.get_gtfs_page(AGENCY, "stop_times.txt", limit=limit, cursor=cursor, **kwargs)
+        pages.append(page["data"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(AGENCY, "stops.txt", "1:2", 2048, 91234)
+    assert decode_cursor(cursor) == {"a": AGENCY, "f": "stops.txt", "v": "1:2", "r": 2048, "o": 91234}
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", encode_cursor(AGENCY, "stops.txt", "1:2", -1, None), ""])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor)
+
+
+def test_as_row_matches_dict_reader():
+    assert as_row(["a", "b"], ["1"]) == {"a": "1", "b": None}
+    assert as_row(["a"], ["1", "2", "3"]) == {"a": "1", None: ["2", "3"]}
+
+
+def test_row_table_matches_dict_reader():
+    fields = ["trip_id", "arrival_time", "stop_sequence", "stop_headsign"]
+    text = ("trip_id,arrival_time,stop_sequence,stop_headsign\n"
+            "T1,07:05:00,1,\n"          # '' stays '' rather than None
+            "T1,25:10:00,007,Nord\n"     # text that isn't canonical comes back as written
+            "T1,7:15:00\n"               # missing trailing columns read as None
+            "T2,07:05:60,2,Sud,extra,more\n")
+    records = list(csv.reader(io.StringIO(text)))[1:]
+    table = RowTable(fields).extend(records)
+    expected = list(csv.DictReader(io.StringIO(text)))
+    assert table.dicts() == expected and table.dicts(1, 3) == expected[1:3]
+    assert table.values(2, 3) == [["T1", "7:15:00", None, None]]
+    assert table.first_long_row == 3 and table.rows[0][1] == 7 * 3600 + 5 * 60
+
+
+def test_row_table_holds_projected_rows(loader):
+    stream = loader.open_rows(AGENCY, "stop_times.txt", columns=["stop_id", "pickup_type", "trip_id"])
+    table = RowTable(stream.fields).extend(stream.records())
+    assert table.dicts() == list(loader.open_rows(AGENCY, "stop_times.txt",
+                                                  columns=["stop_id", "pickup_type", "trip_id"]))
+    assert table.fields == ("stop_id", "pickup_type", "trip_id")
+
+
+def test_sparse_offsets_seek_to_checkpoints(feed_dir, monkeypatch):
+    monkeypatch.setattr(pagination, "STRIDE", 4)
+    path = feed_dir / AGENCY / "stop_times.txt"
+    index = SparseOffsetIndex(path)
+    assert index.num_rows == len(STOP_TIMES) and len(index.offsets) == 3
+    row, offset = index.seek_point(9)
+    assert row == 8
+    with open(path, "rb") as f:
+        f.seek(offset)
+        assert f.readline().startswith(b"T2,07:25:00,07:25:00,S3")
+
+
+@pytest.mark.parametrize("fixture", ["loader", "cached_loader"])
+def test_cursor_pages_cover_the_file_once(request, fixture):
+    pages = _pages(request.getfixturevalue(fixture), limit=3)
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert [row for page in pages for row in page] == STOP_TIMES
+
+
+def test_offset_pages_seek_from_checkpoints(loader, monkeypatch):
+    monkeypatch.setattr(pagination, "STRIDE", 4)
+    rows = loader.get_gtfs_page(AGENCY, "stop_times.txt", limit=3, offset=5)["data"]
+    assert rows == STOP_TIMES[5:8]
+
+
+def test_filtered_pages(cached_loader):
+    pages = _pages(cached_loader, limit=2, filters={"stop_id": ["S2"]})
+    assert [row["trip_id"] for page in pages for row in page] == ["F1", "T1", "T2"]
+
+
+def _first_cursor(loader):
+    return loader.get_gtfs_page(AGENCY, "stop_times.txt", limit=3)["next_cursor"]
+
+
+def test_cursor_rejected_after_file_changes(loader, feed_dir):
+    cursor = _first_cursor(loader)
+    with open(feed_dir / AGENCY / "stop_times.txt", "a", encoding="utf-8") as f:
+        f.write("T2,07:35:00,07:35:00,S1,5,0,0\n")
+    with pytest.raises(ValueError, match="changed"):
+        loader.get_gtfs_page(AGENCY, "stop_times.txt", limit=3, cursor=cursor)
+
+
+def test_cursor_rejected_for_another_file(loader):
+    cursor = _first_cursor(loader)
+    with pytest.raises(ValueError, match="belongs to"):
+        loader.get_gtfs_page(AGENCY, "stops.txt", limit=3, cursor=cursor)
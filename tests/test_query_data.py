@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import json_codec
+from conftest import AGENCY, FEED, write_feed
+
+# Enough rows that a 4 KB budget cuts the page
+STOP_TIMES = FEED["stop_times.txt"][:1] + [
+    [f"L{n // 20}", f"{6 + n // 60:02d}:{n % 60:02d}:00", f"{6 + n // 60:02d}:{n % 60:02d}:00", f"S{n % 4 + 1}",
+     str(n % 20 + 1), "0", "0"]
+    for n in range(300)
+]
+
+
+@pytest.fixture
+def long_feed(served, tmp_path, monkeypatch):
+    from data_loader import GTFSDataLoader
+    write_feed(tmp_path / "long", dict(FEED, **{"stop_times.txt": STOP_TIMES}))
+    monkeypatch.setattr(served, "data_loader", GTFSDataLoader(str(tmp_path / "long"), str(tmp_path / "no-cache")))
+    return served
+
+
+def _query(engine, **args):
+    result = engine.call_tool("query_data", dict({"agency_id": AGENCY}, **args))
+    return json.loads(result["content"][0]["text"])
+
+
+def _rows(payload, output_format):
+    """A query_data payload back as a list of dicts"""
+    if output_format in ("records", "minified"):
+        return payload["data"]
+    if output_format == "columnar":
+        return [dict(zip(payload["fields"], row)) for row in payload["rows"]]
+    return [dict(zip(payload["fields"], values)) for values in zip(*payload["arrays"])]
+
+
+@pytest.mark.parametrize("output_format", ["records", "minified", "columnar", "column_arrays"])
+@pytest.mark.parametrize("args", [
+    {"file_name": "stop_times"},
+    {"file_name": "stop_times", "filters": {"trip_id": "T2"}, "columns": ["stop_id", "departure_time"]},
+    {"file_name": "stops", "limit": 2, "offset": 1},
+])
+def test_formats_hold_the_same_rows(served, output_format, args):
+    expected = _query(served, **args)["data"]
+    payload = _query(served, format=output_format, **args)
+    assert _rows(payload, output_format) == expected
+    assert payload["count"] == len(expected) and payload["format"] == output_format
+
+
+@pytest.mark.parametrize("output_format", ["records", "minified", "columnar", "column_arrays"])
+def test_max_bytes_truncates_with_a_resumable_cursor(long_feed, output_format):
+    everything = _query(long_feed, file_name="stop_times")["data"]
+    assert len(everything) == len(STOP_TIMES) - 1
+    rows, cursor, pages = [], None, 0
+    while True:
+        result = long_feed.call_tool("query_data", {"agency_id": AGENCY, "file_name": "stop_times",
+                                                    "format": output_format, "max_bytes": 4096, "cursor": cursor})
+        text = result["content"][0]["text"]
+        assert len(text.encode("utf-8")) <= 4096
+        payload = json.loads(text)
+        rows += _rows(payload, output_format)
+        pages += 1
+        cursor = payload["next_cursor"]
+        if not cursor:
+            assert not payload["truncated"]
+            break
+        assert payload["truncated"] and payload["count"]
+    assert pages > 2 and rows == everything
+
+
+@pytest.mark.skipif(json_codec.orjson is None, reason="orjson is not installed")
+@pytest.mark.parametrize("indent", [False, True])
+@pytest.mark.parametrize("value", [
+    {"data": [{"stop_id": "S1", "stop_name": "Côte-des-Neiges", "n": 3, "x": 1.5, "b": None, "t": True}]},
+    {"fields": ["a", "b"], "rows": [["1", ""], ["2", None]], "nested": {"deep": [[], {}]}},
+    {"data": [{"a": "1", None: ["extra", "values"]}]},
+    {"big": 2 ** 70, "quote": "say \"hi\"\n\ttab  "},
+])
+def test_orjson_and_stdlib_encode_alike(monkeypatch, value, indent):
+    fast = json_codec.dumps_bytes(value, indent)
+    monkeypatch.setattr(json_codec, "orjson", None)
+    slow = json_codec.dumps_bytes(value, indent)
+    assert fast == slow
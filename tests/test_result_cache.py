@@ -0,0 +1,37 @@
+import json
+
+from conftest import AGENCY
+from result_cache import ResultCache
+
+
+def test_lru_eviction_by_bytes():
+    cache = ResultCache(10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.put("c", b"123")
+    assert cache.get("b") is None and cache.get("a") and cache.get("c")
+    cache.put("huge", b"x" * 11)
+    assert cache.get("huge") is None and cache.stats()["evictions"] == 1
+
+
+def test_results_are_cached_and_errors_are_not(served):
+    args = {"agency_id": AGENCY, "file_name": "stops", "limit": 2}
+    encoded, is_error = served.call_tool_encoded("query_data", args)
+    assert not is_error and json.loads(encoded)["content"][0]["text"]
+    assert served.call_tool_encoded("query_data", dict(args)) == (encoded, False)
+    assert served.result_cache.stats()["hits"] == 1
+
+    bad = dict(args, columns=["platform"])
+    encoded, is_error = served.call_tool_encoded("query_data", bad)
+    assert is_error and json.loads(encoded)["isError"] is True
+    assert "error" in json.loads(json.loads(encoded)["content"][0]["text"])
+    served.call_tool_encoded("query_data", bad)
+    assert served.result_cache.stats()["entries"] == 1
+
+
+def test_error_flag_follows_the_tool_result(served):
+    _, is_error = served.call_tool_encoded("list_agencies", {})
+    assert not is_error
+    _, is_error = served.call_tool_encoded("get_agency_files", {"agency_id": "nowhere"})
+    assert is_error
@@ -0,0 +1,76 @@
+import pytest
+
+from conftest import AGENCY, FEED
+from search_index import SearchIndex, acronym, edit_distance, normalize, trigrams
+
+
+def _columns(rows):
+    return {name: [row[i] for row in rows[1:]] for i, name in enumerate(rows[0])}
+
+
+@pytest.fixture
+def index():
+    # The conftest feed's agency, routes and stops, plus stops sharing a prefix or a near spelling
+    stops = FEED["stops.txt"] + [["B1", "Bloor", "", "", ""], ["B2", "Bloordale", "", "", ""],
+                                 ["B3", "Bloer", "", "", ""], ["B4", "Bloor", "", "", ""],
+                                 ["K1", "Kipling", "", "", ""], ["K2", "Kiplinger", "", "", ""]]
+    index = SearchIndex()
+    index.add_agency(AGENCY, dict(zip(*FEED["agency.txt"])), [acronym("Metro Transit")])
+    index.add_routes(AGENCY, _columns(FEED["routes.txt"]))
+    index.add_stops(AGENCY, _columns(stops))
+    index.freeze()
+    return index
+
+
+def _names(results):
+    return [result["name"] for result in results]
+
+
+def test_edit_distance_gives_up_past_the_cap():
+    assert edit_distance("second", "second", 1) == 0
+    assert edit_distance("secnd", "second", 1) == 1
+    assert edit_distance("thrid", "third", 2) == 2
+    assert edit_distance("thrid", "third", 1) == 2
+    assert edit_distance("st", "street", 2) == 3
+
+
+def test_normalize_and_trigrams():
+    assert normalize("Côte-des-Neiges / St-Laurent") == "cote des neiges st laurent"
+    assert trigrams("st") == {"$st", "st$"}
+    assert acronym("Société de transport de Montréal") == "stm"
+
+
+def test_exact_then_prefix_then_near_spelling(index):
+    results = index.search("bloor", kinds={"stop"})
+    assert _names(results) == ["Bloor", "Bloordale", "Bloer"]
+    assert [result["score"] for result in results] == [1.0, 0.9, 0.85]
+    # Platforms sharing a name are one document
+    assert results[0]["stop_ids"] == ["B1", "B4"]
+
+
+def test_typos_within_the_edit_distance_cap(index):
+    assert _names(index.search("secnd st", kinds={"stop"}))[0] == "Second St"
+    assert _names(index.search("forth", kinds={"stop"}))[0] == "Fourth St"
+    # Three letters allow no edits, so "blr" matches nothing by spelling
+    assert index.search("blr") == []
+
+
+def test_trigram_overlap_ranks_beyond_the_edit_cap(index):
+    # Too many edits away from either name; the share of trigrams in common decides the order
+    results = index.search("kiplingstation", kinds={"stop"})
+    assert _names(results) == ["Kipling", "Kiplinger"]
+    assert 0.45 <= results[1]["score"] < results[0]["score"] < 0.85
+
+
+def test_shorter_names_rank_first_on_equal_score(index):
+    results = index.search("main", kinds={"route"})
+    assert _names(results) == ["2 - Main Local", "1 - Main Frequent"]
+    assert {result["score"] for result in results} == {1.0}
+
+
+def test_kinds_and_agency_filters(index):
+    assert [result["kind"] for result in index.search("metro transit")][:1] == ["agency"]
+    assert index.search("mt", kinds={"agency"})[0]["id"] == AGENCY
+    assert index.search("first", kinds={"route"}) == []
+    assert index.search("first", agency="elsewhere") == []
+    assert index.agency_substring_matches("metro.example") == [AGENCY]
@@ -0,0 +1,37 @@
+from datetime import date
+
+import pytest
+
+from conftest import AGENCY
+
+TUESDAY = date(2025, 6, 3)
+
+
+def _summary(loader, route_id):
+    [summary] = loader.get_route_service_summary(AGENCY, route_id, day=TUESDAY)["summaries"]
+    return summary
+
+
+@pytest.mark.parametrize("fixture", ["loader", "cached_loader"])
+def test_frequency_trip_counts_every_run(request, fixture):
+    summary = _summary(request.getfixturevalue(fixture), "R1")
+    # F1 starts every 10 minutes from 06:00 until (not at) 09:00
+    assert summary["trips"] == 18
+    assert (summary["first_departure"], summary["last_departure"]) == ("06:00:00", "08:50:00")
+    assert summary["trips_per_hour"] == {"06": 6, "07": 6, "08": 6}
+    assert summary["headway_minutes"] == {"median": 10.0, "min": 10.0, "max": 10.0}
+
+
+def test_timed_trips_count_once(loader):
+    summary = _summary(loader, "R2")
+    assert summary["trips"] == 2
+    assert summary["headway_minutes"]["median"] == 13.0
+
+
+def test_persisted_summary_rebuilt_when_frequencies_change(cached_loader, feed_dir, tmp_path):
+    from data_loader import GTFSDataLoader
+    assert _summary(cached_loader, "R1")["trips"] == 18
+    path = feed_dir / AGENCY / "frequencies.txt"
+    path.write_text("trip_id,start_time,end_time,headway_secs\nF1,06:00:00,07:00:00,1200\n", encoding="utf-8")
+    restarted = GTFSDataLoader(str(feed_dir), str(tmp_path / "cache"))
+    assert _summary(restarted, "R1")["trips"] == 3
@@ -0,0 +1,68 @@
+import math
+
+import pytest
+
+from conftest import AGENCY, FEED
+from spatial_index import CELL_DEG, EARTH_RADIUS_M, StopSpatialIndex
+
+
+def _stops(rows):
+    return [dict(zip(rows[0], row)) for row in rows[1:]]
+
+
+def _index(*agencies):
+    index = StopSpatialIndex()
+    for agency, rows in agencies:
+        index.add_agency(agency, _stops(rows))
+    index.freeze()
+    return index
+
+
+@pytest.fixture
+def index():
+    return _index((AGENCY, FEED["stops.txt"]))
+
+
+def _ids(stops):
+    return [stop["stop_id"] for stop in stops]
+
+
+def test_radius_is_inclusive_across_cells(index):
+    # Stops are 0.01 degrees (one cell) apart due north; a radius of exactly that reaches the next stop
+    spacing = math.radians(0.01) * EARTH_RADIUS_M
+    assert _ids(index.near(45.000, -75.000, spacing - 0.01)) == ["S1"]
+    near = index.near(45.000, -75.000, spacing + 1e-6)
+    assert _ids(near) == ["S1", "S2"] and [stop["distance_m"] for stop in near] == [0.0, round(spacing, 1)]
+    # From the middle of a cell boundary both neighbours are equally far
+    assert _ids(index.near(45.015, -75.000, 560)) == ["S2", "S3"]
+
+
+def test_nearest_first_and_limit(index):
+    assert _ids(index.near(45.029, -75.000, 5000)) == ["S4", "S3", "S2", "S1"]
+    assert _ids(index.near(45.029, -75.000, 5000, limit=2)) == ["S4", "S3"]
+    assert index.near(45.029, -75.000, 5000, agency="elsewhere") == []
+
+
+def test_bbox_edges_are_inclusive(index):
+    assert _ids(index.in_bbox(45.010, -75.000, 45.020, -75.000)["stops"]) == ["S2", "S3"]
+    assert index.in_bbox(45.010 + 1e-9, -75.000, 45.020 - 1e-9, -75.000)["total"] == 0
+    # Box corners exactly on cell boundaries
+    box = index.in_bbox(45.000, -75.000 - CELL_DEG, 45.000 + 3 * CELL_DEG, -75.000 + CELL_DEG, limit=1)
+    assert box["total"] == 4 and _ids(box["stops"]) == ["S1"]
+
+
+def test_radius_across_the_antimeridian():
+    index = _index(("date_line", [["stop_id", "stop_lat", "stop_lon"],
+                                  ["E", "-16.5", "179.999"], ["W", "-16.5", "-179.999"], ["F", "-16.5", "179.9"]]))
+    assert _ids(index.near(-16.5, 179.999, 500)) == ["E", "W"]
+    assert _ids(index.near(-16.5, -179.999, 500)) == ["W", "E"]
+    assert sorted(_ids(index.near(-16.5, -180.0, 20000))) == ["E", "F", "W"]
+
+
+def test_radius_over_a_pole():
+    index = _index(("arctic", [["stop_id", "stop_lat", "stop_lon"],
+                               ["A", "89.999", "0"], ["B", "89.999", "180"], ["C", "89.999", "-90"], ["D", "89.99", "0"]]))
+    # Every stop at 89.999 is within ~160 m of the others, whatever its longitude
+    assert sorted(_ids(index.near(89.999, 0, 250))) == ["A", "B", "C"]
+    assert sorted(_ids(index.near(90, 45, 1200))) == ["A", "B", "C", "D"]
+    assert index.in_bbox(89.99, -180, 90, 180)["total"] == 4
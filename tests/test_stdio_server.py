@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from conftest import AGENCY
+
+SERVER = Path(__file__).resolve().parent.parent / "statcan_transit_mcp" / "server.py"
+
+
+def test_stdout_carries_only_json_rpc(feed_dir, tmp_path):
+    messages = [
+        {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}},
+        {"jsonrpc": "2.0", "method": "notifications/initialized"},
+        {"jsonrpc": "2.0", "id": 2, "method": "tools/list"},
+        {"jsonrpc": "2.0", "id": 3, "method": "tools/call",
+         "params": {"name": "query_data", "arguments": {"agency_id": AGENCY, "file_name": "stops", "limit": 2}}},
+    ]
+    env = dict(os.environ, MCP_DATA_SOURCE=str(feed_dir), MCP_CACHE_DIR=str(tmp_path / "cache"),
+               MCP_AGGREGATE_PROCESSES="1")
+    done = subprocess.run([sys.executable, str(SERVER)], input="".join(json.dumps(m) + "\n" for m in messages),
+                          capture_output=True, text=True, env=env, timeout=60)
+    assert done.returncode == 0, done.stderr
+    replies = [json.loads(line) for line in done.stdout.splitlines()]
+    assert all(reply["jsonrpc"] == "2.0" for reply in replies)
+    by_id = {reply["id"]: reply for reply in replies}
+    assert sorted(by_id) == [1, 2, 3]
+    assert by_id[1]["result"]["serverInfo"]["name"]
+    assert {tool["name"] for tool in by_id[2]["result"]["tools"]} >= {"query_data", "plan_trip"}
+    rows = json.loads(by_id[3]["result"]["content"][0]["text"])["data"]
+    assert [row["stop_id"] for row in rows] == ["S1", "S2"]
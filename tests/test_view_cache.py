@@ -0,0 +1,54 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from view_cache import AgencyViewCache
+
+
+def test_other_agencies_build_while_one_is_building(tmp_path):
+    cache = AgencyViewCache(str(tmp_path), "views", 1)
+    release = threading.Event()
+
+    def slow_build():
+        assert release.wait(5)
+        return {"agency": "slow"}
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        slow = pool.submit(cache.get, "slow", "sig", slow_build)
+        # Doesn't wait behind the slow build
+        assert cache.get("fast", "sig", lambda: {"agency": "fast"}) == {"agency": "fast"}
+        release.set()
+        assert slow.result(5) == {"agency": "slow"}
+
+
+def test_same_agency_and_signature_builds_once(tmp_path):
+    cache = AgencyViewCache(str(tmp_path), "views", 1)
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        assert release.wait(5)
+        return {"n": len(builds)}
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(cache.get, "a", "sig", build) for _ in range(4)]
+        while not builds:
+            release.wait(0.01)
+        release.set()
+        assert [f.result(5) for f in futures] == [{"n": 1}] * 4
+    assert builds == [1]
+    # Persisted: a new cache (restart) loads instead of building
+    assert AgencyViewCache(str(tmp_path), "views", 1).get("a", "sig", lambda: pytest.fail("rebuilt")) == {"n": 1}
+
+
+def test_failed_build_is_retried(tmp_path):
+    cache = AgencyViewCache(str(tmp_path), "views", 1)
+
+    def broken():
+        raise ValueError("bad feed")
+
+    with pytest.raises(ValueError):
+        cache.get("a", "sig", broken)
+    assert cache.get("a", "sig", lambda: {"ok": True}) == {"ok": True}